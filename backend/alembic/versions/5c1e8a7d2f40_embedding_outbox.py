@@ -0,0 +1,47 @@
+"""embedding outbox
+
+Revision ID: 5c1e8a7d2f40
+Revises: 011f356a299b
+Create Date: 2026-10-17 10:12:41.318902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c1e8a7d2f40'
+down_revision: Union[str, Sequence[str], None] = '011f356a299b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('embedding_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('message_id', sa.Integer(), nullable=False),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_embedding_outbox_id'), 'embedding_outbox', ['id'], unique=False)
+    op.create_index(op.f('ix_embedding_outbox_next_attempt_at'), 'embedding_outbox', ['next_attempt_at'], unique=False)
+
+    # Enqueue messages that were never indexed before the outbox existed.
+    op.execute(
+        "INSERT INTO embedding_outbox (message_id) "
+        "SELECT id FROM messages WHERE pinecone_id IS NULL AND role = 'user'"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_embedding_outbox_next_attempt_at'), table_name='embedding_outbox')
+    op.drop_index(op.f('ix_embedding_outbox_id'), table_name='embedding_outbox')
+    op.drop_table('embedding_outbox')
@@ -0,0 +1,30 @@
+"""history keyset indexes
+
+Revision ID: 8d3f1b6a9c27
+Revises: 5c1e8a7d2f40
+Create Date: 2026-10-17 14:03:27.551044
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d3f1b6a9c27'
+down_revision: Union[str, Sequence[str], None] = '5c1e8a7d2f40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_conversations_user_created_id', 'conversations', ['user_id', 'created_at', 'id'], unique=False)
+    op.create_index('ix_messages_conversation_created_id', 'messages', ['conversation_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_conversation_created_id', table_name='messages')
+    op.drop_index('ix_conversations_user_created_id', table_name='conversations')
\ No newline at end of file
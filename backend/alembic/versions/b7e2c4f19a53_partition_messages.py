@@ -0,0 +1,119 @@
+"""partition messages by created_at
+
+Revision ID: b7e2c4f19a53
+Revises: 8d3f1b6a9c27
+Create Date: 2026-10-17 16:41:09.204377
+
+"""
+from datetime import date, datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e2c4f19a53'
+down_revision: Union[str, Sequence[str], None] = '8d3f1b6a9c27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Monthly partitions created ahead of time; `manage.py partitions` keeps this going.
+PARTITIONS_AHEAD = 3
+
+COLUMNS = "id, conversation_id, user_id, role, text, pinecone_id, created_at"
+
+
+def _add_months(month: date, n: int) -> date:
+    total = month.year * 12 + month.month - 1 + n
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def _create_month_partition(month: date) -> None:
+    # UTC months, with explicit offsets so the session time zone does not apply
+    op.execute(
+        f"CREATE TABLE messages_p{month:%Y_%m} PARTITION OF messages "
+        f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') TO ('{_add_months(month, 1).isoformat()} 00:00:00+00')"
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    # A partitioned table's primary key must include the partition key, so
+    # (id) is no longer unique on its own and cannot be a foreign key target.
+    op.drop_constraint('embedding_outbox_message_id_fkey', 'embedding_outbox', type_='foreignkey')
+
+    op.drop_index('ix_messages_conversation_created_id', table_name='messages')
+    op.drop_index(op.f('ix_messages_id'), table_name='messages')
+    op.execute("ALTER TABLE messages RENAME TO messages_legacy")
+    op.execute("ALTER TABLE messages_legacy RENAME CONSTRAINT messages_pkey TO messages_legacy_pkey")
+
+    op.execute(
+        """
+        CREATE TABLE messages (
+            id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+            conversation_id INTEGER NOT NULL REFERENCES conversations (id),
+            user_id VARCHAR(8) REFERENCES users (id),
+            role VARCHAR(20) NOT NULL,
+            text TEXT NOT NULL,
+            pinecone_id VARCHAR(128),
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            CONSTRAINT messages_pkey PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    # keep the sequence alive when the legacy table is dropped
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    op.create_index(op.f('ix_messages_id'), 'messages', ['id'], unique=False)
+    op.create_index('ix_messages_conversation_created_id', 'messages', ['conversation_id', 'created_at', 'id'], unique=False)
+
+    first = bind.execute(sa.text("SELECT min(created_at) FROM messages_legacy")).scalar()
+    this_month = datetime.now(timezone.utc).date().replace(day=1)
+    month = first.astimezone(timezone.utc).date().replace(day=1) if first else this_month
+    while month <= _add_months(this_month, PARTITIONS_AHEAD):
+        _create_month_partition(month)
+        month = _add_months(month, 1)
+    op.execute("CREATE TABLE messages_default PARTITION OF messages DEFAULT")
+
+    op.execute(
+        f"INSERT INTO messages ({COLUMNS}) "
+        "SELECT id, conversation_id, user_id, role, text, pinecone_id, COALESCE(created_at, now()) "
+        "FROM messages_legacy"
+    )
+    op.execute("DROP TABLE messages_legacy")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    op.execute("ALTER TABLE messages RENAME TO messages_partitioned")
+    op.execute("ALTER TABLE messages_partitioned RENAME CONSTRAINT messages_pkey TO messages_partitioned_pkey")
+    op.drop_index('ix_messages_conversation_created_id', table_name='messages_partitioned')
+    op.drop_index(op.f('ix_messages_id'), table_name='messages_partitioned')
+    op.create_table('messages',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('messages_id_seq')"), nullable=False),
+    sa.Column('conversation_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.String(length=8), nullable=True),
+    sa.Column('role', sa.String(length=20), nullable=False),
+    sa.Column('text', sa.Text(), nullable=False),
+    sa.Column('pinecone_id', sa.String(length=128), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    op.create_index(op.f('ix_messages_id'), 'messages', ['id'], unique=False)
+    op.create_index('ix_messages_conversation_created_id', 'messages', ['conversation_id', 'created_at', 'id'], unique=False)
+    op.execute(f"INSERT INTO messages ({COLUMNS}) SELECT {COLUMNS} FROM messages_partitioned")
+    op.execute("DROP TABLE messages_partitioned CASCADE")
+
+    op.execute("DELETE FROM embedding_outbox WHERE message_id NOT IN (SELECT id FROM messages)")
+    op.create_foreign_key('embedding_outbox_message_id_fkey', 'embedding_outbox', 'messages', ['message_id'], ['id'], ondelete='CASCADE')
\ No newline at end of file
@@ -0,0 +1,152 @@
+"""
+Local stand-ins for the upstream services used by the review pipeline, so the
+benchmarks in this folder can run on a laptop without network access.
+
+- an OpenAI-compatible HTTP server (embeddings + chat completions) with
+  configurable latency, served by uvicorn on a background thread
+- a fake Pinecone client, installed before `src.services.rag` is imported
+- a throwaway SQLite database (needs `aiosqlite`)
+"""
+import asyncio
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_upstream_app(embed_latency: float, chat_latency: float, dimension: int = 1536) -> FastAPI:
+    upstream = FastAPI()
+
+    @upstream.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await asyncio.sleep(embed_latency)
+        return {
+            "object": "list",
+            "model": body.get("model"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": [((len(text) + i) % 7) / 7.0 + 0.01] * dimension}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": 1, "total_tokens": 1},
+        }
+
+    @upstream.post("/v1/chat/completions")
+    async def chat(request: Request):
+        body = await request.json()
+        await asyncio.sleep(chat_latency)
+        return {
+            "id": "stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "Looks good."},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 3, "total_tokens": 13},
+        }
+
+    # SendGrid v3 stand-in for the email worker; accepted requests are kept
+    # on upstream.state.mail
+    upstream.state.mail = []
+
+    @upstream.post("/v3/mail/send")
+    async def mail_send(request: Request):
+        upstream.state.mail.append(await request.json())
+        return Response(status_code=202)
+
+    return upstream
+
+
+def start_upstream(embed_latency: float, chat_latency: float) -> str:
+    """
+    Serve the stub upstream on a background thread and return its base URL.
+    """
+    port = _free_port()
+    config = uvicorn.Config(make_upstream_app(embed_latency, chat_latency), host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}/v1"
+
+
+class _FakeIndex:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def upsert(self, vectors, **kwargs):
+        time.sleep(self.latency)
+
+    def query(self, **kwargs):
+        time.sleep(self.latency)
+        return {"matches": []}
+
+
+def install_fake_pinecone(latency: float = 0.01, dimension: int = 1536):
+    """
+    Replace the `pinecone` module with an in-memory fake. Must run before
+    anything under `src.services` is imported.
+    """
+    class _Indexes(list):
+        def names(self):
+            return list(self)
+
+    class Pinecone:
+        def __init__(self, api_key=None, **kwargs):
+            pass
+
+        def list_indexes(self):
+            return _Indexes(["code-review-index"])
+
+        def describe_index(self, name):
+            return types.SimpleNamespace(dimension=dimension)
+
+        def Index(self, name=None, **kwargs):
+            return _FakeIndex(latency)
+
+    module = types.ModuleType("pinecone")
+    module.Pinecone = Pinecone
+    sys.modules["pinecone"] = module
+
+
+def configure_env(base_url: str):
+    db_path = os.path.join(tempfile.mkdtemp(prefix="kaiflow-bench-"), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{db_path}"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["LLM_BASE_URL"] = base_url
+    os.environ["EMAIL_API_URL"] = base_url.removesuffix("/v1")
+    os.environ.setdefault("EMAIL_WORKER_IN_PROCESS", "false")
+    os.environ["HF_TOKEN"] = "bench"
+    os.environ.setdefault("FRONTEND_URL", "http://localhost:3000")
+    os.environ.setdefault("JWT_SECRET_KEY", "bench")
+    os.environ.setdefault("REDIS_URL", "redis://127.0.0.1:6379/0")
+    # per-request client logs and "Redis unavailable" fallbacks drown the results
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("src.lib.helpers").setLevel(logging.ERROR)
+
+
+async def create_tables():
+    from src.db import engine, Base
+    from src.models import db_models  # noqa: F401
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
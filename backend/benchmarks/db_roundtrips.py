@@ -0,0 +1,86 @@
+"""
+Count database round-trips per stored review message.
+
+Compares the persistence step of store_message_with_embedding before and
+after it moved to a single transaction: the legacy flow (commit conversation,
+refresh, commit message, refresh, then a second session to re-fetch the row
+and commit pinecone_id) against rag.insert_message. The embedding and vector
+upsert are not part of either count.
+
+Each statement, BEGIN and COMMIT is counted as one round-trip, which is what
+they cost with asyncpg against Postgres. Runs on a throwaway SQLite database.
+
+Usage (from backend/):
+    python -m benchmarks.db_roundtrips --messages 200
+"""
+import argparse
+import asyncio
+import time
+
+from ._stubs import configure_env, create_tables
+
+
+async def _legacy_store(text: str):
+    from src.db import AsyncSessionLocal
+    from src.models.db_models import Message, Conversation
+
+    async with AsyncSessionLocal() as session:
+        conv = Conversation(user_id=None, title=None)
+        session.add(conv)
+        await session.commit()
+        await session.refresh(conv)
+
+        msg = Message(conversation_id=conv.id, user_id=None, role="user", text=text)
+        session.add(msg)
+        await session.commit()
+        await session.refresh(msg)
+
+    async with AsyncSessionLocal() as session:
+        db_msg = await session.get(Message, msg.id)
+        db_msg.pinecone_id = f"msg:{msg.id}"
+        session.add(db_msg)
+        await session.commit()
+
+
+async def _run(messages: int):
+    from sqlalchemy import event
+    from src.db import engine
+    from src.services.rag import insert_message
+
+    await create_tables()
+
+    counts = {"round_trips": 0}
+
+    def _count(*args, **kwargs):
+        counts["round_trips"] += 1
+
+    for name in ("before_cursor_execute", "begin", "commit"):
+        event.listen(engine.sync_engine, name, _count)
+
+    async def measure(label, store):
+        counts["round_trips"] = 0
+        start = time.perf_counter()
+        for i in range(messages):
+            await store(f"def f{i}(): pass")
+        elapsed = time.perf_counter() - start
+        per_request = counts["round_trips"] / messages
+        print(f"{label:<18} {per_request:5.1f} round-trips/request  {elapsed / messages * 1000:7.2f} ms/request")
+        return per_request
+
+    before = await measure("before (legacy)", _legacy_store)
+    after = await measure("after (1 txn)", lambda text: insert_message(text))
+    print(f"saved {before - after:.1f} round-trips per request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+
+    # no upstream calls are made; the URL only satisfies client construction
+    configure_env("http://127.0.0.1:9/v1")
+    asyncio.run(_run(args.messages))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Login throughput and event-loop stall on a single worker.
+
+Runs a burst of concurrent logins (one simulated user lookup plus a bcrypt
+verify each) on one event loop, first verifying inline as the handlers used
+to, then through the bounded bcrypt pool. A 10 ms ticker stands in for the
+review traffic sharing the worker: its lateness is how long the loop stayed
+blocked. Logins rejected by the queue limit (503s) are counted separately.
+
+Usage (from backend/):
+    python -m benchmarks.login_throughput --logins 40
+    BCRYPT_WORKERS=4 python -m benchmarks.login_throughput --logins 200
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from ._stubs import configure_env
+
+TICK = 0.01
+
+
+async def _burst(logins: int, verify, lookup_latency: float) -> dict:
+    from src.lib.helpers import PasswordHasherBusy, hash_password
+
+    hashed = hash_password("Correct-horse-1!")
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - start - TICK)
+
+    async def login() -> float | None:
+        start = time.perf_counter()
+        await asyncio.sleep(lookup_latency)
+        try:
+            ok = await verify("Correct-horse-1!", hashed)
+        except PasswordHasherBusy:
+            return None
+        assert ok
+        return time.perf_counter() - start
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(TICK * 2)
+    start = time.perf_counter()
+    results = await asyncio.gather(*(login() for _ in range(logins)))
+    wall = time.perf_counter() - start
+    done.set()
+    await tick
+
+    latencies = sorted(r for r in results if r is not None)
+    return {
+        "wall": wall,
+        "ok": len(latencies),
+        "rejected": logins - len(latencies),
+        "p50": statistics.median(latencies) if latencies else 0.0,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] if latencies else 0.0,
+        "lag_max": max(lags, default=0.0),
+        "lag_p99": sorted(lags)[int(len(lags) * 0.99) - 1] if lags else 0.0,
+    }
+
+
+async def _run(logins: int, lookup_latency: float):
+    from src.lib.helpers import BCRYPT_WORKERS, BCRYPT_MAX_QUEUE, verify_password, verify_password_async
+
+    async def inline(plain, hashed):
+        return verify_password(plain, hashed)
+
+    print(f"logins per burst: {logins}   bcrypt pool: {BCRYPT_WORKERS} workers, queue {BCRYPT_MAX_QUEUE}")
+    print(f"{'mode':<8} {'logins/s':>9} {'ok':>5} {'503':>5} {'p50':>8} {'p99':>8} {'loop lag p99':>13} {'max':>8}")
+    for name, verify in (("inline", inline), ("pool", verify_password_async)):
+        r = await _burst(logins, verify, lookup_latency)
+        print(
+            f"{name:<8} {r['ok'] / r['wall']:>9.1f} {r['ok']:>5} {r['rejected']:>5} "
+            f"{r['p50']:>7.3f}s {r['p99']:>7.3f}s {r['lag_p99']:>12.3f}s {r['lag_max']:>7.3f}s"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--lookup-latency", type=float, default=0.002, help="Simulated user lookup per login")
+    args = parser.parse_args()
+
+    configure_env("http://127.0.0.1:9")
+    asyncio.run(_run(args.logins, args.lookup_latency))
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,101 @@
+"""
+Microbenchmark: rate limiter calls/sec against a real Redis.
+
+Compares the previous limiter (INCR, then EXPIRE on the first hit: one or two
+round-trips per key) with the Lua sliding-window limiter (one EVALSHA for any
+number of keys), for a single key and for the email + IP pair the auth routes
+now check. Calls are issued sequentially, which is round-trip bound, and with
+--concurrency in-flight calls. The in-process fallback limiter is timed too.
+
+Usage (from backend/, Redis reachable at REDIS_URL):
+    python -m benchmarks.rate_limit_calls --calls 5000 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import time
+import uuid
+
+
+async def _legacy_rate_limit(redis_client, key: str, limit: int, window_seconds: int) -> bool:
+    current = await redis_client.incr(key)
+    if current == 1:
+        await redis_client.expire(key, window_seconds)
+    return current <= limit
+
+
+async def _measure(name: str, call, calls: int, concurrency: int):
+    # warm-up also loads the Lua script
+    await call(0)
+
+    start = time.perf_counter()
+    for i in range(calls):
+        await call(i)
+    sequential = calls / (time.perf_counter() - start)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(i):
+        async with semaphore:
+            await call(i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(bounded(i) for i in range(calls)))
+    concurrent = calls / (time.perf_counter() - start)
+    print(f"{name:<28} {sequential:>12.0f} {concurrent:>14.0f}")
+
+
+async def _run(calls: int, concurrency: int, keys: int):
+    from src.lib.helpers import redis_client, rate_limit_many, LocalRateLimiter
+
+    await redis_client.ping()
+    run = uuid.uuid4().hex[:8]
+    # limits high enough that every call is admitted and recorded
+    limit, window = calls * 4, 60
+
+    def key(i: int, n: int) -> str:
+        return f"bench:{run}:{n}:{i % keys}"
+
+    local = LocalRateLimiter()
+
+    async def local_call(i):
+        local.hit([(key(i, 0), limit, window), (key(i, 1), limit, window)])
+
+    print(f"calls: {calls}   concurrency: {concurrency}   distinct keys: {keys}")
+    print(f"{'limiter':<28} {'seq calls/s':>12} {'conc calls/s':>14}")
+    await _measure("incr+expire, 1 key", lambda i: _legacy_rate_limit(redis_client, key(i, 0), limit, window), calls, concurrency)
+    await _measure("lua sliding window, 1 key", lambda i: rate_limit_many([(key(i, 0), limit, window)]), calls, concurrency)
+    await _measure(
+        "incr+expire, email + ip",
+        lambda i: asyncio.gather(
+            _legacy_rate_limit(redis_client, key(i, 0), limit, window),
+            _legacy_rate_limit(redis_client, key(i, 1), limit, window),
+        ),
+        calls,
+        concurrency,
+    )
+    await _measure(
+        "lua sliding window, email+ip",
+        lambda i: rate_limit_many([(key(i, 0), limit, window), (key(i, 1), limit, window)]),
+        calls,
+        concurrency,
+    )
+    await _measure("local fallback, email+ip", local_call, calls, concurrency)
+
+    async for stale in redis_client.scan_iter(match=f"*bench:{run}:*"):
+        await redis_client.delete(stale)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--keys", type=int, default=100, help="Distinct emails/IPs cycled through")
+    args = parser.parse_args()
+
+    os.environ.setdefault("REDIS_URL", "redis://127.0.0.1:6379/0")
+    asyncio.run(_run(args.calls, args.concurrency, args.keys))
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,67 @@
+"""
+Load benchmark for the review pipeline on a single worker.
+
+Fires N concurrent POST /api/review/text requests at the ASGI app in-process
+(one event loop, i.e. one uvicorn worker) while the embedding, chat and vector
+upstreams are local stubs with fixed latency. If the handlers block the loop,
+wall time grows linearly with N; if they are fully async, the requests overlap
+and wall time stays close to a single request's latency.
+
+Usage (from backend/):
+    python -m benchmarks.review_load --requests 20 --chat-latency 1.0
+"""
+import argparse
+import asyncio
+import time
+
+from ._stubs import configure_env, create_tables, install_fake_pinecone, start_upstream
+
+
+async def _run(requests: int, per_request: float):
+    import httpx
+    from src.app import app
+
+    await create_tables()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        async def one(i: int) -> float:
+            start = time.perf_counter()
+            resp = await http.post("/api/review/text", data={"code": f"def f{i}():\n    return {i}\n"})
+            resp.raise_for_status()
+            return time.perf_counter() - start
+
+        # warm up connections and lazy imports
+        await one(-1)
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(one(i) for i in range(requests)))
+        wall = time.perf_counter() - start
+
+    serial = per_request * requests
+    print(f"requests:              {requests}")
+    print(f"stub latency/request:  {per_request:.3f}s")
+    print(f"wall time:             {wall:.3f}s (serial would be ~{serial:.3f}s)")
+    print(f"mean request latency:  {sum(latencies) / len(latencies):.3f}s")
+    print(f"overlap factor:        {serial / wall:.1f}x")
+    print(f"throughput:            {requests / wall:.1f} reviews/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--chat-latency", type=float, default=1.0)
+    parser.add_argument("--index-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    install_fake_pinecone(latency=args.index_latency)
+    configure_env(start_upstream(args.embed_latency, args.chat_latency))
+
+    # text route: 2 embeddings, 1 upsert, 1 query, 1 completion
+    per_request = 2 * args.embed_latency + 2 * args.index_latency + args.chat_latency
+    asyncio.run(_run(args.requests, per_request))
+
+
+if __name__ == "__main__":
+    main()
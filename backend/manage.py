@@ -0,0 +1,176 @@
+"""
+Management commands. Run from the backend/ directory, like alembic:
+
+    python manage.py provision-index [--recreate]
+    python manage.py outbox-worker [--batch-size N]
+    python manage.py email-worker [--batch-size N]
+    python manage.py reindex {messages,code,all} [--source-index NAME] [--restart]
+    python manage.py partitions [--retention-months N] [--dry-run]   (run daily from cron)
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import asyncio
+import os
+import signal
+
+
+def provision_index(args):
+    from src.services.vector_store import VECTOR_STORE, INDEX_NAME, provision_index
+
+    provision_index(VECTOR_STORE, recreate=args.recreate)
+    print(f"Vector index {INDEX_NAME} ready ({VECTOR_STORE})")
+
+
+def outbox_worker(args):
+    from src.services.outbox import run_outbox_worker
+    from src.services.vector_store import close_vector_store
+
+    async def run():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        if args.batch_size:
+            await run_outbox_worker(stop, batch_size=args.batch_size)
+        else:
+            await run_outbox_worker(stop)
+
+    try:
+        asyncio.run(run())
+    finally:
+        close_vector_store()
+
+
+def email_worker(args):
+    from src.services.email_outbox import run_email_worker
+
+    async def run():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        if args.batch_size:
+            await run_email_worker(stop, batch_size=args.batch_size)
+        else:
+            await run_email_worker(stop)
+
+    asyncio.run(run())
+
+
+def reindex(args):
+    from src.services.reindex import Checkpoint, reindex_messages, reindex_code
+    from src.services.vector_store import VECTOR_STORE, INDEX_NAME, create_vector_store, connect_vector_store, close_vector_store
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    checkpoint = Checkpoint(args.checkpoint)
+    options = {"batch_size": args.batch_size, "concurrency": args.concurrency}
+
+    async def run():
+        if args.target in ("messages", "all"):
+            count = await reindex_messages(checkpoint, page_size=args.page_size, **options)
+            print(f"Messages re-indexed into {INDEX_NAME}: {count}")
+        if args.target in ("code", "all"):
+            if args.source_index:
+                source = create_vector_store(VECTOR_STORE, index_name=args.source_index)
+            else:
+                source = await connect_vector_store()
+            count = await reindex_code(checkpoint, source, **options)
+            print(f"Code vectors re-indexed into {INDEX_NAME}: {count}")
+
+    try:
+        asyncio.run(run())
+    finally:
+        close_vector_store()
+
+
+def partitions(args):
+    from src.services.partitions import maintain_partitions
+    from src.services.vector_store import close_vector_store
+
+    options = {
+        key: value
+        for key, value in (
+            ("retention_months", args.retention_months),
+            ("ahead", args.ahead),
+            ("archive_dir", args.archive_dir),
+        )
+        if value is not None
+    }
+    try:
+        report = asyncio.run(maintain_partitions(dry_run=args.dry_run, **options))
+    finally:
+        close_vector_store()
+    for name in report["created"]:
+        if args.dry_run:
+            stranded = report["stranded"][name]
+            moving = f" (moving {stranded} rows out of messages_default)" if stranded else ""
+            print(f"Would create partition {name}{moving}")
+        else:
+            print(f"Created partition {name}")
+    for retired in report["retired"]:
+        if args.dry_run:
+            print(f"Would retire partition {retired}")
+        else:
+            print(
+                f"Retired partition {retired['partition']}: archived to {retired['archive']}, "
+                f"{retired['vectors']} vectors deleted"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KaiFlow management commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("provision-index", help="Create the vector index if it does not exist")
+    cmd.add_argument(
+        "--recreate",
+        action="store_true",
+        help="Drop and recreate the index on a dimension mismatch (orphans existing vectors; re-index afterwards)",
+    )
+    cmd.set_defaults(func=provision_index)
+
+    cmd = commands.add_parser("outbox-worker", help="Embed and index messages queued in the embedding outbox")
+    cmd.add_argument("--batch-size", type=int, default=None, help="Messages per embed/upsert batch (default: OUTBOX_BATCH_SIZE)")
+    cmd.set_defaults(func=outbox_worker)
+
+    cmd = commands.add_parser("email-worker", help="Send queued OTP emails (set EMAIL_WORKER_IN_PROCESS=false on the API)")
+    cmd.add_argument("--batch-size", type=int, default=None, help="Emails per provider request (default: EMAIL_BATCH_SIZE)")
+    cmd.set_defaults(func=email_worker)
+
+    cmd = commands.add_parser(
+        "reindex",
+        help="Rebuild the vector index from Postgres (messages) and from a source index (uploaded code)",
+        description=(
+            "Re-embeds into the index selected by VECTOR_STORE / PINECONE_INDEX_NAME. "
+            "After an embedding model change, provision a new index, point PINECONE_INDEX_NAME at it, "
+            "and pass the old one as --source-index."
+        ),
+    )
+    cmd.add_argument("target", choices=["messages", "code", "all"])
+    cmd.add_argument("--source-index", help="Index (or local store path) to read code vectors from; default: the target index")
+    cmd.add_argument("--page-size", type=int, default=5000, help="Rows per keyset page (checkpoint granularity)")
+    cmd.add_argument("--batch-size", type=int, default=256, help="Texts per embedding call")
+    cmd.add_argument("--concurrency", type=int, default=4, help="Batches embedded/upserted in parallel")
+    cmd.add_argument("--checkpoint", default="data/reindex-checkpoint.json", help="Progress file used to resume")
+    cmd.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the beginning")
+    cmd.set_defaults(func=reindex)
+
+    cmd = commands.add_parser(
+        "partitions",
+        help="Create upcoming messages partitions and archive/drop expired ones",
+    )
+    cmd.add_argument("--retention-months", type=int, default=None, help="Months of messages to keep live (default: MESSAGES_RETENTION_MONTHS)")
+    cmd.add_argument("--ahead", type=int, default=None, help="Future monthly partitions to keep created (default: MESSAGES_PARTITIONS_AHEAD)")
+    cmd.add_argument("--archive-dir", default=None, help="Where expired partitions are written as .jsonl.gz (default: MESSAGES_ARCHIVE_DIR)")
+    cmd.add_argument("--dry-run", action="store_true", help="List the partitions that would be retired and exit")
+    cmd.set_defaults(func=partitions)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
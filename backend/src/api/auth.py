@@ -3,22 +3,26 @@ from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from ..models.db_models import User
-from ..db import get_session
+from ..db import get_session, get_read_session
+from ..lib.dependencies import get_optional_user_id, invalidate_user
+from ..services.email_outbox import enqueue_otp_email
+from ..lib.metrics import timed
 from ..lib.helpers import (
     SignupRequest,
     LoginRequest,
     VerifyRequest,
-    hash_password,
-    verify_password,
+    hash_password_async,
+    verify_password_async,
+    PasswordHasherBusy,
     validate_password_strength,
     create_access_token,
     create_refresh_token,
     verify_token,
     generate_otp,
     generateUserId,
-    send_otp_email,
     redis_client,
-    rate_limit,
+    rate_limit_many,
+    client_ip,
     logger,
     ACCESS_TOKEN_EXPIRE_MINUTES,
     REFRESH_TOKEN_EXPIRE_DAYS
@@ -27,6 +31,14 @@ from datetime import timedelta
 
 auth = APIRouter(prefix='/auth')
 
+def _busy_response() -> JSONResponse:
+    logger.warning("Password hashing queue full; shedding request")
+    return JSONResponse(
+        status_code=503,
+        content={"error": "Server busy. Try again shortly."},
+        headers={"Retry-After": "1"},
+    )
+
 # include social oauth routers if available
 try:
     from ..lib.google_oauth import router as google_router
@@ -41,10 +53,10 @@ except Exception:
     logger = None
 
 @auth.post('/signup')
-async def signup(request: SignupRequest, session: AsyncSession = Depends(get_session)):
+async def signup(request: SignupRequest, req: Request, session: AsyncSession = Depends(get_session)):
     try:
-        rate_key = f"signup:{request.email}"
-        if not await rate_limit(rate_key, 5, 3600):
+        limits = [(f"signup:{request.email}", 5, 3600), (f"signup-ip:{client_ip(req)}", 20, 3600)]
+        if not await rate_limit_many(limits):
             logger.warning(f"Signup rate limit exceeded for email: {request.email}")
             return JSONResponse(status_code=429, content={"error": "Too many signup attempts. Try again later."})
 
@@ -55,13 +67,14 @@ async def signup(request: SignupRequest, session: AsyncSession = Depends(get_ses
             logger.warning(f"Weak password for email: {request.email}")
             return JSONResponse(status_code=400, content={"error": "Password must be at least 8 characters with uppercase, lowercase, digit, and special character"})
 
-        result = await session.execute(select(User).where(User.email == request.email))
+        with timed("db_user_lookup"):
+            result = await session.execute(select(User).where(User.email == request.email))
         existing_user = result.scalars().first()
         if existing_user:
             logger.warning(f"Signup attempt for existing email: {request.email}")
             return JSONResponse(status_code=400, content={"error": "User already exists"})
 
-        hashed_password = hash_password(request.password)
+        hashed_password = await hash_password_async(request.password)
         new_user = User(
             id=generateUserId(),
             first_name=request.first_name,
@@ -74,14 +87,17 @@ async def signup(request: SignupRequest, session: AsyncSession = Depends(get_ses
         await session.commit()
 
         otp = generate_otp()
-        await redis_client.setex(f"otp:{request.email}", 600, otp)
-        await send_otp_email(request.email, otp)
+        with timed("redis"):
+            await redis_client.setex(f"otp:{request.email}", 600, otp)
+        await enqueue_otp_email(request.email, otp)
 
         logger.info(f"User signed up: {request.email}")
         return JSONResponse(
             content={"message": "Signup successful. Please verify your email."}, 
             status_code=200
         )
+    except PasswordHasherBusy:
+        return _busy_response()
     except Exception as e:
         return JSONResponse(
             content={"error": str(e)},
@@ -89,19 +105,24 @@ async def signup(request: SignupRequest, session: AsyncSession = Depends(get_ses
         )
 
 @auth.post('/login')
-async def login(request: LoginRequest, response: Response, req: Request, session: AsyncSession = Depends(get_session)):
-    rate_key = f"login:{request.email}"
-    if not await rate_limit(rate_key, 5, 900):
+async def login(request: LoginRequest, response: Response, req: Request, session: AsyncSession = Depends(get_read_session)):
+    limits = [(f"login:{request.email}", 5, 900), (f"login-ip:{client_ip(req)}", 50, 900)]
+    if not await rate_limit_many(limits):
         return JSONResponse(status_code=429, content={"error": "Too many login attempts. Try again later."})
     
-    result = await session.execute(select(User).where(User.email == request.email))
+    with timed("db_user_lookup"):
+        result = await session.execute(select(User).where(User.email == request.email))
     
     user = result.scalars().first()
     
     if user is None:
         return JSONResponse(status_code=404, content={"error": "User not found"})
     
-    if not user or not verify_password(request.password, user.password):
+    try:
+        password_ok = await verify_password_async(request.password, user.password)
+    except PasswordHasherBusy:
+        return _busy_response()
+    if not password_ok:
         return JSONResponse(status_code=401, content={"error": "Invalid credentials"})
     
     if not user.verified:
@@ -111,7 +132,8 @@ async def login(request: LoginRequest, response: Response, req: Request, session
     refresh_token = create_refresh_token(data={"sub": str(user.id)})
     
     # Store refresh token in Redis
-    await redis_client.setex(f"refresh:{user.id}", int(timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS).total_seconds()), refresh_token)
+    with timed("redis"):
+        await redis_client.setex(f"refresh:{user.id}", int(timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS).total_seconds()), refresh_token)
 
     cookie_secure = req.url.scheme == "https"
     
@@ -136,19 +158,21 @@ async def login(request: LoginRequest, response: Response, req: Request, session
     return JSONResponse(content={"message": "Login successful"}, status_code=200)
 
 @auth.post('/verify')
-async def verify_otp(request: VerifyRequest, session: AsyncSession = Depends(get_session)):
-    # Rate limit OTP attempts by email (3 per 5 minutes)
-    rate_key = f"otp:{request.email}"
-    if not await rate_limit(rate_key, 3, 300):
+async def verify_otp(request: VerifyRequest, req: Request, session: AsyncSession = Depends(get_session)):
+    # Rate limit OTP attempts by email (3 per 5 minutes) and by client IP
+    limits = [(f"otp:{request.email}", 3, 300), (f"otp-ip:{client_ip(req)}", 30, 300)]
+    if not await rate_limit_many(limits):
         logger.warning(f"OTP rate limit exceeded for email: {request.email}")
         return JSONResponse(status_code=429, content={"error": "Too many OTP attempts. Try again later."})
     
-    stored_otp = await redis_client.get(f"otp:{request.email}")
+    with timed("redis"):
+        stored_otp = await redis_client.get(f"otp:{request.email}")
     if not stored_otp or stored_otp.decode() != request.otp:
         logger.warning(f"Invalid OTP for email: {request.email}")
         return JSONResponse(status_code=400, content={"error": "Invalid OTP"})
     
-    result = await session.execute(select(User).where(User.email == request.email))
+    with timed("db_user_lookup"):
+        result = await session.execute(select(User).where(User.email == request.email))
     user = result.scalars().first()
     if not user:
         logger.warning(f"OTP verification for non-existent user: {request.email}")
@@ -156,13 +180,15 @@ async def verify_otp(request: VerifyRequest, session: AsyncSession = Depends(get
     
     user.verified = True
     await session.commit()
-    await redis_client.delete(f"otp:{request.email}")
+    await invalidate_user(user.id)
+    with timed("redis"):
+        await redis_client.delete(f"otp:{request.email}")
     
     logger.info(f"User verified email: {request.email}")
     return JSONResponse(content={"message": "Email verified successfully"}, status_code=200)
 
 @auth.post('/resend')
-async def resend_otp(request: Request, session: AsyncSession = Depends(get_session)):
+async def resend_otp(request: Request, session: AsyncSession = Depends(get_read_session)):
     try:
         body = await request.json()
         email = body.get("email")
@@ -171,22 +197,24 @@ async def resend_otp(request: Request, session: AsyncSession = Depends(get_sessi
             return JSONResponse(content={"error": "Email is required"}, status_code=400)
 
         # Rate limit resend attempts (e.g., 5 per hour)
-        rate_key = f"resend:{email}"
-        if not await rate_limit(rate_key, 5, 3600):
+        limits = [(f"resend:{email}", 5, 3600), (f"resend-ip:{client_ip(request)}", 20, 3600)]
+        if not await rate_limit_many(limits):
             logger.warning(f"Resend OTP rate limit exceeded for email: {email}")
             return JSONResponse(status_code=429, content={"error": "Too many resend attempts. Try again later."})
 
         # Ensure user exists
-        result = await session.execute(select(User).where(User.email == email))
+        with timed("db_user_lookup"):
+            result = await session.execute(select(User).where(User.email == email))
         user = result.scalars().first()
         if not user:
             logger.warning(f"Resend OTP requested for non-existent user: {email}")
             return JSONResponse(content={"error": "User not found"}, status_code=404)
 
-        # Generate OTP, store in Redis with TTL (5 minutes) and send via email
+        # Generate OTP, store in Redis with TTL (5 minutes) and queue the email
         otp = generate_otp()
-        await redis_client.setex(f"otp:{email}", 300, otp)
-        await send_otp_email(email, otp)
+        with timed("redis"):
+            await redis_client.setex(f"otp:{email}", 300, otp)
+        await enqueue_otp_email(email, otp)
 
         logger.info(f"Resent OTP to {email}")
         return JSONResponse(content={"message": "OTP resent successfully"}, status_code=200)
@@ -198,14 +226,11 @@ async def resend_otp(request: Request, session: AsyncSession = Depends(get_sessi
         )
 
 @auth.post('/logout')
-async def logout(request: Request, response: Response):
-    access_token = request.cookies.get("access_token")
-    user_id = None
-    if access_token:
-        payload = verify_token(access_token)
-        if payload:
-            user_id = payload.get("sub")
+async def logout(response: Response, user_id: str | None = Depends(get_optional_user_id)):
+    if user_id:
+        with timed("redis"):
             await redis_client.delete(f"refresh:{user_id}")
+        await invalidate_user(user_id)
     
     response.delete_cookie("access_token")
     response.delete_cookie("refresh_token")
@@ -221,14 +246,15 @@ async def refresh(request: Request, response: Response):
         return JSONResponse(status_code=401, content={"error": "Refresh token missing"})
     
     payload = verify_token(refresh_token)
-    if not payload:
+    if not payload or payload.get("type") != "refresh":
         logger.warning("Invalid refresh token")
         return JSONResponse(status_code=401, content={"error": "Invalid refresh token"})
     
     user_id = payload.get("sub")
     
     # Check if stored refresh token matches
-    stored_refresh = await redis_client.get(f"refresh:{user_id}")
+    with timed("redis"):
+        stored_refresh = await redis_client.get(f"refresh:{user_id}")
     if not stored_refresh or stored_refresh.decode() != refresh_token:
         logger.warning(f"Refresh token mismatch for user: {user_id}")
         return JSONResponse(status_code=401, content={"error": "Refresh token revoked"})
@@ -0,0 +1,27 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from ..db import pool_stats, replica_engine
+from ..services.openai import llm_status
+
+health = APIRouter(prefix='/health')
+
+@health.get('')
+async def health_check():
+    return JSONResponse(content={"status": "ok"}, status_code=200)
+
+@health.get('/db')
+async def db_pool_status():
+    """
+    Connection pool statistics, for sizing workers against Postgres capacity.
+    """
+    content = pool_stats()
+    if replica_engine is not None:
+        content["replica"] = pool_stats(replica_engine)
+    return JSONResponse(content=content, status_code=200)
+
+@health.get('/llm')
+async def llm_route_status():
+    """
+    Circuit state and current hedge delays of each LLM route.
+    """
+    return JSONResponse(content={"routes": llm_status()}, status_code=200)
\ No newline at end of file
@@ -0,0 +1,144 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import Response
+from sqlalchemy import and_, func, literal, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+import base64
+import orjson
+from ..db import get_read_session
+from ..models.db_models import Conversation, Message
+from ..lib.dependencies import get_current_user_id
+
+history = APIRouter(prefix='/history')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def _json(content: dict) -> Response:
+    # Rows are plain tuples, so orjson can serialize them (datetimes included)
+    # without going through jsonable_encoder.
+    return Response(content=orjson.dumps(content), media_type="application/json")
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = orjson.dumps([created_at.isoformat() if created_at else None, row_id])
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[datetime | None, int]:
+    """
+    Inverse of encode_cursor; raises 400 for anything that was not produced by it.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = orjson.loads(raw)
+        return (datetime.fromisoformat(created_at) if created_at is not None else None), int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _created(value, dialect: str):
+    """
+    Sort key for a created_at column or bound value. The column itself, so
+    the (…, created_at, id) indexes serve the ordering, except on SQLite
+    (local development): it keeps timestamps as text in whichever format
+    wrote them (CURRENT_TIMESTAMP has no fraction, SQLAlchemy binds do), and
+    those strings do not sort as times.
+    """
+    return func.julianday(value) if dialect == "sqlite" else value
+
+def _order(created_col, id_col, dialect: str, descending: bool) -> list:
+    # NULL created_at sorts first when descending and last when ascending on
+    # every dialect, matching a btree index scanned either way on Postgres.
+    created = _created(created_col, dialect)
+    if descending:
+        return [created.desc().nulls_first(), id_col.desc()]
+    return [created.asc().nulls_last(), id_col.asc()]
+
+def _after_cursor(created_col, id_col, cursor: str, dialect: str, descending: bool):
+    """
+    Condition for the rows that follow the cursor in the `_order` ordering.
+    """
+    created_at, row_id = decode_cursor(cursor)
+    id_after = id_col < row_id if descending else id_col > row_id
+    if created_at is None:
+        if descending:
+            return or_(and_(created_col.is_(None), id_after), created_col.is_not(None))
+        return and_(created_col.is_(None), id_after)
+    key = tuple_(_created(created_col, dialect), id_col)
+    bound = tuple_(_created(literal(created_at, created_col.type), dialect), literal(row_id, id_col.type))
+    after = key < bound if descending else key > bound
+    if descending or not created_col.nullable:
+        return after
+    return or_(after, created_col.is_(None))
+
+def _page(rows, limit: int) -> tuple[list, str | None]:
+    # One extra row is fetched to know whether another page exists.
+    rows = list(rows)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last.created_at, last.id)
+
+@history.get('/conversations')
+async def list_conversations(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    user_id: str = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_read_session),
+):
+    """
+    The user's conversations, newest first. Pass `next_cursor` back as `cursor`
+    for the following page.
+    """
+    dialect = session.bind.dialect.name
+    stmt = (
+        select(Conversation.id, Conversation.title, Conversation.created_at)
+        .where(Conversation.user_id == user_id)
+        .order_by(*_order(Conversation.created_at, Conversation.id, dialect, descending=True))
+        .limit(limit + 1)
+    )
+    if cursor:
+        stmt = stmt.where(_after_cursor(Conversation.created_at, Conversation.id, cursor, dialect, descending=True))
+
+    rows, next_cursor = _page((await session.execute(stmt)).all(), limit)
+    return _json({
+        "conversations": [
+            {"id": r.id, "title": r.title, "created_at": r.created_at} for r in rows
+        ],
+        "next_cursor": next_cursor,
+    })
+
+@history.get('/conversations/{conversation_id}/messages')
+async def list_messages(
+    conversation_id: int,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    user_id: str = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_read_session),
+):
+    """
+    Messages of one conversation in chronological order, paged by cursor.
+    """
+    owner = await session.scalar(
+        select(Conversation.user_id).where(Conversation.id == conversation_id)
+    )
+    if owner is None or owner != user_id:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    dialect = session.bind.dialect.name
+    stmt = (
+        select(Message.id, Message.role, Message.text, Message.created_at)
+        .where(Message.conversation_id == conversation_id)
+        .order_by(*_order(Message.created_at, Message.id, dialect, descending=False))
+        .limit(limit + 1)
+    )
+    if cursor:
+        stmt = stmt.where(_after_cursor(Message.created_at, Message.id, cursor, dialect, descending=False))
+
+    rows, next_cursor = _page((await session.execute(stmt)).all(), limit)
+    return _json({
+        "conversation_id": conversation_id,
+        "messages": [
+            {"id": r.id, "role": r.role, "text": r.text, "created_at": r.created_at} for r in rows
+        ],
+        "next_cursor": next_cursor,
+    })
\ No newline at end of file
@@ -0,0 +1,35 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from anyio import to_thread
+import os
+import time
+from ..lib import profiling as prof
+
+def require_admin(request: Request):
+    if not prof.is_admin(request.headers):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+profiling = APIRouter(prefix='/debug', dependencies=[Depends(require_admin)])
+
+@profiling.get('/profile')
+async def sample_profile(
+    seconds: float = Query(10.0, gt=0),
+    interval: float = Query(prof.PROFILE_SAMPLE_INTERVAL, ge=0.001, le=1.0),
+):
+    """
+    Sample this worker for `seconds` and download collapsed stacks, e.g.
+    `flamegraph.pl profile.collapsed > profile.svg` or open in speedscope.
+    """
+    seconds = min(seconds, prof.PROFILE_MAX_SECONDS)
+    try:
+        collapsed = await to_thread.run_sync(prof.sample_stacks, seconds, interval)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    filename = f"worker-{os.getpid()}-{int(time.time())}.collapsed"
+    return PlainTextResponse(collapsed, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@profiling.get('/loop-lag')
+async def loop_lag():
+    if prof.loop_monitor is None:
+        raise HTTPException(status_code=404, detail="Loop monitor is not running")
+    return JSONResponse(content={"pid": os.getpid(), **prof.loop_monitor.stats()}, status_code=200)
\ No newline at end of file
@@ -1,81 +1,339 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
-from ..services.openai import generate_review
-from ..services.rag import store_code_embedding, retrieve_similar_code, store_message_with_embedding
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from ..services.openai import generate_review_async, stream_review, ReviewGenerationError, ReviewUnavailable
+from ..services.rag import (
+    store_code_chunks,
+    retrieve_code_context,
+    retrieve_file_context,
+    store_message_with_embedding,
+    create_conversation,
+    store_message,
+)
+from ..services.chunking import chunk_code
+from ..services.embedding import get_embedding_async
+from ..services.review_cache import get_cached_review, store_cached_review, file_vector
+from ..services.ingest import SUPPORTED_LANGUAGES, MAX_UPLOAD_BYTES, is_supported_filename, detect_frameworks, read_upload
+from ..services.archive import MAX_ARCHIVE_BYTES, ArchiveEntry, iter_archive, spool_upload
+from ..lib.helpers import logger
+from ..lib.metrics import timed
+from ..lib.dependencies import get_optional_user_id
+from ..db import mark_recent_write
+from anyio import to_thread
+import asyncio
+import json
+import os
 import uuid
 from pygments.lexers import guess_lexer
 
 review = APIRouter()
 
-@review.post("/review/text")
-async def review_code_text(code: str = Form(...)):
+ARCHIVE_CONCURRENCY = int(os.getenv("ARCHIVE_CONCURRENCY", "4"))
+
+# Largest file each upload route accepts, enforced on the request body by
+# BodySizeLimitMiddleware before the multipart form is parsed.
+UPLOAD_LIMITS = {
+    "/review/file": MAX_UPLOAD_BYTES,
+    "/review/file/stream": MAX_UPLOAD_BYTES,
+    "/review/archive": MAX_ARCHIVE_BYTES,
+}
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # stop nginx-style proxies from buffering the whole stream
+    "X-Accel-Buffering": "no",
+}
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def review_generation_error_handler(request: Request, exc: ReviewGenerationError):
     """
-    Review code provided as text.
+    502/503/504 for reviews the LLM layer could not produce (see services/openai.py).
     """
-    if not code.strip():
-        raise HTTPException(status_code=400, detail="Code cannot be empty")
-    
-    # Persist message + embedding (creates a conversation if needed)
-    msg_id, pine_id = await store_message_with_embedding(code, conversation_id=None, user_id=None, role="user")
-    
-    # Retrieve similar code for context (optional)
-    similar = retrieve_similar_code(code, top_k=3)
-    context = "\n".join([match['metadata']['code'] for match in similar['matches'] if 'metadata' in match and 'code' in match['metadata']])
-    
-    # Generate review
-    prompt = f"Review the following code. Similar code examples:\n{context}\n\nCode to review:\n{code}\n\nProvide a detailed review:"
-    review = generate_review(code, prompt)
+    logger.error(f"Review generation failed: {exc}")
+    headers = {"Retry-After": "30"} if isinstance(exc, ReviewUnavailable) else None
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)}, headers=headers)
 
-    return JSONResponse(content={"review": review, "code_id": pine_id, "message_id": msg_id})
+def _build_prompt(context: str, code: str) -> str:
+    if not context:
+        return f"Review the following code.\n\nCode to review:\n{code}\n\nProvide a detailed review:"
+    return f"Review the following code. Similar code examples:\n{context}\n\nCode to review:\n{code}\n\nProvide a detailed review:"
 
-@review.post("/review/file")
-async def review_code_file(file: UploadFile = File(...)):
+def _source_metadata(user_id: str | None, **metadata) -> dict:
+    # the vector store rejects null metadata, so anonymous uploads omit user_id
+    if user_id:
+        metadata["user_id"] = user_id
+    return metadata
+
+async def _read_code_file(file: UploadFile):
     """
-    Review code from uploaded file.
+    Validate an uploaded source file and return
+    (code, lexer, detected_language, detected_frameworks).
     """
-    supported_extensions = [
-        '.py', '.js', '.tsx', '.ts', '.tsx', '.java', '.kt', '.cpp', '.c', '.csharp',
-        '.go', '.rs', '.php', '.rb', '.vue', '.swift', '.m', '.scala', '.sh', '.r', '.sql'
-    ]
-    
-    supported_languages = [
-        'python', 'javascript', 'typescript', 'java', 'kotlin', 'cpp', 'c', 'csharp',
-        'go', 'rust', 'php', 'ruby', 'vue', 'swift', 'objective-c', 'scala', 'shell', 'r', 'sql'
-    ]
-    
-    supported_frameworks = [
-        'react', 'angular', 'vue', 'django', 'flask', 'spring', 'laravel', 'rails', 'express',
-        'nextjs', 'nestjs', 'svelte', 'flutter', 'swiftui', 'kivy', 'react-native', 'ionic',
-        'xamarin', 'symfony', 'cakephp', 'codeigniter', 'laravel', 'phoenix',
-    ]
-    
-    if not any(file.filename.endswith(ext) for ext in supported_extensions):
+    if not is_supported_filename(file.filename):
         raise HTTPException(status_code=400, detail="Unsupported file type")
     
-    # Read file content
-    content = await file.read()
-    code = content.decode('utf-8')
-    
+    # Oversized request bodies were already refused by BodySizeLimitMiddleware;
+    # decode the spooled file in chunks, rejecting binary content
+    code = await read_upload(file)
+    lexer, detected_language, detected_frameworks = await _analyze_code(code)
+    return code, lexer, detected_language, detected_frameworks
+
+async def _analyze_code(code: str):
+    """
+    Detect language and frameworks; returns (lexer, detected_language, detected_frameworks).
+    """
     # Detect language using Pygments
     try:
-        lexer = guess_lexer(code)
+        # guess_lexer runs every lexer's heuristics; keep it off the event loop
+        with timed("guess_lexer"):
+            lexer = await to_thread.run_sync(guess_lexer, code)
         detected_language = lexer.name.lower()
     except:
+        lexer = None
         detected_language = None
     
     # Check if detected language is supported
-    if detected_language and detected_language not in [lang.lower() for lang in supported_languages]:
+    if detected_language and detected_language not in [lang.lower() for lang in SUPPORTED_LANGUAGES]:
         raise HTTPException(status_code=400, detail=f"Unsupported language detected: {detected_language}")
     
     # Check for supported frameworks (simple keyword match)
-    detected_frameworks = [fw for fw in supported_frameworks if fw.lower() in code.lower()]
-    
-    # Same as text review
+    detected_frameworks = detect_frameworks(code)
+    return lexer, detected_language, detected_frameworks
+
+async def _cached_review(code: str, vector: list, retrieve, user_id: str | None = None) -> tuple[str, str]:
+    """
+    Return a cached review for `code` (exact or near-duplicate) or generate,
+    cache and return a new one. `retrieve` (returning the prompt context) is
+    only awaited on a miss.
+    Returns (review, cache_status).
+    """
+    with timed("review_cache_lookup"):
+        review, cache_status = await get_cached_review(code, vector, user_id)
+    if review is None:
+        context = await retrieve()
+        review = await generate_review_async(code, _build_prompt(context, code))
+        await store_cached_review(code, vector, review, user_id)
+    return review, cache_status
+
+async def _store_chunks(code: str, lexer, metadata: dict):
+    """
+    Chunk, embed and store a source file. Returns
+    (code_id, chunks, chunk_embeddings, file_vector).
+    """
     code_id = str(uuid.uuid4())
-    store_code_embedding(code_id, code)
-    similar = retrieve_similar_code(code, top_k=3)
-    context = "\n".join([match['metadata']['code'] for match in similar['matches'] if 'metadata' in match and 'code' in match['metadata']])
-    prompt = f"Review the following code. Similar code examples:\n{context}\n\nCode to review:\n{code}\n\nProvide a detailed review:"
-    review = generate_review(code, prompt)
+    chunks = chunk_code(code, lexer)
+    _, embeddings = await store_code_chunks(code_id, chunks, metadata)
+    return code_id, chunks, embeddings, file_vector(embeddings) if embeddings else None
+
+async def _review_source(code: str, lexer, metadata: dict) -> tuple[str, int, str, str]:
+    """
+    Chunk, embed and store a source file, retrieve similar files and generate
+    its review. Returns (code_id, chunk_count, review, cache_status).
+    """
+    code_id, chunks, embeddings, vector = await _store_chunks(code, lexer, metadata)
+    review, cache_status = await _cached_review(
+        code, vector, lambda: retrieve_file_context(code, chunks, embeddings, exclude_ids={code_id}), metadata.get("user_id")
+    )
+    return code_id, len(chunks), review, cache_status
+
+async def _stream_review_events(code: str, vector: list, retrieve, conversation_id: int, user_id: str | None = None):
+    """
+    Forward review tokens as server-sent events and persist the assistant
+    reply as a Message once the model finishes. A cached review is sent as
+    a single `answer` event.
+    """
+    with timed("review_cache_lookup"):
+        review, cache_status = await get_cached_review(code, vector, user_id)
+    if review is not None:
+        yield _sse("answer", {"text": review})
+    else:
+        answer = []
+        try:
+            context = await retrieve()
+            async for kind, text in stream_review(code, _build_prompt(context, code)):
+                if kind == "answer":
+                    answer.append(text)
+                yield _sse(kind, {"text": text})
+        except Exception as e:
+            logger.error(f"Error streaming review: {e}")
+            status = e.status_code if isinstance(e, ReviewGenerationError) else 500
+            yield _sse("error", {"error": f"Error generating review: {str(e)}", "status": status})
+            return
+        review = "".join(answer)
+        await store_cached_review(code, vector, review, user_id)
+
+    msg_id = await store_message(review, conversation_id=conversation_id, user_id=user_id, role="assistant")
+    yield _sse("done", {"conversation_id": conversation_id, "message_id": msg_id, "cache": cache_status})
+
+@review.post("/review/text")
+async def review_code_text(request: Request, code: str = Form(...), user_id: str | None = Depends(get_optional_user_id)):
+    """
+    Review code provided as text.
+    """
+    if not code.strip():
+        raise HTTPException(status_code=400, detail="Code cannot be empty")
+    
+    # Persist message + embedding (creates a conversation if needed)
+    msg_id, pine_id = await store_message_with_embedding(code, conversation_id=None, user_id=user_id, role="user")
+    await mark_recent_write(request)
     
-    return JSONResponse(content={"review": review, "code_id": code_id, "filename": file.filename, "detected_language": detected_language, "detected_frameworks": detected_frameworks})
+    # Reuse a cached review when possible, otherwise retrieve similar code
+    # for context and generate one
+    embedding = await get_embedding_async(code)
+    review, cache_status = await _cached_review(code, embedding, lambda: retrieve_code_context(code, exclude_ids={pine_id}), user_id)
+
+    return JSONResponse(content={"review": review, "code_id": pine_id, "message_id": msg_id, "cache": cache_status})
+
+@review.post("/review/text/stream")
+async def review_code_text_stream(request: Request, code: str = Form(...), user_id: str | None = Depends(get_optional_user_id)):
+    """
+    Review code provided as text, streaming reasoning and answer tokens as
+    server-sent events (`reasoning`, `answer`, then `done` or `error`).
+    """
+    if not code.strip():
+        raise HTTPException(status_code=400, detail="Code cannot be empty")
+
+    async def events():
+        # SSE comment line: flushes headers so the client sees the first byte
+        # before embedding and retrieval run
+        yield ": stream-open\n\n"
+        conversation_id = await create_conversation(user_id=user_id)
+        msg_id, pine_id = await store_message_with_embedding(code, conversation_id=conversation_id, user_id=user_id, role="user")
+        await mark_recent_write(request)
+        yield _sse("meta", {"code_id": pine_id, "message_id": msg_id, "conversation_id": conversation_id})
+        embedding = await get_embedding_async(code)
+        retrieve = lambda: retrieve_code_context(code, exclude_ids={pine_id})
+        async for event in _stream_review_events(code, embedding, retrieve, conversation_id, user_id):
+            yield event
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@review.post("/review/file")
+async def review_code_file(file: UploadFile = File(...), user_id: str | None = Depends(get_optional_user_id)):
+    """
+    Review code from uploaded file.
+    """
+    code, lexer, detected_language, detected_frameworks = await _read_code_file(file)
+    
+    # Embed the file per function/class chunk, then retrieve similar files
+    code_id, chunk_count, review, cache_status = await _review_source(code, lexer, _source_metadata(user_id, filename=file.filename))
+    
+    return JSONResponse(content={"review": review, "code_id": code_id, "filename": file.filename, "detected_language": detected_language, "detected_frameworks": detected_frameworks, "chunks": chunk_count, "cache": cache_status})
+
+@review.post("/review/file/stream")
+async def review_code_file_stream(request: Request, file: UploadFile = File(...), user_id: str | None = Depends(get_optional_user_id)):
+    """
+    Review code from an uploaded file, streaming the review as server-sent events.
+    """
+    code, lexer, detected_language, detected_frameworks = await _read_code_file(file)
+    filename = file.filename
+
+    async def events():
+        yield ": stream-open\n\n"
+        code_id, chunks, embeddings, vector = await _store_chunks(code, lexer, _source_metadata(user_id, filename=filename))
+        conversation_id = await create_conversation(user_id=user_id, title=filename)
+        await store_message(code, conversation_id=conversation_id, user_id=user_id, role="user")
+        await mark_recent_write(request)
+        yield _sse("meta", {
+            "code_id": code_id,
+            "conversation_id": conversation_id,
+            "filename": filename,
+            "detected_language": detected_language,
+            "detected_frameworks": detected_frameworks,
+            "chunks": len(chunks),
+        })
+        retrieve = lambda: retrieve_file_context(code, chunks, embeddings, exclude_ids={code_id})
+        async for event in _stream_review_events(code, vector, retrieve, conversation_id, user_id):
+            yield event
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+async def _review_archive_entry(entry: ArchiveEntry, archive_id: str, user_id: str | None = None) -> dict:
+    result = {"filename": entry.filename}
+    try:
+        lexer, detected_language, detected_frameworks = await _analyze_code(entry.code)
+        code_id, chunk_count, review, cache_status = await _review_source(
+            entry.code, lexer, _source_metadata(user_id, filename=entry.filename, archive_id=archive_id)
+        )
+    except HTTPException as e:
+        result.update(status="skipped", error=e.detail)
+    except Exception as e:
+        logger.error(f"Error reviewing {entry.filename} from archive {archive_id}: {e}")
+        result.update(status="failed", error=str(e))
+    else:
+        result.update(
+            status="reviewed",
+            code_id=code_id,
+            review=review,
+            detected_language=detected_language,
+            detected_frameworks=detected_frameworks,
+            chunks=chunk_count,
+            cache=cache_status,
+        )
+    return result
+
+@review.post("/review/archive")
+async def review_code_archive(file: UploadFile = File(...), user_id: str | None = Depends(get_optional_user_id)):
+    """
+    Review every supported source file in a zip/tar archive (a repository or
+    changeset). Files are reviewed concurrently, at most ARCHIVE_CONCURRENCY
+    at a time, and each result is streamed back as a server-sent `file` event
+    as soon as it finishes, followed by an aggregated `report` event.
+    """
+    archive_id = str(uuid.uuid4())
+    filename = file.filename
+    spool = await spool_upload(file)
+    entries = iter_archive(spool, max_file_bytes=MAX_UPLOAD_BYTES)
+    try:
+        # Read the first entry up front so a corrupt archive is a 400, not a broken stream
+        first = await to_thread.run_sync(next, entries, None)
+    except BaseException:
+        spool.close()
+        raise
+
+    async def events():
+        yield _sse("meta", {"archive_id": archive_id, "filename": filename})
+        results = []
+        pending = set()
+        entry = first
+        try:
+            while True:
+                # Only read the next entry when a slot is free, so at most
+                # ARCHIVE_CONCURRENCY files are held in memory at once.
+                while entry is not None and len(pending) < ARCHIVE_CONCURRENCY:
+                    if entry.code is None:
+                        skipped = {"filename": entry.filename, "status": "skipped", "error": entry.error}
+                        results.append(skipped)
+                        yield _sse("file", skipped)
+                    else:
+                        pending.add(asyncio.create_task(_review_archive_entry(entry, archive_id, user_id)))
+                    try:
+                        entry = await to_thread.run_sync(next, entries, None)
+                    except HTTPException as e:
+                        # corrupt past this point: report it, finish what was read
+                        yield _sse("error", {"error": e.detail, "status": e.status_code})
+                        entry = None
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    results.append(result)
+                    yield _sse("file", result)
+        finally:
+            for task in pending:
+                task.cancel()
+            entries.close()
+            spool.close()
+
+        yield _sse("report", {
+            "archive_id": archive_id,
+            "filename": filename,
+            "files_reviewed": sum(1 for r in results if r["status"] == "reviewed"),
+            "files_skipped": sum(1 for r in results if r["status"] == "skipped"),
+            "files_failed": sum(1 for r in results if r["status"] == "failed"),
+            "results": sorted(results, key=lambda r: r["filename"]),
+        })
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
\ No newline at end of file
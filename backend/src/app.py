@@ -3,13 +3,64 @@ load_dotenv()
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .api.review import review
+from contextlib import asynccontextmanager
+from .api.review import UPLOAD_LIMITS, review, review_generation_error_handler
 from .api.auth import auth
+from .api.health import health
+from .api.history import history
+from .api.profiling import profiling
+from .services.vector_store import VECTOR_STORE, connect_vector_store, close_vector_store
+from .services.rag import drain_background_tasks, load_tokenizer
+from .services.email_outbox import check_email_config, run_email_worker
+from .services.openai import ReviewGenerationError, close_llm_clients
+from .lib.body_limit import BodySizeLimitMiddleware
+from .lib.metrics import make_metrics_app
+from .lib.profiling import ProfilingMiddleware, start_loop_monitor, stop_loop_monitor
 import uvicorn
 import os
+import asyncio
 from starlette.middleware.sessions import SessionMiddleware
 
-app = FastAPI()
+# Connect to the vector index during startup instead of on the first review.
+VECTOR_STORE_WARMUP = os.getenv("VECTOR_STORE_WARMUP", "false").lower() == "true"
+# Drain the OTP email queue inside each API worker; turn off when running
+# `python manage.py email-worker` as a separate process instead.
+EMAIL_WORKER_IN_PROCESS = os.getenv("EMAIL_WORKER_IN_PROCESS", "true").lower() == "true"
+# Admin-only profiling endpoints, the X-Profile header and the event loop lag
+# monitor (src/lib/profiling.py). Off by default: nothing is installed.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if EMAIL_WORKER_IN_PROCESS:
+        # refuse to start rather than dead-letter every OTP email
+        check_email_config()
+    # Index provisioning is a deploy step (`python manage.py provision-index`);
+    # workers only connect, lazily and once per process.
+    # The local store is single-process; opening it here makes a second
+    # worker fail at startup rather than on its first review.
+    if VECTOR_STORE_WARMUP or VECTOR_STORE == "local":
+        await connect_vector_store()
+    if PROFILING_ENABLED:
+        start_loop_monitor()
+    # loads (or downloads) the RAG tokenizer off the event loop; token budgets
+    # are estimated until it is ready
+    tokenizer = asyncio.create_task(load_tokenizer())
+    email_stop = asyncio.Event()
+    email_worker = asyncio.create_task(run_email_worker(email_stop)) if EMAIL_WORKER_IN_PROCESS else None
+    yield
+    tokenizer.cancel()
+    if email_worker is not None:
+        email_stop.set()
+        await email_worker
+    await drain_background_tasks()
+    close_vector_store()
+    await close_llm_clients()
+    if PROFILING_ENABLED:
+        await stop_loop_monitor()
+
+# Mounted sub-apps do not receive lifespan events, so this lives on the root app.
+app = FastAPI(lifespan=lifespan)
 
 api = FastAPI(
     openapi_url="/openapi.json",
@@ -33,10 +84,24 @@ api.add_middleware(
     secret_key=os.getenv('SESSION_SECRET', os.getenv('JWT_SECRET_KEY'))
 )
 
+# refuse oversized uploads before Starlette spools them
+api.add_middleware(BodySizeLimitMiddleware, limits=UPLOAD_LIMITS)
+
+api.add_exception_handler(ReviewGenerationError, review_generation_error_handler)
+
 api.include_router(review)
 api.include_router(auth)
+api.include_router(health)
+api.include_router(history)
+
+if PROFILING_ENABLED:
+    # outermost, so a profiled request includes the other middleware
+    api.add_middleware(ProfilingMiddleware)
+    api.include_router(profiling)
 
 app.mount("/api", api)
+# Prometheus scrape target; outside /api so it skips CORS and sessions.
+app.mount("/metrics", make_metrics_app())
 
 if __name__ == "__main__":
     uvicorn.run("src.app:app")
\ No newline at end of file
@@ -1,11 +1,20 @@
 import os
+import time
+import uuid
+from fastapi import Request
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from dotenv import load_dotenv
+from .lib.cache import TTLCache
+from .lib.helpers import client_ip, logger, redis_client
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Optional streaming replica for read-only lookups (login, OTP resend, OAuth).
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
 from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
 
 
@@ -42,15 +51,194 @@ def _normalize_database_url(url: str) -> tuple[str, dict | None]:
 
 
 DATABASE_URL, SERVER_SETTINGS = _normalize_database_url(DATABASE_URL)
+DATABASE_REPLICA_URL, REPLICA_SERVER_SETTINGS = _normalize_database_url(DATABASE_REPLICA_URL)
+
+# Pool tuning. Size workers so that
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) stays under Postgres max_connections.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# PgBouncer in transaction/statement mode cannot keep asyncpg's named
+# prepared statements between transactions: disable both statement caches
+# and give every statement a unique name.
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+# After a client commits on the primary, its reads stay on the primary for
+# this many seconds so replication lag cannot hide its own writes.
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "10"))
+READ_YOUR_WRITES_PREFIX = "recent-write:"
+
+
+class PoolStats:
+    """
+    Checkout wait-time counters, updated by InstrumentedPool.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, wait: float):
+        self.checkouts += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records how long each checkout waited for a connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.timeouts += 1
+            raise
+        self.stats.record(time.perf_counter() - start)
+        return conn
+
+
+def _engine_options(url: str, server_settings: dict | None) -> dict:
+    connect_args = {}
+    if server_settings:
+        connect_args["server_settings"] = server_settings
+    options = {"echo": False, "future": True, "connect_args": connect_args}
+    if not url or not url.startswith("postgresql"):
+        return options
+
+    options.update(
+        poolclass=InstrumentedPool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+    if DB_PGBOUNCER:
+        connect_args.update(
+            statement_cache_size=0,
+            prepared_statement_cache_size=0,
+            prepared_statement_name_func=lambda: f"__asyncpg_{uuid.uuid4()}__",
+        )
+    return options
+
+
+def pool_stats(target=None) -> dict:
+    """
+    Connection pool status for monitoring: configured size, connections
+    checked out / idle / in overflow, and checkout wait times.
+    """
+    pool = (target or engine).pool
+    if not isinstance(pool, InstrumentedPool):
+        return {"pool": type(pool).__name__}
+    stats = pool.stats
+    return {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "checkouts": stats.checkouts,
+        "timeouts": stats.timeouts,
+        "wait_seconds_total": stats.wait_total,
+        "wait_seconds_max": stats.wait_max,
+        "wait_seconds_avg": stats.wait_total / stats.checkouts if stats.checkouts else 0.0,
+    }
+
+
+engine = create_async_engine(DATABASE_URL, **_engine_options(DATABASE_URL, SERVER_SETTINGS))
+class _TrackedSession(AsyncSession):
+    """
+    Marks the client in `info["request"]` (set by get_session) as a recent
+    writer once a commit succeeds, before the handler carries on.
+    """
 
-connect_args = {}
-if SERVER_SETTINGS:
-    connect_args["server_settings"] = SERVER_SETTINGS
+    async def commit(self):
+        await super().commit()
+        await mark_recent_write(self.info.get("request"))
 
-engine = create_async_engine(DATABASE_URL, echo=False, future=True, connect_args=connect_args)
-AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+AsyncSessionLocal = sessionmaker(engine, class_=_TrackedSession, expire_on_commit=False)
 Base = declarative_base()
 
-async def get_session():
+replica_engine = None
+ReplicaSessionLocal = AsyncSessionLocal
+if DATABASE_REPLICA_URL:
+    replica_engine = create_async_engine(
+        DATABASE_REPLICA_URL,
+        **_engine_options(DATABASE_REPLICA_URL, REPLICA_SERVER_SETTINGS),
+    )
+    if DATABASE_REPLICA_URL.startswith("postgresql"):
+        replica_engine = replica_engine.execution_options(postgresql_readonly=True)
+    ReplicaSessionLocal = sessionmaker(replica_engine, class_=AsyncSession, expire_on_commit=False)
+
+# Local copy of the shared Redis marker, so this worker skips the round trip.
+_recent_writers = TTLCache(maxsize=10000, ttl=READ_YOUR_WRITES_SECONDS)
+
+
+def _client_key(request: Request | None) -> str | None:
+    if request is None:
+        return None
+    return client_ip(request)
+
+
+async def mark_recent_write(request: Request | None):
+    """
+    Pin the client's reads to the primary for READ_YOUR_WRITES_SECONDS. Called
+    on commit for get_session, and by code that writes through its own session.
+    The marker lives in Redis because the client's next request may be served
+    by another worker.
+    """
+    key = _client_key(request)
+    if key is None:
+        return
+    _recent_writers.set(key, True)
+    try:
+        await redis_client.set(READ_YOUR_WRITES_PREFIX + key, 1, px=int(READ_YOUR_WRITES_SECONDS * 1000))
+    except Exception as e:
+        logger.warning(f"Redis error marking a recent write: {e}")
+
+
+async def _is_recent_writer(key: str | None) -> bool:
+    if key is None:
+        return False
+    if _recent_writers.get(key):
+        return True
+    try:
+        return bool(await redis_client.exists(READ_YOUR_WRITES_PREFIX + key))
+    except Exception as e:
+        # without the shared marker a replica read may miss the client's own write
+        logger.warning(f"Redis error checking recent writes, reading from the primary: {e}")
+        return True
+
+
+async def get_session(request: Request = None):
+    """
+    Primary session. Commits mark the calling client so its following reads
+    through get_read_session also go to the primary.
+    """
     async with AsyncSessionLocal() as session:
+        session.info["request"] = request
+        yield session
+
+async def get_read_session(request: Request = None):
+    """
+    Session for pure reads. Uses the replica when one is configured, unless
+    the client committed on the primary within READ_YOUR_WRITES_SECONDS.
+    """
+    if replica_engine is None or await _is_recent_writer(_client_key(request)):
+        async with AsyncSessionLocal() as session:
+            yield session
+        return
+    async with ReplicaSessionLocal() as session:
         yield session
\ No newline at end of file
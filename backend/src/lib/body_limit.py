@@ -0,0 +1,56 @@
+"""
+Reject oversized request bodies before they are read. Starlette parses a
+multipart form, spooling every file to memory or disk, before the endpoint
+(or any dependency) runs, so a size check in the handler only fires after
+the whole upload has been received.
+"""
+import os
+from fastapi import HTTPException
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+# Room for the multipart boundaries, part headers and small form fields on
+# top of the file size limit.
+MULTIPART_OVERHEAD_BYTES = int(os.getenv("MULTIPART_OVERHEAD_BYTES", str(64 * 1024)))
+
+
+class BodySizeLimitMiddleware:
+    """
+    `limits` maps a route path (relative to the app this is installed on) to
+    the largest file it accepts. A Content-Length over the limit is refused
+    with 413 straight away; bodies without one (chunked) are counted as they
+    arrive and abort with 413 once they cross it.
+    """
+
+    def __init__(self, app, limits: dict[str, int], overhead: int = MULTIPART_OVERHEAD_BYTES):
+        self.app = app
+        self.limits = limits
+        self.overhead = overhead
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        path, root = scope["path"], scope.get("root_path", "")
+        max_bytes = self.limits.get(path[len(root):] if path.startswith(root) else path)
+        if max_bytes is None:
+            return await self.app(scope, receive, send)
+
+        detail = f"Upload exceeds the {max_bytes} byte limit"
+        limit = max_bytes + self.overhead
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            return await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI re-raises HTTPExceptions from body parsing as-is
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
\ No newline at end of file
@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Small thread-safe in-process LRU cache with per-entry TTL and hit/miss counters.
+
+    Entries are evicted when they expire or when the cache grows past
+    `maxsize` (least recently used first).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.evictions += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float | None = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
\ No newline at end of file
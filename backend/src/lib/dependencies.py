@@ -0,0 +1,138 @@
+import os
+import json
+import time
+from dataclasses import dataclass, asdict
+from fastapi import Depends, HTTPException, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..db import get_read_session
+from ..models.db_models import User
+from .cache import TTLCache
+from .helpers import verify_token, redis_client, logger
+from .metrics import record_cache, timed
+
+# Verified access tokens are kept for at most this long (and never past their
+# own expiry), so a hot client skips the HS256 decode on most requests.
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", "300"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "60"))
+# Share cached users between workers through Redis as well.
+USER_CACHE_REDIS = os.getenv("USER_CACHE_REDIS", "false").lower() == "true"
+
+_token_cache = TTLCache(maxsize=AUTH_TOKEN_CACHE_SIZE, ttl=AUTH_TOKEN_CACHE_TTL)
+_user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+@dataclass
+class CurrentUser:
+    id: str
+    email: str
+    first_name: str | None
+    last_name: str | None
+    verified: bool
+
+
+def _user_cache_key(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+def decode_access_token(token: str) -> dict | None:
+    """
+    verify_token with a TTL-bounded LRU in front. Returns the payload, or None
+    for an invalid or expired token, or one that is not an access token (a
+    refresh token sent as the access_token cookie).
+    """
+    payload = _token_cache.get(token)
+    if payload is not None:
+        record_cache("auth_token", "hit")
+        return payload
+    record_cache("auth_token", "miss")
+    payload = verify_token(token)
+    if not payload or not payload.get("sub") or payload.get("type") != "access":
+        return None
+    remaining = payload.get("exp", 0) - time.time()
+    if remaining > 0:
+        _token_cache.set(token, payload, ttl=min(AUTH_TOKEN_CACHE_TTL, remaining))
+    return payload
+
+
+async def get_optional_user_id(request: Request) -> str | None:
+    """
+    Id of the caller from the access_token cookie, or None for anonymous
+    callers. No database access.
+    """
+    token = request.cookies.get("access_token")
+    if not token:
+        return None
+    payload = decode_access_token(token)
+    return payload["sub"] if payload else None
+
+
+async def get_current_user_id(user_id: str | None = Depends(get_optional_user_id)) -> str:
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return user_id
+
+
+async def _load_user(user_id: str, session: AsyncSession) -> CurrentUser | None:
+    user = _user_cache.get(user_id)
+    if user is not None:
+        record_cache("user", "local")
+        return user
+
+    if USER_CACHE_REDIS:
+        try:
+            cached = await redis_client.get(_user_cache_key(user_id))
+            if cached:
+                user = CurrentUser(**json.loads(cached))
+                _user_cache.set(user_id, user)
+                record_cache("user", "redis")
+                return user
+        except Exception as e:
+            logger.warning(f"User cache read failed: {e}")
+
+    record_cache("user", "miss")
+    with timed("db_load_user"):
+        row = (
+            await session.execute(
+                select(User.id, User.email, User.first_name, User.last_name, User.verified).where(User.id == user_id)
+            )
+        ).first()
+    if row is None:
+        return None
+    user = CurrentUser(id=row.id, email=row.email, first_name=row.first_name, last_name=row.last_name, verified=bool(row.verified))
+    _user_cache.set(user_id, user)
+    if USER_CACHE_REDIS:
+        try:
+            await redis_client.setex(_user_cache_key(user_id), USER_CACHE_TTL, json.dumps(asdict(user)))
+        except Exception as e:
+            logger.warning(f"User cache write failed: {e}")
+    return user
+
+
+async def get_current_user(
+    user_id: str = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_read_session),
+) -> CurrentUser:
+    """
+    The authenticated user. Served from the in-process cache (then Redis when
+    USER_CACHE_REDIS is on); the session only connects on a cache miss.
+    """
+    user = await _load_user(user_id, session)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return user
+
+
+async def invalidate_user(user_id: str):
+    """
+    Drop a cached user after its row changes. Other workers' in-process
+    copies expire within USER_CACHE_TTL.
+    """
+    _user_cache.pop(user_id)
+    if USER_CACHE_REDIS:
+        try:
+            await redis_client.delete(_user_cache_key(user_id))
+        except Exception as e:
+            logger.warning(f"User cache invalidation failed: {e}")
@@ -5,12 +5,12 @@ import os
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from ..models.db_models import User
-from ..db import get_session
+from ..db import get_session, get_read_session
 from .helpers import (
     create_access_token,
     create_refresh_token,
     redis_client,
-    hash_password,
+    UNUSABLE_PASSWORD,
     generateUserId,
     ACCESS_TOKEN_EXPIRE_MINUTES,
     REFRESH_TOKEN_EXPIRE_DAYS,
@@ -41,7 +41,7 @@ async def github_login(request: Request):
 
 
 @router.get('/callback', name='github_callback')
-async def github_callback(request: Request, session: AsyncSession = Depends(get_session)):
+async def github_callback(request: Request, read_session: AsyncSession = Depends(get_read_session), session: AsyncSession = Depends(get_session)):
     try:
         token = await oauth.github.authorize_access_token(request)
         # fetch user info
@@ -68,17 +68,20 @@ async def github_callback(request: Request, session: AsyncSession = Depends(get_
     if not email:
         raise HTTPException(status_code=400, detail="No email available from GitHub")
 
-    result = await session.execute(select(User).where(User.email == email))
+    # Returning users are resolved on the replica; only a miss is re-checked
+    # on the primary before creating the account.
+    result = await read_session.execute(select(User).where(User.email == email))
     user = result.scalars().first()
     if not user:
-        import secrets
-        pwd = secrets.token_urlsafe(24)
+        result = await session.execute(select(User).where(User.email == email))
+        user = result.scalars().first()
+    if not user:
         user = User(
             id=generateUserId(),
             first_name=profile.get('name'),
             last_name=None,
             email=email,
-            password=hash_password(pwd),
+            password=UNUSABLE_PASSWORD,
             verified=True,
         )
         session.add(user)
@@ -4,15 +4,19 @@ load_dotenv()
 import redis.asyncio as redis
 from jose import jwt
 from passlib.context import CryptContext
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
 import os
 import random
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 import string
 import logging
 import re
 from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime, timedelta
+from .metrics import timed
 
 # Logging
 logging.basicConfig(level=logging.INFO)
@@ -24,11 +28,20 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 30
 
 REDIS_URL = os.getenv("REDIS_URL")
-SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY")
-SENDGRID_FROM_EMAIL = os.getenv("SENDGRID_FROM_EMAIL")
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt releases the GIL, so a small thread pool runs hashes in parallel
+# without blocking the event loop. Size it to the cores a worker may spend on
+# password checks; requests beyond BCRYPT_MAX_QUEUE waiting hashes get a 503.
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", str(min(4, os.cpu_count() or 1))))
+BCRYPT_MAX_QUEUE = int(os.getenv("BCRYPT_MAX_QUEUE", "32"))
+_bcrypt_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+_bcrypt_pending = 0
+
+# Stored for accounts that sign in through OAuth only; never matches a password.
+UNUSABLE_PASSWORD = "!"
+
 # Redis client
 redis_client = redis.from_url(REDIS_URL)
 
@@ -48,12 +61,47 @@ class VerifyRequest(BaseModel):
     otp: str = Field(..., min_length=6, max_length=6)
 
 # Helpers
+class PasswordHasherBusy(Exception):
+    """Raised when too many bcrypt operations are already queued."""
+
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
+    if not hashed_password or hashed_password == UNUSABLE_PASSWORD:
+        return False
     return pwd_context.verify(plain_password, hashed_password)
 
+def _bcrypt_done(_future):
+    global _bcrypt_pending
+    _bcrypt_pending -= 1
+
+async def _run_bcrypt(fn, *args):
+    """
+    Run fn on the bcrypt pool. The pending count is released when the thread
+    finishes, not when the caller stops waiting, so cancelled requests still
+    count against the queue limit while their hash is running.
+    """
+    global _bcrypt_pending
+    if _bcrypt_pending >= BCRYPT_WORKERS + BCRYPT_MAX_QUEUE:
+        raise PasswordHasherBusy()
+    _bcrypt_pending += 1
+    future = _bcrypt_executor.submit(fn, *args)
+    # done callbacks run on the worker thread; hop back to the loop
+    loop = asyncio.get_running_loop()
+    future.add_done_callback(lambda f: loop.call_soon_threadsafe(_bcrypt_done, f))
+    return await asyncio.wrap_future(future)
+
+async def hash_password_async(password: str) -> str:
+    with timed("bcrypt_hash"):
+        return await _run_bcrypt(hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    if not hashed_password or hashed_password == UNUSABLE_PASSWORD:
+        return False
+    with timed("bcrypt_verify"):
+        return await _run_bcrypt(verify_password, plain_password, hashed_password)
+
 def validate_password_strength(password: str) -> bool:
     """Check if password meets minimum requirements: 8+ chars, upper, lower, digit, special"""
     if len(password) < 8:
@@ -68,31 +116,119 @@ def validate_password_strength(password: str) -> bool:
         return False
     return True
 
+# Sliding-window log per key in a sorted set. All keys are checked before any
+# is recorded, so a request rejected by one limit does not count against the
+# others; the whole call is a single atomic EVALSHA.
+# KEYS: one sorted set per limit. ARGV: member, then (limit, window_ms) pairs.
+# Returns 0 when allowed, else the 1-based index of the first exceeded limit.
+_SLIDING_WINDOW_LUA = """
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[i * 2])
+    local window = tonumber(ARGV[i * 2 + 1])
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    if redis.call('ZCARD', key) >= limit then
+        return i
+    end
+end
+for i, key in ipairs(KEYS) do
+    redis.call('ZADD', key, now, ARGV[1])
+    redis.call('PEXPIRE', key, tonumber(ARGV[i * 2 + 1]))
+end
+return 0
+"""
+_sliding_window = redis_client.register_script(_SLIDING_WINDOW_LUA)
+
+RATE_LIMIT_PREFIX = "rl:"
+# After a Redis error, use the in-process limiter for this long before retrying.
+RATE_LIMIT_REDIS_RETRY = float(os.getenv("RATE_LIMIT_REDIS_RETRY", "5"))
+RATE_LIMIT_LOCAL_KEYS = int(os.getenv("RATE_LIMIT_LOCAL_KEYS", "10000"))
+_redis_down_until = 0.0
+
+
+class LocalRateLimiter:
+    """
+    In-process sliding-window fallback used while Redis is unreachable. Limits
+    apply per worker, so the effective limit is approximate across workers.
+    """
+
+    def __init__(self, max_keys: int = RATE_LIMIT_LOCAL_KEYS):
+        self.max_keys = max_keys
+        self._hits: OrderedDict[str, deque] = OrderedDict()
+
+    def hit(self, limits: list[tuple[str, int, int]]) -> bool:
+        now = time.monotonic()
+        windows = []
+        for key, limit, window_seconds in limits:
+            hits = self._hits.get(key)
+            if hits is None:
+                hits = self._hits[key] = deque()
+            self._hits.move_to_end(key)
+            while hits and hits[0] <= now - window_seconds:
+                hits.popleft()
+            if len(hits) >= limit:
+                return False
+            windows.append(hits)
+        for hits in windows:
+            hits.append(now)
+        while len(self._hits) > self.max_keys:
+            self._hits.popitem(last=False)
+        return True
+
+
+_local_limiter = LocalRateLimiter()
+
+def client_ip(request) -> str:
+    # X-Forwarded-For is client-supplied, so it is never read here. Behind a
+    # proxy, uvicorn's --proxy-headers (on by default) rewrites request.client
+    # from it, but only for proxies listed in --forwarded-allow-ips
+    # (FORWARDED_ALLOW_IPS, 127.0.0.1 by default).
+    return request.client.host if request.client else "unknown"
+
+async def rate_limit_many(limits: list[tuple[str, int, int]]) -> bool:
+    """
+    Check and record one hit against several (key, limit, window_seconds)
+    limits at once, e.g. per email and per IP. Returns True if all allow it.
+    """
+    global _redis_down_until
+    if time.monotonic() >= _redis_down_until:
+        keys = [RATE_LIMIT_PREFIX + key for key, _, _ in limits]
+        args = [uuid.uuid4().hex]
+        for _, limit, window_seconds in limits:
+            args += [limit, int(window_seconds * 1000)]
+        try:
+            with timed("rate_limit_redis"):
+                exceeded = await _sliding_window(keys=keys, args=args)
+        except Exception as e:
+            logger.error(f"Redis error in rate_limit: {e}. Using local limiter for {RATE_LIMIT_REDIS_RETRY}s.")
+            _redis_down_until = time.monotonic() + RATE_LIMIT_REDIS_RETRY
+        else:
+            if exceeded:
+                logger.warning(f"Rate limit exceeded for key: {limits[int(exceeded) - 1][0]}")
+                return False
+            return True
+
+    if not _local_limiter.hit(limits):
+        logger.warning(f"Rate limit exceeded (local) for keys: {[key for key, _, _ in limits]}")
+        return False
+    return True
+
 async def rate_limit(key: str, limit: int, window_seconds: int) -> bool:
     """Rate limiting using Redis. Returns True if allowed, False if exceeded."""
-    try:
-        current = await redis_client.incr(key)
-        if current == 1:
-            await redis_client.expire(key, window_seconds)
-        if current > limit:
-            logger.warning(f"Rate limit exceeded for key: {key}")
-            return False
-        return True
-    except Exception as e:
-        logger.error(f"Redis error in rate_limit: {e}. Allowing request.")
-        return True  # Allow if Redis fails
+    return await rate_limit_many([(key, limit, window_seconds)])
 
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "type": "access"})
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
 def create_refresh_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "type": "refresh"})
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
@@ -110,26 +246,4 @@ def generateUserId(length: int = 8) -> str:
     """Generate a short human-friendly ID of configurable length (default 8)."""
     alphabet: str = string.ascii_letters + string.digits
     short_id: str = ''.join(random.choices(alphabet, k=length))
-    return short_id
-
-async def send_otp_email(email: str, otp: str):
-    message = Mail(
-        from_email=SENDGRID_FROM_EMAIL,
-        to_emails=email,
-        subject='Your OTP Code',
-        html_content=f'<p>Your OTP code is: <strong>{otp}</strong></p>'
-    )
-    sg = SendGridAPIClient(SENDGRID_API_KEY)
-    try:
-        # SendGrid client is synchronous; run in thread to avoid blocking the event loop
-        from anyio import to_thread
-        resp = await to_thread.run_sync(lambda: sg.send(message))
-        # resp has status_code and body
-        status = getattr(resp, "status_code", None) or getattr(resp, "status", None)
-        if status and int(status) >= 400:
-            logger.error(f"SendGrid send failed: status={status} body={getattr(resp,'body',None)}")
-            raise Exception(f"SendGrid error: {status}")
-        logger.info(f"OTP email sent to {email}, status={status}")
-    except Exception as e:
-        logger.error(f"SendGrid error when sending OTP to {email}: {e}")
-        raise
\ No newline at end of file
+    return short_id
\ No newline at end of file
@@ -0,0 +1,100 @@
+"""
+Prometheus metrics for the review pipeline and auth.
+
+    kaiflow_stage_seconds{stage}               latency histogram per pipeline stage
+    kaiflow_llm_tokens_total{model, kind}      prompt / completion / embedding tokens
+    kaiflow_llm_requests_total{route, outcome} LLM attempts (ok, timeout, rate_limited, ...)
+    kaiflow_llm_hedges_total{route}            hedged requests sent to a route
+    kaiflow_cache_lookups_total{cache, result} cache hits and misses; hit ratio is
+        sum by (cache) (rate(...{result!="miss"}[5m])) / sum by (cache) (rate(...[5m]))
+    kaiflow_event_loop_lag_seconds             timer lateness (with PROFILING_ENABLED)
+
+With several workers (gunicorn/uvicorn --workers), set PROMETHEUS_MULTIPROC_DIR
+to an empty directory shared by all of them so /metrics aggregates every
+process instead of whichever one served the scrape.
+"""
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, make_asgi_app, multiprocess
+
+# request stages span ~1 ms (cache lookups) to minutes (reasoning models)
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "kaiflow_stage_seconds",
+    "Time spent in each review/auth pipeline stage",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "kaiflow_llm_tokens_total",
+    "Tokens reported by the model provider",
+    ["model", "kind"],
+)
+LLM_REQUESTS = Counter(
+    "kaiflow_llm_requests_total",
+    "LLM attempts by route and outcome",
+    ["route", "outcome"],
+)
+LLM_HEDGES = Counter(
+    "kaiflow_llm_hedges_total",
+    "Hedged LLM requests by the route they were sent to",
+    ["route"],
+)
+CACHE_LOOKUPS = Counter(
+    "kaiflow_cache_lookups_total",
+    "Cache lookups by cache and result",
+    ["cache", "result"],
+)
+
+# only observed while the profiling loop monitor runs (PROFILING_ENABLED)
+LOOP_LAG = Histogram(
+    "kaiflow_event_loop_lag_seconds",
+    "How late the event loop ran a timer callback",
+    buckets=STAGE_BUCKETS,
+)
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    Observe the duration of the block (including any awaits inside it) in
+    kaiflow_stage_seconds{stage=...}, whether it returns or raises.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+def record_usage(model: str, usage, prompt_kind: str = "prompt"):
+    """
+    Count tokens from an OpenAI-style `usage` object (embedding calls pass
+    prompt_kind="embedding"); responses without usage are ignored.
+    """
+    if usage is None:
+        return
+    prompt = getattr(usage, "prompt_tokens", 0) or 0
+    completion = getattr(usage, "completion_tokens", 0) or 0
+    if prompt:
+        LLM_TOKENS.labels(model, prompt_kind).inc(prompt)
+    if completion:
+        LLM_TOKENS.labels(model, "completion").inc(completion)
+
+
+def record_cache(cache: str, result: str, count: int = 1):
+    if count:
+        CACHE_LOOKUPS.labels(cache, result).inc(count)
+
+
+def make_metrics_app():
+    """
+    ASGI app serving the Prometheus text format, for mounting at /metrics.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return make_asgi_app(registry=registry)
+    return make_asgi_app(registry=REGISTRY)
\ No newline at end of file
@@ -0,0 +1,268 @@
+"""
+Opt-in profiling for live workers. Nothing here is installed unless
+PROFILING_ENABLED=true (see app.py), and every entry point requires the
+X-Admin-Token header to match PROFILING_ADMIN_TOKEN.
+
+    X-Profile: text | html | cprofile   profile this request and return the report
+                                        instead of its response (pyinstrument when
+                                        installed, otherwise cProfile)
+    GET /api/debug/profile?seconds=10   sample every thread of the worker and
+                                        download collapsed stacks (flamegraph.pl,
+                                        speedscope, inferno)
+    GET /api/debug/loop-lag             event loop lag and the stacks that were
+                                        running while the loop was blocked
+"""
+import os
+import io
+import sys
+import hmac
+import time
+import asyncio
+import cProfile
+import pstats
+import threading
+from collections import Counter, deque
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
+from .metrics import LOOP_LAG
+from .helpers import logger
+
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+PROFILE_CPROFILE_LINES = int(os.getenv("PROFILE_CPROFILE_LINES", "60"))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.25"))
+# A loop that has not run the monitor's tick for this long counts as blocked,
+# and the stack it is stuck in is captured.
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", "0.1"))
+
+ADMIN_HEADER = "x-admin-token"
+PROFILE_HEADER = "x-profile"
+
+# Only one profiler can hook the interpreter at a time.
+_request_profile_lock = asyncio.Lock()
+_sampling_lock = threading.Lock()
+
+
+def is_admin(headers) -> bool:
+    if not PROFILING_ADMIN_TOKEN:
+        return False
+    return hmac.compare_digest(headers.get(ADMIN_HEADER, ""), PROFILING_ADMIN_TOKEN)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    # ';' separates frames in the collapsed format
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+def _stack(frame) -> list[str]:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class _RequestProfiler:
+    """
+    pyinstrument in async mode attributes time to the profiled request's own
+    task. cProfile cannot tell tasks apart and also counts whatever other
+    requests ran on the loop meanwhile.
+    """
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self._pyinstrument = None
+        self._cprofile = None
+        if mode != "cprofile":
+            try:
+                from pyinstrument import Profiler
+                self._pyinstrument = Profiler(interval=0.001, async_mode="enabled")
+            except ImportError:
+                pass
+        if self._pyinstrument is None:
+            self._cprofile = cProfile.Profile()
+
+    def start(self):
+        if self._pyinstrument is not None:
+            self._pyinstrument.start()
+        else:
+            self._cprofile.enable()
+
+    def stop(self) -> Response:
+        if self._pyinstrument is not None:
+            self._pyinstrument.stop()
+            if self.mode == "html":
+                return Response(self._pyinstrument.output_html(), media_type="text/html")
+            return Response(self._pyinstrument.output_text(unicode=True, show_all=False), media_type="text/plain")
+        self._cprofile.disable()
+        out = io.StringIO()
+        stats = pstats.Stats(self._cprofile, stream=out)
+        stats.sort_stats("cumulative").print_stats(PROFILE_CPROFILE_LINES)
+        return Response(out.getvalue(), media_type="text/plain")
+
+
+class ProfilingMiddleware:
+    """
+    Profile requests that carry X-Profile from an admin. The handler runs to
+    completion (streaming bodies included) and its body is discarded; the
+    original status is returned in X-Profiled-Status.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        if not PROFILING_ADMIN_TOKEN:
+            logger.warning("PROFILING_ENABLED without PROFILING_ADMIN_TOKEN: all profiling requests will be refused")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = Headers(scope=scope)
+        mode = headers.get(PROFILE_HEADER)
+        if not mode:
+            return await self.app(scope, receive, send)
+        if not is_admin(headers):
+            return await JSONResponse(status_code=403, content={"error": "Forbidden"})(scope, receive, send)
+        if _request_profile_lock.locked() or _sampling_lock.locked():
+            return await JSONResponse(status_code=409, content={"error": "Another profile is running"})(scope, receive, send)
+
+        status = None
+
+        async def capture(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        async with _request_profile_lock:
+            profiler = _RequestProfiler(mode.strip().lower())
+            start = time.perf_counter()
+            profiler.start()
+            try:
+                await self.app(scope, receive, capture)
+            finally:
+                report = profiler.stop()
+        report.headers["X-Profiled-Status"] = str(status)
+        report.headers["X-Profiled-Seconds"] = f"{time.perf_counter() - start:.6f}"
+        await report(scope, receive, send)
+
+
+def sample_stacks(seconds: float, interval: float = PROFILE_SAMPLE_INTERVAL) -> str:
+    """
+    Sample the stack of every other thread (the event loop, thread pools)
+    every `interval` seconds for `seconds`, and return them in collapsed
+    format: one "thread;outer;...;inner count" line per distinct stack.
+    Blocks; run it in a thread.
+    """
+    if not _sampling_lock.acquire(blocking=False):
+        raise RuntimeError("Another profile is running")
+    try:
+        me = threading.get_ident()
+        counts = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                thread = names.get(ident, str(ident)).replace(";", ":").replace(" ", "_")
+                counts[";".join([thread] + _stack(frame))] += 1
+            time.sleep(interval)
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+    finally:
+        _sampling_lock.release()
+
+
+class LoopLagMonitor:
+    """
+    A task that sleeps LOOP_LAG_INTERVAL and measures how late it wakes up,
+    plus a watchdog thread that captures the loop thread's stack whenever a
+    tick is overdue by LOOP_LAG_THRESHOLD, i.e. while something synchronous
+    is still holding the loop.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_LAG_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.blocked_count = 0
+        self.blocked = deque(maxlen=20)
+        self._lags = deque(maxlen=int(60 / interval) or 1)
+        self._due = 0.0
+        self._loop_thread = None
+        self._task = None
+        self._stop = threading.Event()
+        self._watchdog = None
+
+    def start(self):
+        self._loop_thread = threading.get_ident()
+        self._due = time.monotonic() + self.interval
+        self._task = asyncio.create_task(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _tick(self):
+        while True:
+            self._due = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - self._due)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self._lags.append(lag)
+            LOOP_LAG.observe(lag)
+
+    def _watch(self):
+        captured_for = None
+        while not self._stop.wait(self.threshold / 2):
+            due = self._due
+            overdue = time.monotonic() - due
+            if overdue < self.threshold or captured_for == due:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            captured_for = due
+            stack = _stack(frame)
+            self.blocked_count += 1
+            self.blocked.append({"at": time.time(), "overdue_seconds": round(overdue, 4), "stack": stack})
+            logger.warning(f"Event loop blocked for {overdue:.3f}s in: {' <- '.join(reversed(stack[-5:]))}")
+
+    def stats(self) -> dict:
+        lags = sorted(self._lags)
+        return {
+            "interval_seconds": self.interval,
+            "threshold_seconds": self.threshold,
+            "last_lag_seconds": self.last_lag,
+            "max_lag_seconds": self.max_lag,
+            "p99_lag_seconds_last_minute": lags[int(len(lags) * 0.99) - 1] if lags else 0.0,
+            "blocked_count": self.blocked_count,
+            "recent_blocks": list(self.blocked),
+        }
+
+
+loop_monitor: LoopLagMonitor | None = None
+
+
+def start_loop_monitor() -> LoopLagMonitor:
+    global loop_monitor
+    loop_monitor = LoopLagMonitor()
+    loop_monitor.start()
+    return loop_monitor
+
+
+async def stop_loop_monitor():
+    global loop_monitor
+    if loop_monitor is not None:
+        await loop_monitor.stop()
+        loop_monitor = None
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from ..db import Base
@@ -22,7 +22,17 @@ class Conversation(Base):
 
     user = relationship("User", backref="conversations")
 
+    __table_args__ = (
+        # keyset pagination of a user's conversations
+        Index("ix_conversations_user_created_id", "user_id", "created_at", "id"),
+    )
+
 class Message(Base):
+    """
+    On Postgres this table is range-partitioned by month on created_at
+    (migration b7e2c4f19a53) with primary key (id, created_at); ids still come
+    from a single sequence, so the ORM identifies rows by id alone.
+    """
     __tablename__ = "messages"
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
@@ -30,7 +40,29 @@ class Message(Base):
     role = Column(String(20), nullable=False)  # "user" | "assistant"
     text = Column(Text, nullable=False)
     pinecone_id = Column(String(128), nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
 
     conversation = relationship("Conversation", backref="messages")
     user = relationship("User", backref="messages")
+
+    __table_args__ = (
+        # keyset pagination of a conversation's messages
+        Index("ix_messages_conversation_created_id", "conversation_id", "created_at", "id"),
+    )
+
+class EmbeddingOutbox(Base):
+    """
+    Messages waiting to be embedded and upserted to the vector store. Written
+    in the same transaction as the Message; drained by the outbox worker.
+    """
+    __tablename__ = "embedding_outbox"
+    id = Column(Integer, primary_key=True, index=True)
+    # no foreign key: messages is partitioned, and rows of dropped partitions
+    # are removed by the retention job (`manage.py partitions`)
+    message_id = Column(Integer, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), index=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    message = relationship("Message", primaryjoin="foreign(EmbeddingOutbox.message_id) == Message.id")
@@ -0,0 +1,132 @@
+import lzma
+import os
+import tarfile
+import tempfile
+import zipfile
+import zlib
+from dataclasses import dataclass
+from typing import IO, Iterator
+from fastapi import HTTPException, UploadFile
+from .ingest import TextDecoder, is_supported_filename
+
+MAX_ARCHIVE_BYTES = int(os.getenv("MAX_ARCHIVE_BYTES", str(50 * 1024 * 1024)))
+MAX_ARCHIVE_FILES = int(os.getenv("MAX_ARCHIVE_FILES", "200"))
+ARCHIVE_READ_SIZE = 64 * 1024
+# archives up to this size stay in memory while spooled, larger ones go to disk
+ARCHIVE_SPOOL_MEMORY = 1024 * 1024
+
+UNSUPPORTED_ARCHIVE = "Unsupported archive format; upload a zip or tar file"
+# What a truncated or corrupt archive raises while it is being read (gzip and
+# bz2 report bad streams as OSError).
+_CORRUPT_ARCHIVE_ERRORS = (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError, zlib.error, lzma.LZMAError)
+
+
+@dataclass
+class ArchiveEntry:
+    """
+    A supported source file from an archive. `code` is None when the entry
+    was skipped, with the reason in `error`.
+    """
+    filename: str
+    code: str | None = None
+    error: str | None = None
+
+
+async def spool_upload(file: UploadFile, max_bytes: int = MAX_ARCHIVE_BYTES) -> IO[bytes]:
+    """
+    Copy an uploaded archive into a temporary file owned by the caller, so it
+    outlives the request body (streamed responses keep reading it after the
+    handler returns). The copy is chunked and aborts with 413 past `max_bytes`.
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Archive exceeds the {max_bytes} byte limit")
+    spool = tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_MEMORY)
+    size = 0
+    try:
+        while True:
+            chunk = await file.read(ARCHIVE_READ_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"Archive exceeds the {max_bytes} byte limit")
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def _decode(stream: IO[bytes], max_bytes: int) -> str:
+    decoder = TextDecoder(max_bytes)
+    while True:
+        chunk = stream.read(ARCHIVE_READ_SIZE)
+        if not chunk:
+            break
+        decoder.feed(chunk)
+    return decoder.finish()
+
+
+def _entry(filename: str, opener, max_bytes: int) -> ArchiveEntry:
+    try:
+        with opener() as stream:
+            code = _decode(stream, max_bytes)
+    except HTTPException as e:
+        return ArchiveEntry(filename, error=e.detail)
+    except NotImplementedError:
+        # zipfile: a compression method it cannot decompress (a RuntimeError
+        # subclass, so it is caught first)
+        return ArchiveEntry(filename, error="Unsupported compression method")
+    except RuntimeError:
+        # zipfile: "File ... is encrypted, password required for extraction"
+        return ArchiveEntry(filename, error="Encrypted files are not supported")
+    if not code.strip():
+        return ArchiveEntry(filename, error="File is empty")
+    return ArchiveEntry(filename, code=code)
+
+
+def iter_archive(fileobj: IO[bytes], max_file_bytes: int, max_files: int = MAX_ARCHIVE_FILES) -> Iterator[ArchiveEntry]:
+    """
+    Lazily walk a zip or tar (optionally compressed) archive and yield its
+    supported source files one at a time, so only the entry being read is
+    held in memory. Sizes are enforced on the decompressed bytes actually
+    read, which also bounds compression bombs. An unreadable archive raises
+    HTTPException(400), possibly after some entries were already yielded.
+
+    This is blocking file I/O; drive it from a worker thread.
+    """
+    try:
+        yield from _walk_archive(fileobj, max_file_bytes, max_files)
+    except _CORRUPT_ARCHIVE_ERRORS:
+        raise HTTPException(status_code=400, detail=UNSUPPORTED_ARCHIVE)
+
+
+def _walk_archive(fileobj: IO[bytes], max_file_bytes: int, max_files: int) -> Iterator[ArchiveEntry]:
+    fileobj.seek(0)
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            count = 0
+            for info in archive.infolist():
+                if info.is_dir() or not is_supported_filename(info.filename):
+                    continue
+                count += 1
+                if count > max_files:
+                    yield ArchiveEntry(info.filename, error=f"Archive file limit of {max_files} reached")
+                    return
+                yield _entry(info.filename, lambda: archive.open(info), max_file_bytes)
+        return
+
+    fileobj.seek(0)
+    # stream mode ("r|*") reads members sequentially without seeking back
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        count = 0
+        for member in archive:
+            if not member.isfile() or not is_supported_filename(member.name):
+                continue
+            count += 1
+            if count > max_files:
+                yield ArchiveEntry(member.name, error=f"Archive file limit of {max_files} reached")
+                return
+            yield _entry(member.name, lambda: archive.extractfile(member), max_file_bytes)
\ No newline at end of file
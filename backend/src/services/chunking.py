@@ -0,0 +1,114 @@
+import os
+from dataclasses import dataclass
+from pygments.lexer import Lexer
+from pygments.token import Keyword
+
+# ~1k tokens per chunk keeps every chunk well inside the embedding model's limit
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", "4000"))
+
+# Keywords that open a function/class-like definition in the supported languages.
+DEFINITION_KEYWORDS = {
+    "def", "class", "function", "func", "fn", "fun", "struct", "interface",
+    "impl", "trait", "enum", "module", "object", "procedure", "sub",
+    "public", "private", "protected", "internal", "static", "export",
+}
+
+# Modifiers that may precede a definition keyword on the same line.
+MODIFIER_KEYWORDS = {"async", "pub", "abstract", "final", "default", "override", "open", "data", "sealed"}
+
+COMMENT_PREFIXES = ("@", "#", "//", "/*", "*", "--")
+
+
+@dataclass
+class CodeChunk:
+    text: str
+    start: int
+    end: int
+    start_line: int
+
+
+def _definition_starts(code: str, lexer: Lexer) -> list[tuple[int, int]]:
+    """
+    Return (line_start_offset, indent) for every line that begins with a
+    definition keyword, moved up to include decorators and leading comments.
+    """
+    starts = []
+    seen_lines = set()
+    for index, tokentype, value in lexer.get_tokens_unprocessed(code):
+        if tokentype not in Keyword or value not in DEFINITION_KEYWORDS:
+            continue
+        line_start = code.rfind("\n", 0, index) + 1
+        prefix = code[line_start:index]
+        if line_start in seen_lines or not set(prefix.split()) <= MODIFIER_KEYWORDS | DEFINITION_KEYWORDS:
+            continue
+        seen_lines.add(line_start)
+        while line_start > 0:
+            prev_start = code.rfind("\n", 0, line_start - 1) + 1
+            prev_line = code[prev_start:line_start].strip()
+            if not prev_line.startswith(COMMENT_PREFIXES):
+                break
+            line_start = prev_start
+        indent = len(prefix) - len(prefix.lstrip())
+        starts.append((line_start, len(prefix[:indent].expandtabs(4))))
+    return starts
+
+
+def _split_lines(code: str, start: int, end: int, max_chars: int) -> list[tuple[int, int]]:
+    spans = []
+    cursor = start
+    while end - cursor > max_chars:
+        cut = code.rfind("\n", cursor, cursor + max_chars)
+        cut = cursor + max_chars if cut <= cursor else cut + 1
+        spans.append((cursor, cut))
+        cursor = cut
+    spans.append((cursor, end))
+    return spans
+
+
+def _split_span(code: str, start: int, end: int, boundaries: list[tuple[int, int]], max_chars: int) -> list[tuple[int, int]]:
+    if end - start <= max_chars:
+        return [(start, end)]
+    inner = [(offset, indent) for offset, indent in boundaries if start < offset < end]
+    if not inner:
+        return _split_lines(code, start, end, max_chars)
+    # split on the outermost definitions first, recurse into oversized ones
+    level = min(indent for _, indent in inner)
+    cuts = [start] + [offset for offset, indent in inner if indent == level] + [end]
+    nested = [b for b in inner if b[1] > level]
+    spans = []
+    for a, b in zip(cuts, cuts[1:]):
+        spans.extend(_split_span(code, a, b, nested, max_chars))
+    return spans
+
+
+def chunk_code(code: str, lexer: Lexer | None = None, max_chars: int = CHUNK_MAX_CHARS) -> list[CodeChunk]:
+    """
+    Split source code into chunks at function/class boundaries.
+
+    Definitions are found with the Pygments lexer used for language
+    detection. Oversized definitions are split at nested definitions and
+    then at line breaks, and adjacent small pieces are merged back together
+    up to `max_chars`. Without a lexer the code is split by lines only.
+    """
+    if not code:
+        return []
+    boundaries = _definition_starts(code, lexer) if lexer is not None else []
+    spans = _split_span(code, 0, len(code), boundaries, max_chars)
+
+    merged: list[tuple[int, int]] = []
+    for start, end in spans:
+        if merged and end - merged[-1][0] <= max_chars:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+
+    chunks = []
+    line = 1
+    previous = 0
+    for start, end in merged:
+        line += code.count("\n", previous, start)
+        previous = start
+        text = code[start:end]
+        if text.strip():
+            chunks.append(CodeChunk(text=text, start=start, end=end, start_line=line))
+    return chunks
\ No newline at end of file
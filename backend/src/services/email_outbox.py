@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import httpx
+from ..lib.helpers import redis_client, logger
+
+SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY")
+SENDGRID_FROM_EMAIL = os.getenv("SENDGRID_FROM_EMAIL")
+# SendGrid v3 by default; point at a local HTTP stub in tests and benchmarks.
+EMAIL_API_URL = os.getenv("EMAIL_API_URL", "https://api.sendgrid.com").rstrip("/")
+# SendGrid accepts up to 1000 personalizations per /v3/mail/send request.
+EMAIL_BATCH_SIZE = min(int(os.getenv("EMAIL_BATCH_SIZE", "100")), 1000)
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "6"))
+EMAIL_BACKOFF_BASE = float(os.getenv("EMAIL_BACKOFF_BASE", "2.0"))
+EMAIL_BACKOFF_MAX = float(os.getenv("EMAIL_BACKOFF_MAX", "300"))
+EMAIL_SEND_TIMEOUT = float(os.getenv("EMAIL_SEND_TIMEOUT", "10"))
+EMAIL_POLL_TIMEOUT = 1
+
+EMAIL_QUEUE_KEY = "email:queue"
+EMAIL_RETRY_KEY = "email:retry"  # sorted set scored by due time
+EMAIL_DEAD_KEY = "email:dead"
+# Dead letters are for inspecting failures, not a permanent record: keep the
+# newest EMAIL_DEAD_MAX and drop the list after EMAIL_DEAD_TTL seconds idle.
+EMAIL_DEAD_MAX = int(os.getenv("EMAIL_DEAD_MAX", "1000"))
+EMAIL_DEAD_TTL = int(os.getenv("EMAIL_DEAD_TTL", str(7 * 24 * 3600)))
+
+OTP_SUBJECT = "Your OTP Code"
+# per-recipient values are filled in through SendGrid substitutions
+OTP_HTML = "<p>Your OTP code is: <strong>-otp-</strong></p>"
+
+_counters = {"sent": 0, "retried": 0, "dead": 0, "batches": 0}
+
+
+class EmailConfigError(RuntimeError):
+    pass
+
+
+def check_email_config():
+    """
+    Raise EmailConfigError unless SendGrid is configured. Without a key every
+    send is rejected and each job is retried until it is dead-lettered.
+    """
+    missing = [name for name, value in (("SENDGRID_API_KEY", SENDGRID_API_KEY), ("SENDGRID_FROM_EMAIL", SENDGRID_FROM_EMAIL)) if not value]
+    if missing:
+        raise EmailConfigError(f"Email worker needs {', '.join(missing)}")
+
+
+class EmailSendError(Exception):
+    def __init__(self, message: str, retryable: bool):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+async def enqueue_otp_email(email: str, otp: str):
+    """
+    Queue an OTP email for the background sender; returns once it is in Redis.
+    """
+    job = {"id": uuid.uuid4().hex, "to": email, "otp": otp, "attempts": 0}
+    await redis_client.rpush(EMAIL_QUEUE_KEY, json.dumps(job))
+
+
+def _backoff(attempts: int) -> float:
+    # exponential backoff with full jitter
+    return random.uniform(0, min(EMAIL_BACKOFF_MAX, EMAIL_BACKOFF_BASE ** attempts))
+
+
+def _mail_payload(jobs: list[dict]) -> dict:
+    return {
+        "from": {"email": SENDGRID_FROM_EMAIL},
+        "subject": OTP_SUBJECT,
+        "content": [{"type": "text/html", "value": OTP_HTML}],
+        "personalizations": [
+            {"to": [{"email": job["to"]}], "substitutions": {"-otp-": job["otp"]}} for job in jobs
+        ],
+    }
+
+
+def create_email_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=EMAIL_API_URL,
+        headers={"Authorization": f"Bearer {SENDGRID_API_KEY}"},
+        timeout=EMAIL_SEND_TIMEOUT,
+        limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+    )
+
+
+async def _send(client: httpx.AsyncClient, jobs: list[dict]):
+    try:
+        resp = await client.post("/v3/mail/send", json=_mail_payload(jobs))
+    except httpx.HTTPError as e:
+        raise EmailSendError(f"{type(e).__name__}: {e}", retryable=True)
+    if resp.status_code >= 400:
+        retryable = resp.status_code == 429 or resp.status_code >= 500
+        raise EmailSendError(f"status={resp.status_code} body={resp.text[:500]}", retryable=retryable)
+
+
+async def _take(batch_size: int) -> list[dict]:
+    """
+    Pop up to batch_size queued jobs, blocking briefly when the queue is empty.
+    Jobs popped by a worker that dies before sending are lost; users can
+    request a new OTP.
+    """
+    first = await redis_client.blpop(EMAIL_QUEUE_KEY, timeout=EMAIL_POLL_TIMEOUT)
+    if first is None:
+        return []
+    raw = [first[1]]
+    if batch_size > 1:
+        raw += await redis_client.lpop(EMAIL_QUEUE_KEY, batch_size - 1) or []
+    return [json.loads(item) for item in raw]
+
+
+async def _promote_due_retries():
+    """
+    Move retries whose backoff has elapsed back onto the queue. ZREM decides
+    which worker moves each job when several run at once.
+    """
+    due = await redis_client.zrangebyscore(EMAIL_RETRY_KEY, "-inf", time.time(), start=0, num=EMAIL_BATCH_SIZE)
+    for item in due:
+        if await redis_client.zrem(EMAIL_RETRY_KEY, item):
+            await redis_client.rpush(EMAIL_QUEUE_KEY, item)
+
+
+def _failed(job: dict, error: str) -> str:
+    job["attempts"] += 1
+    job["last_error"] = error
+    return json.dumps(job)
+
+
+async def _dead_letter(jobs: list[dict], error: str):
+    for job in jobs:
+        logger.error(f"OTP email to {job['to']} dead-lettered after {job['attempts'] + 1} attempts: {error}")
+    # the OTP is a live credential until it expires; never keep it
+    dead = [_failed({**job, "otp": None}, error) for job in jobs]
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.rpush(EMAIL_DEAD_KEY, *dead)
+    pipe.ltrim(EMAIL_DEAD_KEY, -EMAIL_DEAD_MAX, -1)
+    pipe.expire(EMAIL_DEAD_KEY, EMAIL_DEAD_TTL)
+    await pipe.execute()
+    _counters["dead"] += len(jobs)
+
+
+async def _reschedule(jobs: list[dict], error: str):
+    retry = [job for job in jobs if job["attempts"] + 1 < EMAIL_MAX_ATTEMPTS]
+    exhausted = [job for job in jobs if job["attempts"] + 1 >= EMAIL_MAX_ATTEMPTS]
+    if retry:
+        await redis_client.zadd(
+            EMAIL_RETRY_KEY,
+            {_failed(job, error): time.time() + _backoff(job["attempts"]) for job in retry},
+        )
+        _counters["retried"] += len(retry)
+    if exhausted:
+        await _dead_letter(exhausted, error)
+
+
+async def _deliver(client: httpx.AsyncClient, jobs: list[dict]) -> int:
+    try:
+        await _send(client, jobs)
+    except EmailSendError as e:
+        if e.retryable:
+            logger.warning(f"OTP email batch of {len(jobs)} failed, will retry: {e}")
+            await _reschedule(jobs, str(e))
+            return 0
+        if len(jobs) == 1:
+            await _dead_letter(jobs, str(e))
+            return 0
+        # one bad address rejects the whole request: send individually so
+        # only the offending job is dead-lettered
+        sent = 0
+        for job in jobs:
+            sent += await _deliver(client, [job])
+        return sent
+    _counters["sent"] += len(jobs)
+    return len(jobs)
+
+
+async def process_email_batch(client: httpx.AsyncClient, batch_size: int = EMAIL_BATCH_SIZE) -> int:
+    """
+    Send one batch of queued emails as a single request. Returns the number
+    of jobs taken from the queue.
+    """
+    await _promote_due_retries()
+    jobs = await _take(batch_size)
+    if jobs:
+        _counters["batches"] += 1
+        await _deliver(client, jobs)
+    return len(jobs)
+
+
+async def email_stats() -> dict:
+    queued, retrying, dead = await asyncio.gather(
+        redis_client.llen(EMAIL_QUEUE_KEY),
+        redis_client.zcard(EMAIL_RETRY_KEY),
+        redis_client.llen(EMAIL_DEAD_KEY),
+    )
+    return {"queued": queued, "retrying": retrying, "dead_letters": dead, **_counters}
+
+
+async def run_email_worker(stop: asyncio.Event | None = None, batch_size: int = EMAIL_BATCH_SIZE):
+    """
+    Drain the email queue until `stop` is set, reusing one pooled HTTP client.
+    Raises EmailConfigError at start when SendGrid is not configured.
+    """
+    check_email_config()
+    stop = stop or asyncio.Event()
+    logger.info(f"Email worker started (batch_size={batch_size}, api={EMAIL_API_URL})")
+    async with create_email_client() as client:
+        while not stop.is_set():
+            try:
+                await process_email_batch(client, batch_size)
+            except Exception as e:
+                logger.error(f"Email worker error: {e}")
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=EMAIL_POLL_TIMEOUT)
+                except asyncio.TimeoutError:
+                    pass
+    logger.info("Email worker stopped")
\ No newline at end of file
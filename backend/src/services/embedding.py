@@ -1,23 +1,257 @@
 import os
-from openai import OpenAI
+import asyncio
+import hashlib
+import weakref
+from array import array
+from openai import OpenAI, AsyncOpenAI
+from ..lib.cache import TTLCache
+from ..lib.helpers import redis_client, logger
+from ..lib.metrics import timed, record_cache, record_usage
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Two-tier cache: per-process LRU in front of the shared Redis tier.
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_LOCAL_CACHE_TTL = int(os.getenv("EMBEDDING_LOCAL_CACHE_TTL", "3600"))
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", str(7 * 24 * 3600)))
+
+# Micro-batching: concurrent requests arriving within the window share one API call.
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "64"))
 
 client = OpenAI(
     base_url=os.environ["OPENAI_BASE_URL"],
     api_key=os.environ["HF_TOKEN"],
 )
 
+async_client = AsyncOpenAI(
+    base_url=os.environ["OPENAI_BASE_URL"],
+    api_key=os.environ["HF_TOKEN"],
+)
+
+_local_cache = TTLCache(maxsize=EMBEDDING_CACHE_SIZE, ttl=EMBEDDING_LOCAL_CACHE_TTL)
+_redis_stats = {"hits": 0, "misses": 0, "errors": 0}
+
+def normalize_code(text: str) -> str:
+    """
+    Collapse all whitespace runs so reformatted or re-indented resubmissions
+    map to the same cache entry.
+    """
+    return " ".join(text.split())
+
+def embedding_cache_key(text: str, model: str = EMBEDDING_MODEL) -> str:
+    digest = hashlib.sha256(f"{model}\0{normalize_code(text)}".encode("utf-8")).hexdigest()
+    return f"emb:{digest}"
+
+def _pack(embedding: list) -> bytes:
+    return array("f", embedding).tobytes()
+
+def _unpack(raw: bytes) -> list:
+    vec = array("f")
+    vec.frombytes(raw)
+    return vec.tolist()
+
+async def _redis_get_many(keys: list[str]) -> list[list | None]:
+    try:
+        raws = await redis_client.mget(keys)
+    except Exception as e:
+        _redis_stats["errors"] += 1
+        logger.warning(f"Redis error reading embedding cache: {e}")
+        return [None] * len(keys)
+    found = []
+    for raw in raws:
+        if raw is None:
+            _redis_stats["misses"] += 1
+            found.append(None)
+        else:
+            _redis_stats["hits"] += 1
+            found.append(_unpack(raw))
+    hits = sum(1 for value in found if value is not None)
+    record_cache("embedding_redis", "hit", hits)
+    record_cache("embedding_redis", "miss", len(found) - hits)
+    return found
+
+async def _redis_set_many(items: dict[str, list]):
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for key, embedding in items.items():
+            pipe.setex(key, EMBEDDING_CACHE_TTL, _pack(embedding))
+        await pipe.execute()
+    except Exception as e:
+        _redis_stats["errors"] += 1
+        logger.warning(f"Redis error writing embedding cache: {e}")
+
+def embedding_cache_stats() -> dict:
+    """
+    Hit/miss counters for both cache tiers.
+    """
+    return {"local": _local_cache.stats(), "redis": dict(_redis_stats)}
+
+def _batches(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def get_embeddings(texts: list[str]) -> list[list]:
+    """
+    Bulk variant of get_embedding: embed many texts with as few API calls as
+    possible (one per EMBEDDING_MAX_BATCH_SIZE inputs). Duplicate and cached
+    texts are not sent. Only the in-process cache tier is consulted.
+    """
+    keys = [embedding_cache_key(text) for text in texts]
+    found = {key: _local_cache.get(key) for key in set(keys)}
+    missing = {key: text for key, text in zip(keys, texts) if found[key] is None}
+    if missing:
+        items = list(missing.items())
+        for batch in _batches(items, EMBEDDING_MAX_BATCH_SIZE):
+            try:
+                response = client.embeddings.create(
+                    input=[text for _, text in batch],
+                    model=EMBEDDING_MODEL
+                )
+            except Exception as e:
+                raise ValueError(f"Error generating embedding: {str(e)}")
+            for (key, _), data in zip(batch, sorted(response.data, key=lambda d: d.index)):
+                found[key] = data.embedding
+                _local_cache.set(key, data.embedding)
+    return [found[key] for key in keys]
+
 def get_embedding(text: str) -> list:
     """
     Generate embedding for the given text using OpenAI.
+    Only the in-process cache tier is consulted from sync code.
     """
+    return get_embeddings([text])[0]
+
+async def _create_embeddings(texts: list[str]) -> list[list]:
     try:
-        response = client.embeddings.create(
-            input=text,
-            model="text-embedding-ada-002"
-        )
-        return response.data[0].embedding
+        with timed("embedding_api"):
+            response = await async_client.embeddings.create(
+                input=texts,
+                model=EMBEDDING_MODEL
+            )
     except Exception as e:
         raise ValueError(f"Error generating embedding: {str(e)}")
+    record_usage(EMBEDDING_MODEL, getattr(response, "usage", None), prompt_kind="embedding")
+    return [data.embedding for data in sorted(response.data, key=lambda d: d.index)]
+
+class EmbeddingBatcher:
+    """
+    Coalesce concurrent embedding requests into bulk API calls.
+
+    The first request opens a window of `window_ms`; everything submitted
+    before it closes (or until `max_batch_size` distinct texts are queued)
+    is sent as a single `embeddings.create` call and the vectors are fanned
+    back out to each waiting caller.
+    """
+
+    def __init__(self, window_ms: float = EMBEDDING_BATCH_WINDOW_MS, max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE):
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._pending: dict[str, tuple[str, asyncio.Future]] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        # Strong references to in-flight sends (the loop only keeps weak ones).
+        self._tasks: set[asyncio.Task] = set()
+
+    def submit(self, key: str, text: str) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        entry = self._pending.get(key)
+        if entry is not None:
+            return entry[1]
+        future = loop.create_future()
+        self._pending[key] = (text, future)
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        task = asyncio.get_running_loop().create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: dict[str, tuple[str, asyncio.Future]]):
+        entries = list(batch.items())
+        try:
+            embeddings = await _create_embeddings([text for _, (text, _) in entries])
+        except Exception as e:
+            for _, (_, future) in entries:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (key, (_, future)), embedding in zip(entries, embeddings):
+            _local_cache.set(key, embedding)
+            if not future.done():
+                future.set_result(embedding)
+        await _redis_set_many({key: embedding for (key, _), embedding in zip(entries, embeddings)})
+
+_batchers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, EmbeddingBatcher]" = weakref.WeakKeyDictionary()
+
+def _get_batcher() -> EmbeddingBatcher:
+    loop = asyncio.get_running_loop()
+    batcher = _batchers.get(loop)
+    if batcher is None:
+        batcher = _batchers[loop] = EmbeddingBatcher()
+    return batcher
+
+async def get_embeddings_async(texts: list[str], cache: bool = True) -> list[list]:
+    """
+    Async bulk embedding. Checks the in-process LRU, then Redis (one MGET),
+    and sends the remaining distinct texts in batches of EMBEDDING_MAX_BATCH_SIZE.
+
+    cache=False skips both tiers, for bulk jobs (re-indexing) whose vectors
+    would only evict the ones live requests reuse.
+    """
+    if not cache:
+        embeddings = []
+        for batch in _batches(texts, EMBEDDING_MAX_BATCH_SIZE):
+            embeddings.extend(await _create_embeddings(batch))
+        return embeddings
+    keys = [embedding_cache_key(text) for text in texts]
+    found = {key: _local_cache.get(key) for key in set(keys)}
+    remote_keys = [key for key, value in found.items() if value is None]
+    record_cache("embedding_local", "hit", len(found) - len(remote_keys))
+    record_cache("embedding_local", "miss", len(remote_keys))
+    if remote_keys:
+        for key, value in zip(remote_keys, await _redis_get_many(remote_keys)):
+            if value is not None:
+                found[key] = value
+                _local_cache.set(key, value)
+    missing = {key: text for key, text in zip(keys, texts) if found[key] is None}
+    if missing:
+        items = list(missing.items())
+        fresh = {}
+        for batch in _batches(items, EMBEDDING_MAX_BATCH_SIZE):
+            embeddings = await _create_embeddings([text for _, text in batch])
+            for (key, _), embedding in zip(batch, embeddings):
+                found[key] = fresh[key] = embedding
+                _local_cache.set(key, embedding)
+        await _redis_set_many(fresh)
+    return [found[key] for key in keys]
+
+async def get_embedding_async(text: str) -> list:
+    """
+    Async variant of get_embedding; does not block the event loop.
+    Checks the in-process LRU, then Redis; misses go through the shared
+    micro-batcher so concurrent reviews share one API call.
+    """
+    key = embedding_cache_key(text)
+    cached = _local_cache.get(key)
+    record_cache("embedding_local", "miss" if cached is None else "hit")
+    if cached is not None:
+        return cached
+    cached = (await _redis_get_many([key]))[0]
+    if cached is not None:
+        _local_cache.set(key, cached)
+        return cached
+    # shield: a cancelled caller must not cancel the future other callers share
+    return await asyncio.shield(_get_batcher().submit(key, text))
 
 def cosine_similarity(vec1: list, vec2: list) -> float:
     """
@@ -0,0 +1,106 @@
+import codecs
+import os
+import re
+from fastapi import HTTPException, UploadFile
+
+SUPPORTED_EXTENSIONS = [
+    '.py', '.js', '.tsx', '.ts', '.tsx', '.java', '.kt', '.cpp', '.c', '.csharp',
+    '.go', '.rs', '.php', '.rb', '.vue', '.swift', '.m', '.scala', '.sh', '.r', '.sql'
+]
+
+SUPPORTED_LANGUAGES = [
+    'python', 'javascript', 'typescript', 'java', 'kotlin', 'cpp', 'c', 'csharp',
+    'go', 'rust', 'php', 'ruby', 'vue', 'swift', 'objective-c', 'scala', 'shell', 'r', 'sql'
+]
+
+SUPPORTED_FRAMEWORKS = [
+    'react', 'angular', 'vue', 'django', 'flask', 'spring', 'laravel', 'rails', 'express',
+    'nextjs', 'nestjs', 'svelte', 'flutter', 'swiftui', 'kivy', 'react-native', 'ionic',
+    'xamarin', 'symfony', 'cakephp', 'codeigniter', 'laravel', 'phoenix',
+]
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(2 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+_FRAMEWORKS = list(dict.fromkeys(fw.lower() for fw in SUPPORTED_FRAMEWORKS))
+# Longest names first so "react-native" wins over "react" at the same position;
+# the zero-width lookahead lets matches overlap.
+_FRAMEWORK_PATTERN = re.compile(
+    "(?=(" + "|".join(re.escape(fw) for fw in sorted(_FRAMEWORKS, key=len, reverse=True)) + "))",
+    re.IGNORECASE,
+)
+# Names contained in a longer name, e.g. "react" in "react-native".
+_IMPLIED_FRAMEWORKS = {fw: [other for other in _FRAMEWORKS if other != fw and other in fw] for fw in _FRAMEWORKS}
+
+
+def is_supported_filename(filename: str | None) -> bool:
+    return bool(filename) and any(filename.endswith(ext) for ext in SUPPORTED_EXTENSIONS)
+
+
+def detect_frameworks(code: str) -> list[str]:
+    """
+    Keyword-match supported frameworks in a single pass over the code
+    (case-insensitive, same substring semantics as a per-framework `in` check).
+    """
+    found = set()
+    for match in _FRAMEWORK_PATTERN.finditer(code):
+        name = match.group(1).lower()
+        if name not in found:
+            found.add(name)
+            found.update(_IMPLIED_FRAMEWORKS[name])
+            if len(found) == len(_FRAMEWORKS):
+                break
+    return [fw for fw in _FRAMEWORKS if fw in found]
+
+
+class TextDecoder:
+    """
+    Incremental UTF-8 decoder that rejects binary content (NUL bytes or
+    invalid UTF-8) as soon as it shows up and enforces a size limit.
+    Raises HTTPException(400/413).
+    """
+
+    def __init__(self, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._parts: list[str] = []
+
+    def feed(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise HTTPException(status_code=413, detail=f"File exceeds the {self.max_bytes} byte limit")
+        if b"\0" in chunk:
+            raise HTTPException(status_code=400, detail="Binary files are not supported")
+        try:
+            self._parts.append(self._decoder.decode(chunk))
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="File is not valid UTF-8 text")
+
+    def finish(self) -> str:
+        try:
+            self._parts.append(self._decoder.decode(b"", final=True))
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="File is not valid UTF-8 text")
+        text = "".join(self._parts)
+        self._parts = []
+        return text
+
+
+async def read_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES, chunk_size: int = UPLOAD_CHUNK_SIZE) -> str:
+    """
+    Read an uploaded file as text in fixed-size chunks, so at most one chunk
+    of raw bytes is held alongside the decoded text. Starlette has spooled
+    the whole upload by the time this runs, so the size checks here only
+    stop it from being decoded; oversized request bodies are refused before
+    parsing by BodySizeLimitMiddleware (src/lib/body_limit.py).
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File exceeds the {max_bytes} byte limit")
+    decoder = TextDecoder(max_bytes)
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        decoder.feed(chunk)
+    return decoder.finish()
\ No newline at end of file
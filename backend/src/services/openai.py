@@ -1,28 +1,465 @@
 import os
-from openai import OpenAI
-
-client = OpenAI(
-    base_url="https://router.huggingface.co/v1",
-    api_key=os.environ["HF_TOKEN"],
+import json
+import time
+import random
+import asyncio
+import httpx
+from collections import deque
+from dataclasses import dataclass, field
+from openai import (
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+    APIError,
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    InternalServerError,
+    RateLimitError,
 )
+from ..lib.helpers import logger
+from ..lib.metrics import timed, record_usage, LLM_REQUESTS, LLM_HEDGES
+
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://router.huggingface.co/v1")
+REVIEW_MODEL = os.getenv("REVIEW_MODEL", "deepseek-ai/DeepSeek-R1:novita")
+# Further models to fall back to (and hedge against) on the same router, e.g.
+# "deepseek-ai/DeepSeek-R1:together,deepseek-ai/DeepSeek-R1:fireworks-ai" to
+# reach other Hugging Face providers. For other endpoints set LLM_ROUTES to a
+# JSON list of {"name", "base_url", "model", "api_key_env"} instead; the first
+# entry is the primary.
+LLM_FALLBACK_MODELS = [m.strip() for m in os.getenv("LLM_FALLBACK_MODELS", "").split(",") if m.strip()]
+LLM_ROUTES = os.getenv("LLM_ROUTES")
+# Ask for a final usage chunk on streamed completions (token metrics); turn
+# off for providers that reject `stream_options`.
+LLM_STREAM_USAGE = os.getenv("LLM_STREAM_USAGE", "true").lower() == "true"
+
+# Deadlines cover every attempt, backoff and fallback of one call. A streamed
+# review's deadline only runs until its first chunk; after that each read is
+# bounded by LLM_ATTEMPT_TIMEOUT.
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "180"))
+LLM_STREAM_DEADLINE = float(os.getenv("LLM_STREAM_DEADLINE", "60"))
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "120"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE = float(os.getenv("LLM_RETRY_BASE", "0.5"))
+LLM_RETRY_MAX = float(os.getenv("LLM_RETRY_MAX", "8"))
+# Hedging: when the primary has not answered (or, streaming, sent its first
+# chunk) within its recent LLM_HEDGE_PERCENTILE latency, send the same request
+# to the next route as well and keep whichever finishes first.
+LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0"))
+# used until a route has LLM_HEDGE_MIN_SAMPLES latencies
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "30"))
+# A route that fails this many times in a row is skipped for the cooldown,
+# then gets a single trial request.
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
 
-def generate_review(code: str, prompt: str = None) -> str:
+# kinds of latency tracked per route
+COMPLETION = "completion"
+FIRST_CHUNK = "first_chunk"
+
+
+class ReviewGenerationError(Exception):
     """
-    Generate a code review using the DeepSeek model via OpenAI client.
+    No review could be generated. status_code is what the API returns.
     """
-    if prompt is None:
-        prompt = f"Review the following code for best practices, bugs, and improvements:\n\n{code}\n\nProvide a detailed review:"
-    
-    try:
-        completion = client.chat.completions.create(
-            model="deepseek-ai/DeepSeek-R1:novita",
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
+    status_code = 502
+
+
+class ReviewTimeout(ReviewGenerationError):
+    status_code = 504
+
+
+class ReviewUnavailable(ReviewGenerationError):
+    status_code = 503
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive = 0
+        self.opened_at = None
+        self.trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def available(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self.trial)
+
+    def acquire(self) -> bool:
+        """
+        Whether a request may go out now; in half-open state only one may.
+        """
+        if not self.available():
+            return False
+        if self.opened_at is not None:
+            self.trial = True
+        return True
+
+    def record_success(self):
+        self.consecutive = 0
+        self.opened_at = None
+        self.trial = False
+
+    def record_failure(self):
+        self.consecutive += 1
+        if self.trial or self.consecutive >= self.failures:
+            if self.opened_at is None or self.trial:
+                logger.warning(f"LLM circuit opened after {self.consecutive} consecutive failures")
+            self.opened_at = time.monotonic()
+        self.trial = False
+
+    def release(self):
+        # a trial that was cancelled (e.g. lost a hedge) proves nothing
+        self.trial = False
+
+
+@dataclass
+class LLMRoute:
+    name: str
+    base_url: str
+    model: str
+    api_key: str
+    breaker: CircuitBreaker = field(default_factory=CircuitBreaker)
+    latencies: dict = field(default_factory=lambda: {COMPLETION: deque(maxlen=200), FIRST_CHUNK: deque(maxlen=200)})
+
+    def __post_init__(self):
+        # one pooled client per route, reused by every request; retries are ours
+        self.client = AsyncOpenAI(
+            base_url=self.base_url,
+            api_key=self.api_key,
+            timeout=httpx.Timeout(LLM_ATTEMPT_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+            ),
         )
-        return completion.choices[0].message.content
+
+    def hedge_delay(self, kind: str) -> float:
+        samples = sorted(self.latencies[kind])
+        if len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY
+        index = min(len(samples) - 1, int(len(samples) * LLM_HEDGE_PERCENTILE))
+        return max(LLM_HEDGE_MIN_DELAY, samples[index])
+
+
+def _load_routes() -> list[LLMRoute]:
+    if LLM_ROUTES:
+        routes = []
+        for n, spec in enumerate(json.loads(LLM_ROUTES)):
+            api_key = spec.get("api_key") or os.environ[spec.get("api_key_env", "HF_TOKEN")]
+            routes.append(LLMRoute(
+                name=spec.get("name") or f"route{n}",
+                base_url=spec.get("base_url", LLM_BASE_URL),
+                model=spec["model"],
+                api_key=api_key,
+            ))
+        return routes
+    api_key = os.environ["HF_TOKEN"]
+    return [LLMRoute(name=model, base_url=LLM_BASE_URL, model=model, api_key=api_key) for model in [REVIEW_MODEL] + LLM_FALLBACK_MODELS]
+
+
+routes = _load_routes()
+# the primary model names the review cache entries
+REVIEW_MODEL = routes[0].model
+
+
+async def close_llm_clients():
+    for route in routes:
+        await route.client.close()
+
+
+def llm_status() -> list[dict]:
+    return [
+        {
+            "name": route.name,
+            "model": route.model,
+            "circuit": route.breaker.state,
+            "consecutive_failures": route.breaker.consecutive,
+            "hedge_delay_seconds": {kind: route.hedge_delay(kind) for kind in route.latencies},
+        }
+        for route in routes
+    ]
+
+
+def _retryable(e: Exception) -> bool:
+    if isinstance(e, (TimeoutError, APITimeoutError, APIConnectionError, RateLimitError, InternalServerError)):
+        return True
+    return isinstance(e, APIStatusError) and e.status_code in (408, 409, 425)
+
+
+def _outcome(e: Exception) -> str:
+    if isinstance(e, (TimeoutError, APITimeoutError)):
+        return "timeout"
+    if isinstance(e, RateLimitError):
+        return "rate_limited"
+    return "retryable_error" if _retryable(e) else "error"
+
+
+def _backoff(attempt: int) -> float:
+    # exponential backoff with full jitter
+    return random.uniform(0, min(LLM_RETRY_MAX, LLM_RETRY_BASE * 2 ** attempt))
+
+
+async def _attempt(route: LLMRoute, call, kind: str, timeout: float):
+    start = time.monotonic()
+    try:
+        try:
+            async with asyncio.timeout(timeout):
+                result = await call(route)
+        except TimeoutError:
+            raise TimeoutError(f"no response from {route.name} within {timeout:.1f}s") from None
+    except asyncio.CancelledError:
+        route.breaker.release()
+        LLM_REQUESTS.labels(route.name, "cancelled").inc()
+        raise
     except Exception as e:
-        return f"Error generating review: {str(e)}"
\ No newline at end of file
+        # a provider that answers with a 4xx is up; only count outages
+        if _retryable(e):
+            route.breaker.record_failure()
+        else:
+            route.breaker.record_success()
+        LLM_REQUESTS.labels(route.name, _outcome(e)).inc()
+        raise
+    route.breaker.record_success()
+    route.latencies[kind].append(time.monotonic() - start)
+    LLM_REQUESTS.labels(route.name, "ok").inc()
+    return result
+
+
+async def _call_route(route: LLMRoute, call, kind: str, deadline: float):
+    """
+    Call one route with bounded, jittered retries of retryable errors, all
+    within the deadline.
+    """
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"deadline exceeded before attempt {attempt + 1}")
+        if not route.breaker.acquire():
+            raise CircuitOpen(f"circuit open for {route.name}")
+        try:
+            return await _attempt(route, call, kind, min(LLM_ATTEMPT_TIMEOUT, remaining))
+        except Exception as e:
+            if not _retryable(e) or attempt == LLM_MAX_RETRIES:
+                raise
+            delay = _backoff(attempt)
+            if time.monotonic() + delay >= deadline:
+                raise
+            logger.warning(f"LLM call to {route.name} failed ({type(e).__name__}: {e}), retry {attempt + 1} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+def _final_error(errors: list[Exception]) -> ReviewGenerationError:
+    if not errors:
+        return ReviewUnavailable("All LLM providers are unavailable")
+    detail = "; ".join(f"{type(e).__name__}: {e}" for e in errors)
+    if all(isinstance(e, (TimeoutError, APITimeoutError)) for e in errors):
+        return ReviewTimeout(f"Review generation timed out ({detail})")
+    if all(isinstance(e, (CircuitOpen, RateLimitError)) for e in errors):
+        return ReviewUnavailable(f"LLM providers are unavailable ({detail})")
+    return ReviewGenerationError(f"Review generation failed ({detail})")
+
+
+async def _route_call(call, kind: str, deadline_seconds: float, discard=None):
+    """
+    Run `call(route)` on the first available route, falling back to the next
+    one when a route fails and, with LLM_HEDGE, racing the next one when the
+    current one is slower than its usual latency. Returns (route, result);
+    `discard` is awaited for successful results that lost a race. Raises
+    ReviewGenerationError.
+    """
+    deadline = time.monotonic() + deadline_seconds
+    queue = [route for route in routes if route.breaker.available()]
+    errors: list[Exception] = []
+    pending: dict[asyncio.Task, tuple[LLMRoute, float]] = {}
+
+    def launch():
+        route = queue.pop(0)
+        task = asyncio.create_task(_call_route(route, call, kind, deadline))
+        pending[task] = (route, time.monotonic())
+
+    if not queue:
+        raise _final_error([CircuitOpen(f"circuit open for {route.name}") for route in routes])
+    launch()
+    try:
+        while pending:
+            timeout = None
+            if LLM_HEDGE and queue and len(pending) == 1:
+                route, started = next(iter(pending.values()))
+                timeout = max(0.0, started + route.hedge_delay(kind) - time.monotonic())
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                LLM_HEDGES.labels(queue[0].name).inc()
+                logger.info(f"Hedging LLM call to {queue[0].name} after {timeout:.2f}s")
+                launch()
+                continue
+            winner = None
+            for task in done:
+                route, _ = pending.pop(task)
+                if task.exception() is not None:
+                    errors.append(task.exception())
+                elif winner is None:
+                    winner = (route, task.result())
+                elif discard is not None:
+                    await discard(task.result())
+            if winner is not None:
+                return winner
+            if not pending and queue:
+                launch()
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+    raise _final_error(errors)
+
+
+def _default_prompt(code: str) -> str:
+    return f"Review the following code for best practices, bugs, and improvements:\n\n{code}\n\nProvide a detailed review:"
+
+def _messages(prompt: str) -> list[dict]:
+    return [
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
+
+async def generate_review_async(code: str, prompt: str = None) -> str:
+    """
+    Generate a code review through the configured routes (see _route_call).
+    Raises ReviewGenerationError instead of returning error text, so failures
+    are never cached or stored as reviews.
+    """
+    if prompt is None:
+        prompt = _default_prompt(code)
+
+    async def complete(route: LLMRoute):
+        return await route.client.chat.completions.create(model=route.model, messages=_messages(prompt))
+
+    with timed("llm_generate"):
+        route, completion = await _route_call(complete, COMPLETION, LLM_DEADLINE)
+    record_usage(route.model, getattr(completion, "usage", None))
+    return completion.choices[0].message.content
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+class _ThinkTagSplitter:
+    """
+    Split streamed content into reasoning and answer parts for providers that
+    inline the reasoning as <think>...</think> instead of sending
+    `reasoning_content`. Tags may be split across chunks, so a possible
+    partial tag at the end of a chunk is held back until the next one.
+    """
+    def __init__(self):
+        self.in_think = False
+        self.pending = ""
+
+    def feed(self, text: str):
+        self.pending += text
+        while self.pending:
+            tag = THINK_CLOSE if self.in_think else THINK_OPEN
+            kind = "reasoning" if self.in_think else "answer"
+            pos = self.pending.find(tag)
+            if pos >= 0:
+                if pos:
+                    yield kind, self.pending[:pos]
+                self.pending = self.pending[pos + len(tag):]
+                self.in_think = not self.in_think
+                continue
+            keep = 0
+            for i in range(1, len(tag)):
+                if self.pending.endswith(tag[:i]):
+                    keep = i
+            emit = self.pending[:len(self.pending) - keep]
+            if emit:
+                yield kind, emit
+            self.pending = self.pending[len(self.pending) - keep:]
+            return
+
+    def flush(self):
+        if self.pending:
+            yield ("reasoning" if self.in_think else "answer"), self.pending
+            self.pending = ""
+
+async def stream_review(code: str, prompt: str = None):
+    """
+    Stream a code review as it is generated.
+
+    Yields (kind, text) tuples where kind is "reasoning" for the model's
+    chain of thought and "answer" for the review itself. Routing, retries and
+    hedging apply until the first chunk arrives; after that the stream is
+    committed to its route. Raises ReviewGenerationError, which the caller
+    reports mid-stream.
+    """
+    if prompt is None:
+        prompt = _default_prompt(code)
+
+    extra = {"stream_options": {"include_usage": True}} if LLM_STREAM_USAGE else {}
+
+    async def open_stream(route: LLMRoute):
+        stream = await route.client.chat.completions.create(
+            model=route.model,
+            messages=_messages(prompt),
+            stream=True,
+            **extra,
+        )
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except BaseException:
+            await stream.close()
+            raise
+        return stream, first
+
+    async def discard(opened):
+        await opened[0].close()
+
+    with timed("llm_first_chunk"):
+        route, (stream, first) = await _route_call(open_stream, FIRST_CHUNK, LLM_STREAM_DEADLINE, discard)
+
+    async def chunks():
+        if first is not None:
+            yield first
+        async for chunk in stream:
+            yield chunk
+
+    try:
+        with timed("llm_stream"):
+            splitter = _ThinkTagSplitter()
+            async for chunk in chunks():
+                if getattr(chunk, "usage", None):
+                    record_usage(route.model, chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                reasoning = getattr(delta, "reasoning_content", None) or getattr(delta, "reasoning", None)
+                if reasoning:
+                    yield "reasoning", reasoning
+                if delta.content:
+                    for part in splitter.feed(delta.content):
+                        yield part
+            for part in splitter.flush():
+                yield part
+    except (APITimeoutError, httpx.TimeoutException) as e:
+        raise ReviewTimeout(f"Review stream from {route.name} timed out: {e}")
+    except (APIError, httpx.HTTPError) as e:
+        raise ReviewGenerationError(f"Review stream from {route.name} failed: {type(e).__name__}: {e}")
+    finally:
+        await stream.close()
\ No newline at end of file
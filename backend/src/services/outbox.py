@@ -0,0 +1,174 @@
+import os
+import time
+import random
+import asyncio
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update, delete, func
+from .embedding import get_embeddings_async
+from .vector_store import connect_vector_store
+from ..db import AsyncSessionLocal
+from ..models.db_models import Message, EmbeddingOutbox
+from ..lib.helpers import logger
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "64"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "2.0"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "600"))
+# How long a claimed batch is hidden from other workers while it is processed.
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "120"))
+OUTBOX_STATS_INTERVAL = float(os.getenv("OUTBOX_STATS_INTERVAL", "60"))
+
+_counters = {"processed": 0, "failed": 0, "batches": 0}
+
+
+def message_vector_id(message_id: int) -> str:
+    return f"msg:{message_id}"
+
+
+def _backoff(attempts: int) -> float:
+    # exponential backoff with full jitter
+    return random.uniform(0, min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE ** attempts))
+
+
+async def _claim(batch_size: int, message_ids: list[int] | None) -> list[tuple[int, int, str, int, str | None, int]]:
+    """
+    Lease up to batch_size due entries: SKIP LOCKED lets several workers
+    drain concurrently, and pushing next_attempt_at forward hides the claimed
+    rows until they are finished or the lease runs out.
+    """
+    now = datetime.now(timezone.utc)
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            query = (
+                select(
+                    EmbeddingOutbox.id,
+                    EmbeddingOutbox.attempts,
+                    Message.id,
+                    Message.text,
+                    Message.conversation_id,
+                    Message.user_id,
+                )
+                .join(Message, Message.id == EmbeddingOutbox.message_id)
+                .where(EmbeddingOutbox.attempts < OUTBOX_MAX_ATTEMPTS)
+                .order_by(EmbeddingOutbox.id)
+                .limit(batch_size)
+                .with_for_update(of=EmbeddingOutbox, skip_locked=True)
+            )
+            if message_ids is not None:
+                query = query.where(EmbeddingOutbox.message_id.in_(message_ids))
+            else:
+                query = query.where(EmbeddingOutbox.next_attempt_at <= now)
+            rows = (await session.execute(query)).all()
+            if rows:
+                await session.execute(
+                    update(EmbeddingOutbox)
+                    .where(EmbeddingOutbox.id.in_([row[0] for row in rows]))
+                    .values(
+                        attempts=EmbeddingOutbox.attempts + 1,
+                        next_attempt_at=now + timedelta(seconds=OUTBOX_LEASE_SECONDS),
+                    )
+                )
+    return rows
+
+
+async def process_outbox_batch(batch_size: int = OUTBOX_BATCH_SIZE, message_ids: list[int] | None = None) -> int:
+    """
+    Drain one batch: bulk-embed the messages, bulk-upsert their vectors, then
+    set pinecone_id and delete the outbox rows in one transaction. On failure
+    the batch is rescheduled with exponential backoff; entries that reach
+    OUTBOX_MAX_ATTEMPTS stay in the table for inspection.
+
+    `message_ids` restricts the batch to specific messages regardless of
+    their schedule (used to index a message right after inserting it).
+
+    Returns: number of messages indexed
+    """
+    rows = await _claim(batch_size, message_ids)
+    if not rows:
+        return 0
+    outbox_ids = [row[0] for row in rows]
+    _counters["batches"] += 1
+
+    try:
+        embeddings = await get_embeddings_async([row[3] for row in rows])
+        vectors = []
+        for (_, _, message_id, text, conversation_id, user_id), embedding in zip(rows, embeddings):
+            metadata = {"message_id": message_id, "conversation_id": conversation_id, "user_id": user_id, "text": text}
+            # Pinecone rejects null metadata values
+            metadata = {key: value for key, value in metadata.items() if value is not None}
+            vectors.append((message_vector_id(message_id), embedding, metadata))
+        store = await connect_vector_store()
+        await store.upsert(vectors)
+    except Exception as e:
+        _counters["failed"] += len(rows)
+        logger.error(f"Outbox batch of {len(rows)} failed: {e}")
+        now = datetime.now(timezone.utc)
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(EmbeddingOutbox),
+                [
+                    {"id": outbox_id, "next_attempt_at": now + timedelta(seconds=_backoff(attempts + 1)), "last_error": str(e)[:2000]}
+                    for outbox_id, attempts, *_ in rows
+                ],
+            )
+            await session.commit()
+        return 0
+
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            await session.execute(
+                update(Message),
+                [{"id": row[2], "pinecone_id": message_vector_id(row[2])} for row in rows],
+            )
+            await session.execute(delete(EmbeddingOutbox).where(EmbeddingOutbox.id.in_(outbox_ids)))
+    _counters["processed"] += len(rows)
+    return len(rows)
+
+
+async def outbox_stats() -> dict:
+    """
+    Backlog and lag metrics: pending/dead entry counts, age of the oldest
+    pending entry, and this process's processed/failed counters.
+    """
+    async with AsyncSessionLocal() as session:
+        pending, oldest = (await session.execute(
+            select(func.count(EmbeddingOutbox.id), func.min(EmbeddingOutbox.created_at))
+            .where(EmbeddingOutbox.attempts < OUTBOX_MAX_ATTEMPTS)
+        )).one()
+        dead = (await session.execute(
+            select(func.count(EmbeddingOutbox.id)).where(EmbeddingOutbox.attempts >= OUTBOX_MAX_ATTEMPTS)
+        )).scalar_one()
+    lag = 0.0
+    if oldest is not None:
+        if oldest.tzinfo is None:
+            oldest = oldest.replace(tzinfo=timezone.utc)
+        lag = max(0.0, (datetime.now(timezone.utc) - oldest).total_seconds())
+    return {"pending": pending, "dead": dead, "lag_seconds": lag, **_counters}
+
+
+async def run_outbox_worker(stop: asyncio.Event | None = None, batch_size: int = OUTBOX_BATCH_SIZE):
+    """
+    Drain the outbox until `stop` is set, polling when it is empty.
+    """
+    stop = stop or asyncio.Event()
+    last_stats = 0.0
+    logger.info(f"Outbox worker started (batch_size={batch_size})")
+    while not stop.is_set():
+        try:
+            indexed = await process_outbox_batch(batch_size)
+        except Exception as e:
+            logger.error(f"Outbox worker error: {e}")
+            indexed = 0
+        if time.monotonic() - last_stats >= OUTBOX_STATS_INTERVAL:
+            last_stats = time.monotonic()
+            try:
+                logger.info(f"Outbox stats: {await outbox_stats()}")
+            except Exception as e:
+                logger.warning(f"Could not read outbox stats: {e}")
+        if not indexed:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    logger.info("Outbox worker stopped")
\ No newline at end of file
@@ -0,0 +1,217 @@
+import os
+import re
+import gzip
+import json
+from datetime import date, datetime, timezone
+from sqlalchemy import text
+from .vector_store import connect_vector_store
+from ..db import engine
+from ..lib.helpers import logger
+
+# Months of messages kept in the live table; older partitions are archived and dropped.
+MESSAGES_RETENTION_MONTHS = int(os.getenv("MESSAGES_RETENTION_MONTHS", "12"))
+MESSAGES_PARTITIONS_AHEAD = int(os.getenv("MESSAGES_PARTITIONS_AHEAD", "3"))
+MESSAGES_ARCHIVE_DIR = os.getenv("MESSAGES_ARCHIVE_DIR", "data/archive")
+ARCHIVE_FETCH_SIZE = 1000
+VECTOR_DELETE_BATCH = 1000  # Pinecone's per-request delete limit
+DETACH_LOCK_TIMEOUT = os.getenv("PARTITION_DETACH_LOCK_TIMEOUT", "5s")
+
+_PARTITION_NAME = re.compile(r"^messages_p(\d{4})_(\d{2})$")
+_COLUMNS = "id, conversation_id, user_id, role, text, pinecone_id, created_at"
+
+
+def add_months(month: date, n: int) -> date:
+    total = month.year * 12 + month.month - 1 + n
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"messages_p{month:%Y_%m}"
+
+
+def _month_range(month: date) -> dict:
+    # aware UTC datetimes: bare dates would be read in the session time zone
+    start, end = month, add_months(month, 1)
+    return {
+        "lo": datetime(start.year, start.month, 1, tzinfo=timezone.utc),
+        "hi": datetime(end.year, end.month, 1, tzinfo=timezone.utc),
+    }
+
+
+def _bounds(month: date) -> str:
+    bounds = _month_range(month)
+    return f"FROM ('{bounds['lo'].isoformat()}') TO ('{bounds['hi'].isoformat()}')"
+
+
+_IN_MONTH = "created_at >= :lo AND created_at < :hi"
+
+
+def _missing_months(existing: dict, this_month: date, ahead: int) -> list[date]:
+    months = (add_months(this_month, n) for n in range(ahead + 1))
+    return [month for month in months if month not in existing]
+
+
+async def _default_rows(conn, month: date) -> int:
+    """
+    Rows of `month` that fell through to messages_default because its
+    partition did not exist yet. Postgres refuses to create the partition
+    while they are there.
+    """
+    return await conn.scalar(
+        text(f"SELECT count(*) FROM messages_default WHERE {_IN_MONTH}"), _month_range(month)
+    )
+
+
+async def _partitions(conn) -> dict[date, tuple[str, bool]]:
+    """
+    Monthly partition tables by month: (name, attached). Detached tables left
+    behind by an interrupted run are included so the job can finish them.
+    """
+    rows = await conn.execute(
+        text(
+            "SELECT c.relname, i.inhparent IS NOT NULL "
+            "FROM pg_class c "
+            "LEFT JOIN pg_inherits i ON i.inhrelid = c.oid AND i.inhparent = 'messages'::regclass "
+            "WHERE c.relkind = 'r' AND c.relnamespace = current_schema()::regnamespace "
+            "AND c.relname LIKE 'messages\\_p%'"
+        )
+    )
+    found = {}
+    for name, attached in rows:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            found[date(int(match[1]), int(match[2]), 1)] = (name, attached)
+    return found
+
+
+async def ensure_partitions(ahead: int = MESSAGES_PARTITIONS_AHEAD, today: date | None = None) -> list[str]:
+    """
+    Create the monthly partitions (UTC months) from the current month up to
+    `ahead` months out, so inserts never fall through to the default
+    partition. Rows that already did, for a month created late, are moved
+    out of messages_default into the new partition in the same transaction.
+    """
+    this_month = (today or datetime.now(timezone.utc).date()).replace(day=1)
+    created = []
+    async with engine.begin() as conn:
+        for month in _missing_months(await _partitions(conn), this_month, ahead):
+            name = partition_name(month)
+            stranded = await _default_rows(conn, month)
+            if not stranded:
+                await conn.execute(text(f"CREATE TABLE {name} PARTITION OF messages FOR VALUES {_bounds(month)}"))
+            else:
+                # Build the partition as a plain table, move the rows over and
+                # attach it; attaching checks the default partition is clear.
+                await conn.execute(text(f"CREATE TABLE {name} (LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+                await conn.execute(
+                    text(
+                        f"WITH moved AS (DELETE FROM messages_default WHERE {_IN_MONTH} RETURNING {_COLUMNS}) "
+                        f"INSERT INTO {name} ({_COLUMNS}) SELECT {_COLUMNS} FROM moved"
+                    ),
+                    _month_range(month),
+                )
+                await conn.execute(text(f"ALTER TABLE messages ATTACH PARTITION {name} FOR VALUES {_bounds(month)}"))
+                logger.warning(f"Moved {stranded} rows from messages_default into the new partition {name}")
+            created.append(name)
+    return created
+
+
+async def _archive_rows(conn, name: str, archive_dir: str) -> str:
+    """
+    Stream a detached partition into <archive_dir>/<name>.jsonl.gz. The file
+    appears under its final name only once complete.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.jsonl.gz")
+    if os.path.exists(path):
+        return path
+
+    tmp = f"{path}.tmp"
+    result = await conn.stream(
+        text(f"SELECT id, conversation_id, user_id, role, text, pinecone_id, created_at FROM {name} ORDER BY id"),
+        execution_options={"yield_per": ARCHIVE_FETCH_SIZE},
+    )
+    with gzip.open(tmp, "wt", encoding="utf-8") as out:
+        async for row in result.mappings():
+            out.write(json.dumps(dict(row), default=str) + "\n")
+    os.replace(tmp, path)
+    return path
+
+
+async def _delete_vectors(conn, name: str) -> int:
+    store = await connect_vector_store()
+    deleted = 0
+    result = await conn.stream(
+        text(f"SELECT pinecone_id FROM {name} WHERE pinecone_id IS NOT NULL ORDER BY id"),
+        execution_options={"yield_per": VECTOR_DELETE_BATCH},
+    )
+    async for rows in result.scalars().partitions(VECTOR_DELETE_BATCH):
+        await store.delete(list(rows))
+        deleted += len(rows)
+    store.flush()
+    return deleted
+
+
+async def retire_partition(name: str, attached: bool, archive_dir: str = MESSAGES_ARCHIVE_DIR) -> dict:
+    """
+    Detach a monthly partition, archive its rows, delete their vectors and
+    pending outbox entries, then drop it. Each step is safe to repeat, and
+    the table is dropped last, so an interrupted run resumes on the next one.
+    """
+    if attached:
+        # Detaching is metadata-only but needs a brief exclusive lock on
+        # messages (CONCURRENTLY is not allowed next to a default partition);
+        # give up instead of queueing inserts behind a long-running query.
+        async with engine.begin() as conn:
+            await conn.execute(text(f"SET LOCAL lock_timeout = '{DETACH_LOCK_TIMEOUT}'"))
+            await conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+
+    async with engine.connect() as conn:
+        path = await _archive_rows(conn, name, archive_dir)
+        vectors = await _delete_vectors(conn, name)
+
+    async with engine.begin() as conn:
+        outbox = await conn.execute(
+            text(f"DELETE FROM embedding_outbox WHERE message_id IN (SELECT id FROM {name})")
+        )
+        await conn.execute(text(f"DROP TABLE {name}"))
+
+    logger.info(f"Retired partition {name}: archive={path} vectors={vectors} outbox={outbox.rowcount}")
+    return {"partition": name, "archive": path, "vectors": vectors, "outbox": outbox.rowcount}
+
+
+async def maintain_partitions(
+    retention_months: int = MESSAGES_RETENTION_MONTHS,
+    ahead: int = MESSAGES_PARTITIONS_AHEAD,
+    archive_dir: str = MESSAGES_ARCHIVE_DIR,
+    dry_run: bool = False,
+) -> dict:
+    """
+    One run of the scheduled partition job: create upcoming partitions and
+    retire the ones older than the retention window.
+    """
+    if engine.dialect.name != "postgresql":
+        raise RuntimeError("Message partitioning requires PostgreSQL")
+
+    this_month = datetime.now(timezone.utc).date().replace(day=1)
+    cutoff = add_months(this_month, -retention_months)
+    async with engine.connect() as conn:
+        existing = await _partitions(conn)
+        expired = sorted(
+            (month, name, attached)
+            for month, (name, attached) in existing.items()
+            if month < cutoff
+        )
+        if dry_run:
+            missing = _missing_months(existing, this_month, ahead)
+            return {
+                "created": [partition_name(month) for month in missing],
+                # rows each new partition would take over from messages_default
+                "stranded": {partition_name(month): await _default_rows(conn, month) for month in missing},
+                "retired": [name for _, name, _ in expired],
+                "dry_run": True,
+            }
+
+    created = await ensure_partitions(ahead, this_month)
+    retired = [await retire_partition(name, attached, archive_dir) for _, name, attached in expired]
+    return {"created": created, "retired": retired}
\ No newline at end of file
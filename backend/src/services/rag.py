@@ -1,102 +1,426 @@
-from pinecone import Pinecone # type: ignore
+import asyncio
 import os
-from .embedding import get_embedding
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from .embedding import get_embedding_async, get_embeddings_async, normalize_code
+from .chunking import CodeChunk
+from .vector_store import connect_vector_store
 from dotenv import load_dotenv
 from ..db import AsyncSessionLocal
-from ..models.db_models import Message, Conversation
+from ..models.db_models import Message, Conversation, EmbeddingOutbox
+from .outbox import OUTBOX_LEASE_SECONDS, message_vector_id, process_outbox_batch
+from ..lib.helpers import logger
+from ..lib.metrics import timed
 
 load_dotenv()
 
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-
-INDEX_NAME = "code-review-index"
-
-# Create index if it doesn't exist or has wrong dimension
-if INDEX_NAME in pc.list_indexes().names():
-    index_info = pc.describe_index(INDEX_NAME)
-    if index_info.dimension != 1536:
-        pc.delete_index(INDEX_NAME)
-        pc.create_index(
-            name=INDEX_NAME,
-            dimension=1536,
-            metric="cosine",
-            spec={
-                "serverless": {
-                    "cloud": "aws",
-                    "region": "us-east-1"
-                }
-            }
-        )
-else:
-    pc.create_index(
-        name=INDEX_NAME,
-        dimension=1536,
-        metric="cosine",
-        spec={
-            "serverless": {
-                "cloud": "aws",
-                "region": "us-east-1"
-            }
-        }
-    )
+UPSERT_BATCH_SIZE = 100
+# Similar-file retrieval queries at most FILE_QUERY_CHUNKS chunks of a file
+# (spread evenly over it), at most RETRIEVAL_CONCURRENCY at a time.
+FILE_QUERY_CHUNKS = int(os.getenv("FILE_QUERY_CHUNKS", "16"))
+RETRIEVAL_CONCURRENCY = int(os.getenv("RETRIEVAL_CONCURRENCY", "8"))
+# How store_message_with_embedding indexes a new message. Every message is
+# enqueued in the embedding outbox in the same transaction; then
+#   "outbox":       leave it to the outbox worker (python manage.py outbox-worker)
+#   "write_behind": also index it in a background task right away
+#   "inline":       index it before returning
+# Failures in the last two modes are retried by the worker.
+MESSAGE_INDEX_MODE = os.getenv("MESSAGE_INDEX_MODE", "outbox")
+
+# Prompt context: retrieve CONTEXT_CANDIDATES neighbours, drop the submission
+# itself and duplicates, pick up to CONTEXT_MAX_SNIPPETS by maximal marginal
+# relevance (CONTEXT_MMR_LAMBDA=1 is plain score order) and pack them into
+# CONTEXT_TOKEN_BUDGET tokens of CONTEXT_TOKENIZER.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+CONTEXT_MAX_SNIPPETS = int(os.getenv("CONTEXT_MAX_SNIPPETS", "3"))
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "10"))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "cl100k_base")
+CONTEXT_TOKENIZER_TIMEOUT = float(os.getenv("CONTEXT_TOKENIZER_TIMEOUT", "30"))
+CONTEXT_TOKENIZER_RETRY = float(os.getenv("CONTEXT_TOKENIZER_RETRY", "300"))
+# a snippet that only fits truncated below this many tokens is left out
+CONTEXT_MIN_SNIPPET_TOKENS = int(os.getenv("CONTEXT_MIN_SNIPPET_TOKENS", "64"))
 
-index = pc.Index(INDEX_NAME)
+# Strong references to in-flight write-behind tasks (the loop only keeps weak ones).
+_background_tasks: set[asyncio.Task] = set()
 
-def store_code_embedding(code_id: str, code: str, metadata: dict = None):
+async def store_code_embedding_async(code_id: str, code: str, metadata: dict = None):
     """
-    Store code embedding in Pinecone.
+    Store code embedding in the vector store.
     """
-    embedding = get_embedding(code)
+    embedding = await get_embedding_async(code)
     if metadata is None:
         metadata = {}
     metadata["code"] = code
-    index.upsert([(code_id, embedding, metadata)])
+    store = await connect_vector_store()
+    await store.upsert([(code_id, embedding, metadata)])
+
+
+async def store_code_chunks(code_id: str, chunks: list[CodeChunk], metadata: dict = None) -> tuple[list[str], list[list]]:
+    """
+    Embed all chunks of a file in one batch and upsert each as its own vector
+    "<code_id>#<n>" with file and offset metadata.
+
+    Returns: (vector ids, chunk embeddings)
+    """
+    embeddings = await get_embeddings_async([chunk.text for chunk in chunks])
+    vectors = []
+    for n, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
+        chunk_metadata = dict(metadata or {})
+        chunk_metadata.update({
+            "code_id": code_id,
+            "chunk": n,
+            "start": chunk.start,
+            "end": chunk.end,
+            "start_line": chunk.start_line,
+            "code": chunk.text,
+        })
+        vectors.append((f"{code_id}#{n}", embedding, chunk_metadata))
+    store = await connect_vector_store()
+    for i in range(0, len(vectors), UPSERT_BATCH_SIZE):
+        await store.upsert(vectors[i:i + UPSERT_BATCH_SIZE])
+    return [vector_id for vector_id, _, _ in vectors], embeddings
+
+
+async def create_conversation(user_id: str | None = None, title: str | None = None) -> int:
+    """
+    Create an empty Conversation row and return its id.
+    """
+    with timed("db_create_conversation"):
+        async with AsyncSessionLocal() as session:
+            conv = Conversation(user_id=user_id, title=title)
+            session.add(conv)
+            # INSERT ... RETURNING populates the id; expire_on_commit=False keeps it
+            await session.commit()
+            return conv.id
+
+
+async def store_message(
+    text: str,
+    conversation_id: int,
+    user_id: str | None = None,
+    role: str = "assistant"
+) -> int:
+    """
+    Create a Message row without embedding it. Used for assistant replies,
+    which are never retrieved as similar code.
+
+    Returns: message_id
+    """
+    with timed("db_store_message"):
+        async with AsyncSessionLocal() as session:
+            msg = Message(conversation_id=conversation_id, user_id=user_id, role=role, text=text)
+            session.add(msg)
+            await session.commit()
+            return msg.id
+
+
+async def insert_message(
+    text: str,
+    conversation_id: int | None = None,
+    user_id: str | None = None,
+    role: str = "user",
+    index_now: bool = False
+) -> tuple[int, int, str]:
+    """
+    Insert a Message (and its Conversation if needed) together with its
+    embedding outbox entry in a single transaction.
+
+    With index_now the outbox entry is scheduled one lease into the future,
+    so the worker only picks it up if the caller's own indexing fails.
+
+    Returns: (message_id, conversation_id, pinecone_id)
+    """
+    with timed("db_insert_message"):
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                if conversation_id is None:
+                    conv = Conversation(user_id=user_id, title=None)
+                    session.add(conv)
+                    await session.flush()
+                    conversation_id = conv.id
+
+                msg = Message(conversation_id=conversation_id, user_id=user_id, role=role, text=text)
+                session.add(msg)
+                await session.flush()
+                entry = EmbeddingOutbox(message_id=msg.id)
+                if index_now:
+                    entry.next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+                session.add(entry)
+    # pinecone_id itself is set by the outbox once the vector is upserted
+    return msg.id, conversation_id, message_vector_id(msg.id)
+
+
+async def _index_behind(message_id: int):
+    try:
+        await process_outbox_batch(message_ids=[message_id])
+    except Exception as e:
+        logger.error(f"Write-behind indexing failed for message {message_id}: {e}")
 
 
 async def store_message_with_embedding(
     text: str, 
     conversation_id: int | None = None, 
-    user_id: int | None = None, 
-    role: str = "user"
+    user_id: str | None = None, 
+    role: str = "user",
+    index_mode: str | None = None
 ) -> tuple[int, str]:
     """
-    Create a Message row (and Conversation if needed), generate an embedding,
-    upsert it to Pinecone using id "msg:<id>", and update the Message.pinecone_id.
+    Create a Message row (and Conversation if needed) and enqueue it for
+    embedding + upsert to the vector store under id "msg:<id>", all in one
+    transaction. See MESSAGE_INDEX_MODE for when the indexing happens.
 
     Returns: (message_id, pinecone_id)
     """
-    async with AsyncSessionLocal() as session:
-        if conversation_id is None:
-            conv = Conversation(user_id=user_id, title=None)
-            session.add(conv)
-            await session.commit()
-            await session.refresh(conv)
-            conversation_id = conv.id
+    index_mode = index_mode or MESSAGE_INDEX_MODE
+    msg_id, conversation_id, pine_id = await insert_message(
+        text, conversation_id, user_id, role, index_now=index_mode != "outbox"
+    )
 
-        msg = Message(conversation_id=conversation_id, user_id=user_id, role=role, text=text)
-        session.add(msg)
-        await session.commit()
-        await session.refresh(msg)
+    if index_mode == "write_behind":
+        task = asyncio.create_task(_index_behind(msg_id))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    elif index_mode == "inline":
+        # a failure is logged and left to the worker rather than failing the review
+        await process_outbox_batch(message_ids=[msg_id])
 
-    # generate embedding (sync call may block briefly)
-    embedding = get_embedding(text)
-    pine_id = f"msg:{msg.id}"
-    metadata = {"message_id": msg.id, "conversation_id": conversation_id, "user_id": user_id, "text": text}
-    index.upsert([(pine_id, embedding, metadata)])
+    return msg_id, pine_id
 
-    # update message with pinecone id
-    async with AsyncSessionLocal() as session:
-        db_msg = await session.get(Message, msg.id)
-        db_msg.pinecone_id = pine_id
-        session.add(db_msg)
-        await session.commit()
 
-    return msg.id, pine_id
+async def drain_background_tasks(timeout: float = 10.0):
+    """
+    Wait for in-flight write-behind work, e.g. on shutdown.
+    """
+    if _background_tasks:
+        await asyncio.wait(set(_background_tasks), timeout=timeout)
+
+async def retrieve_similar_code_async(query_code: str, top_k: int = 5, include_values: bool = False):
+    """
+    Retrieve similar code snippets from the vector store.
+    """
+    query_embedding = await get_embedding_async(query_code)
+    store = await connect_vector_store()
+    return await store.query(query_embedding, top_k=top_k, include_values=include_values)
+
+def _spread(items: list, limit: int) -> list:
+    # evenly spaced sample that keeps the first and last item
+    if len(items) <= limit:
+        return items
+    if limit <= 1:
+        return items[:limit]
+    step = (len(items) - 1) / (limit - 1)
+    return [items[round(i * step)] for i in range(limit)]
+
+async def retrieve_similar_files(
+    chunks: list[CodeChunk],
+    top_k: int = 3,
+    per_chunk_k: int = 5,
+    include_values: bool = False,
+    embeddings: list[list] | None = None,
+    filter: dict | None = None,
+):
+    """
+    Query the index with up to FILE_QUERY_CHUNKS chunks of a file and
+    aggregate the chunk hits per source file (`code_id`). A file scores as its best matching chunk and
+    its matched chunks are joined in file order; `vector_id` is its best
+    matching chunk. With include_values a file carries that chunk's vector.
+
+    Pass `embeddings` (one per chunk) when the chunks were just embedded,
+    and a metadata `filter` to restrict the hits, e.g. to other files.
 
-def retrieve_similar_code(query_code: str, top_k: int = 5):
+    Returns the same {"matches": [...]} shape as retrieve_similar_code_async.
     """
-    Retrieve similar code snippets from Pinecone.
+    if embeddings is None:
+        chunks = _spread(chunks, FILE_QUERY_CHUNKS)
+        embeddings = await get_embeddings_async([chunk.text for chunk in chunks])
+    else:
+        embeddings = _spread(embeddings, FILE_QUERY_CHUNKS)
+    store = await connect_vector_store()
+    semaphore = asyncio.Semaphore(RETRIEVAL_CONCURRENCY)
+
+    async def query(embedding):
+        async with semaphore:
+            return await store.query(embedding, top_k=per_chunk_k, include_values=include_values, filter=filter)
+
+    results = await asyncio.gather(*(query(embedding) for embedding in embeddings))
+
+    files: dict[str, dict] = {}
+    for result in results:
+        for match in result['matches']:
+            metadata = match.get('metadata') or {}
+            if 'code' not in metadata:
+                continue
+            file_id = metadata.get('code_id', match['id'])
+            entry = files.setdefault(file_id, {"id": file_id, "score": match['score'], "chunks": {}, "filename": metadata.get('filename'), "vector_id": match['id'], "values": match.get('values')})
+            if match['score'] > entry["score"]:
+                entry["score"] = match['score']
+                entry["vector_id"] = match['id']
+                entry["values"] = match.get('values')
+            entry["chunks"][match['id']] = (metadata.get('start', 0), metadata['code'])
+
+    ranked = sorted(files.values(), key=lambda f: f["score"], reverse=True)[:top_k]
+    matches = []
+    for entry in ranked:
+        code = "\n".join(text for _, text in sorted(entry["chunks"].values()))
+        metadata = {"code": code, "code_id": entry["id"], "chunks": len(entry["chunks"])}
+        if entry["filename"]:
+            metadata["filename"] = entry["filename"]
+        item = {"id": entry["id"], "score": entry["score"], "metadata": metadata, "vector_id": entry["vector_id"]}
+        if include_values:
+            item["values"] = entry["values"]
+        matches.append(item)
+    return {"matches": matches}
+
+_encoding = None
+
+async def load_tokenizer(retry_seconds: float = CONTEXT_TOKENIZER_RETRY):
     """
-    query_embedding = get_embedding(query_code)
-    results = index.query(vector=query_embedding, top_k=top_k, include_metadata=True)
-    return results
\ No newline at end of file
+    Load the tiktoken encoding in a thread, retrying until it succeeds. Run
+    from the app lifespan: tiktoken downloads its BPE file on first use (with
+    no timeout), which must never happen on the event loop. Until it is
+    loaded token counts are estimated at four characters per token. Point
+    TIKTOKEN_CACHE_DIR at a directory holding the file to skip the download.
+    """
+    global _encoding
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("tiktoken is not installed; estimating 4 characters per token")
+        return
+    while _encoding is None:
+        try:
+            _encoding = await asyncio.wait_for(
+                asyncio.to_thread(tiktoken.get_encoding, CONTEXT_TOKENIZER), timeout=CONTEXT_TOKENIZER_TIMEOUT
+            )
+            logger.info(f"Tokenizer {CONTEXT_TOKENIZER} loaded")
+        except Exception as e:
+            logger.warning(f"Tokenizer {CONTEXT_TOKENIZER} unavailable ({type(e).__name__}: {e}); retrying in {retry_seconds:.0f}s")
+            await asyncio.sleep(retry_seconds)
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    encoding = _encoding
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+def _mmr(candidates: list[dict], k: int, lambda_: float) -> list[dict]:
+    """
+    Greedy maximal marginal relevance over matches carrying `score` (query
+    similarity) and, where available, `values`. Candidates without a vector
+    are never penalised for redundancy.
+    """
+    if len(candidates) <= 1 or lambda_ >= 1:
+        return candidates[:k]
+    vectors = []
+    for match in candidates:
+        values = match.get("values")
+        if values:
+            v = np.asarray(values, dtype=np.float32)
+            norm = np.linalg.norm(v)
+            vectors.append(v / norm if norm else None)
+        else:
+            vectors.append(None)
+    selected: list[int] = []
+    remaining = list(range(len(candidates)))
+    while remaining and len(selected) < k:
+        best, best_value = None, None
+        for i in remaining:
+            redundancy = max(
+                (float(vectors[i] @ vectors[j]) for j in selected if vectors[i] is not None and vectors[j] is not None),
+                default=0.0,
+            )
+            value = lambda_ * candidates[i]["score"] - (1 - lambda_) * redundancy
+            if best_value is None or value > best_value:
+                best, best_value = i, value
+        selected.append(best)
+        remaining.remove(best)
+    return [candidates[i] for i in selected]
+
+def _context_candidates(similar: dict, code: str, exclude_ids=()) -> list[dict]:
+    # matches with code that are neither the submission itself nor a
+    # duplicate of it or of a better-ranked match
+    exclude_ids = set(exclude_ids)
+    seen = {normalize_code(code)}
+    candidates = []
+    for match in similar["matches"]:
+        metadata = match.get("metadata") or {}
+        if "code" not in metadata:
+            continue
+        if match["id"] in exclude_ids or metadata.get("code_id") in exclude_ids:
+            continue
+        key = normalize_code(metadata["code"])
+        if key in seen:
+            continue
+        seen.add(key)
+        candidates.append(match)
+    return candidates
+
+def build_context(
+    similar: dict,
+    code: str,
+    exclude_ids=(),
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    max_snippets: int = CONTEXT_MAX_SNIPPETS,
+    mmr_lambda: float = CONTEXT_MMR_LAMBDA,
+) -> str:
+    """
+    Assemble prompt context from retrieval results: skip `exclude_ids` (the
+    submission's own vectors) and any snippet whose normalized code equals
+    the submission or an earlier snippet, diversify with MMR, then pack the
+    snippets in that order into `token_budget` tokens, truncating the last
+    one if enough room is left.
+    """
+    candidates = _context_candidates(similar, code, exclude_ids)
+    snippets = []
+    remaining = token_budget
+    for match in _mmr(candidates, max_snippets, mmr_lambda):
+        snippet = match["metadata"]["code"]
+        tokens = count_tokens(snippet)
+        if tokens > remaining:
+            if remaining < CONTEXT_MIN_SNIPPET_TOKENS:
+                continue
+            snippet = truncate_tokens(snippet, remaining)
+            tokens = remaining
+        snippets.append(snippet)
+        remaining -= tokens + 1  # newline separator
+        if remaining < CONTEXT_MIN_SNIPPET_TOKENS:
+            break
+    return "\n".join(snippets)
+
+async def retrieve_code_context(code: str, exclude_ids=()) -> str:
+    """
+    Prompt context for a text submission; see build_context.
+    """
+    similar = await retrieve_similar_code_async(code, top_k=CONTEXT_CANDIDATES, include_values=True)
+    with timed("context_build"):
+        return build_context(similar, code, exclude_ids)
+
+async def retrieve_file_context(code: str, chunks: list[CodeChunk], embeddings: list[list] | None = None, exclude_ids=()) -> str:
+    """
+    Prompt context for a chunked file stored under one of `exclude_ids`;
+    `embeddings` are its chunk vectors, if already computed.
+    """
+    # The file's own chunks are each other's nearest neighbours and would fill
+    # every per-chunk top-k, so they are filtered out in the index itself.
+    # Query without values, then fetch vectors only for the few candidate
+    # files that MMR compares.
+    filter = {"code_id": {"$nin": list(exclude_ids)}} if exclude_ids else None
+    similar = await retrieve_similar_files(
+        chunks, top_k=CONTEXT_CANDIDATES, per_chunk_k=CONTEXT_CANDIDATES, embeddings=embeddings, filter=filter
+    )
+    candidates = _context_candidates(similar, code, exclude_ids)
+    if len(candidates) > 1 and CONTEXT_MMR_LAMBDA < 1:
+        store = await connect_vector_store()
+        values = await store.fetch_values([match["vector_id"] for match in candidates])
+        for match in candidates:
+            match["values"] = values.get(match["vector_id"])
+    with timed("context_build"):
+        return build_context({"matches": candidates}, code, exclude_ids)
\ No newline at end of file
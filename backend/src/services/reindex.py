@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import random
+import asyncio
+from sqlalchemy import select, update, delete
+from .embedding import get_embeddings_async
+from .outbox import message_vector_id
+from .vector_store import VectorStore, connect_vector_store
+from ..db import AsyncSessionLocal
+from ..models.db_models import Message, EmbeddingOutbox
+from ..lib.helpers import logger
+
+REINDEX_PAGE_SIZE = 5000
+REINDEX_BATCH_SIZE = 256
+REINDEX_CONCURRENCY = 4
+REINDEX_RETRIES = 5
+UPSERT_CHUNK = 100
+
+
+class Checkpoint:
+    """
+    JSON progress file, replaced atomically so a crash never leaves it half
+    written. Holds a resume position per job.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.state = {}
+        if os.path.exists(path):
+            with open(path) as fh:
+                self.state = json.load(fh)
+
+    def get(self, key, default=None):
+        return self.state.get(key, default)
+
+    def save(self, **values):
+        self.state.update(values, updated_at=time.time())
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as fh:
+            json.dump(self.state, fh)
+        os.replace(tmp_path, self.path)
+
+
+async def _with_retries(label: str, func):
+    for attempt in range(1, REINDEX_RETRIES + 1):
+        try:
+            return await func()
+        except Exception as e:
+            if attempt == REINDEX_RETRIES:
+                raise
+            delay = random.uniform(0, min(60, 2 ** attempt))
+            logger.warning(f"{label} failed (attempt {attempt}/{REINDEX_RETRIES}): {e}; retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def _upsert(store: VectorStore, vectors: list):
+    for i in range(0, len(vectors), UPSERT_CHUNK):
+        await store.upsert(vectors[i:i + UPSERT_CHUNK])
+
+
+async def _index_message_batch(store: VectorStore, rows: list):
+    embeddings = await _with_retries("embedding batch", lambda: get_embeddings_async([row.text for row in rows], cache=False))
+    vectors = []
+    for row, embedding in zip(rows, embeddings):
+        metadata = {"message_id": row.id, "conversation_id": row.conversation_id, "user_id": row.user_id, "text": row.text}
+        metadata = {key: value for key, value in metadata.items() if value is not None}
+        vectors.append((message_vector_id(row.id), embedding, metadata))
+    await _with_retries("upsert batch", lambda: _upsert(store, vectors))
+
+    ids = [row.id for row in rows]
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            await session.execute(update(Message), [{"id": i, "pinecone_id": message_vector_id(i)} for i in ids])
+            await session.execute(delete(EmbeddingOutbox).where(EmbeddingOutbox.message_id.in_(ids)))
+
+
+async def reindex_messages(
+    checkpoint: Checkpoint,
+    page_size: int = REINDEX_PAGE_SIZE,
+    batch_size: int = REINDEX_BATCH_SIZE,
+    concurrency: int = REINDEX_CONCURRENCY,
+) -> int:
+    """
+    Re-embed and upsert every user message, in id order.
+
+    Rows are read in keyset pages (`id > last_id ORDER BY id LIMIT page_size`)
+    through a server-side cursor, so memory is bounded by the in-flight
+    batches rather than the table. Up to `concurrency` batches of
+    `batch_size` are embedded/upserted at once, and the checkpoint advances
+    to the end of each page once all of its batches are done, so a restart
+    resumes from the last completed page.
+
+    Returns: number of messages indexed in this run
+    """
+    store = await connect_vector_store()
+    last_id = checkpoint.get("messages_last_id", 0)
+    total = 0
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_batch(rows):
+        try:
+            await _index_message_batch(store, rows)
+        finally:
+            semaphore.release()
+
+    while True:
+        tasks = []
+        page_last_id = last_id
+        async with AsyncSessionLocal() as session:
+            query = (
+                select(Message.id, Message.text, Message.conversation_id, Message.user_id)
+                .where(Message.id > last_id, Message.role == "user")
+                .order_by(Message.id)
+                .limit(page_size)
+                .execution_options(yield_per=batch_size)
+            )
+            result = await session.stream(query)
+            async for rows in result.partitions(batch_size):
+                # backpressure: stop reading until a batch slot is free
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(run_batch(rows)))
+                page_last_id = rows[-1].id
+                total += len(rows)
+        if not tasks:
+            break
+        await asyncio.gather(*tasks)
+        last_id = page_last_id
+        checkpoint.save(messages_last_id=last_id)
+        rate = total / max(time.monotonic() - started, 1e-6)
+        logger.info(f"Re-indexed {total} messages (last id {last_id}, {rate:.0f}/s)")
+    return total
+
+
+async def reindex_code(
+    checkpoint: Checkpoint,
+    source: VectorStore,
+    batch_size: int = REINDEX_BATCH_SIZE,
+    concurrency: int = REINDEX_CONCURRENCY,
+) -> int:
+    """
+    Re-embed uploaded-code vectors. Their source text only lives in the
+    vector metadata (`code`), so they are read back from `source` (the old
+    index, or the current one for an in-place rebuild) and upserted to the
+    current store with their ids and metadata unchanged. Message vectors are
+    skipped; reindex_messages rebuilds those from Postgres.
+
+    Returns: number of code vectors indexed in this run
+    """
+    target = await connect_vector_store()
+    cursor = checkpoint.get("code_cursor")
+    if checkpoint.get("code_done"):
+        return 0
+    total = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_batch(items):
+        try:
+            embeddings = await _with_retries(
+                "embedding batch", lambda: get_embeddings_async([item["metadata"]["code"] for item in items], cache=False)
+            )
+            vectors = [(item["id"], embedding, item["metadata"]) for item, embedding in zip(items, embeddings)]
+            await _with_retries("upsert batch", lambda: _upsert(target, vectors))
+        finally:
+            semaphore.release()
+
+    while True:
+        # Scan pages are capped by the backend (100 for Pinecone); gather
+        # enough of them to keep `concurrency` embedding batches busy.
+        items = []
+        while len(items) < batch_size * concurrency:
+            page, cursor = await source.scan(cursor, limit=source.SCAN_PAGE_LIMIT)
+            items.extend(item for item in page if "code" in item["metadata"] and not item["id"].startswith("msg:"))
+            if cursor is None:
+                break
+        tasks = []
+        for i in range(0, len(items), batch_size):
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(run_batch(items[i:i + batch_size])))
+        await asyncio.gather(*tasks)
+        total += len(items)
+        if cursor is None:
+            checkpoint.save(code_cursor=None, code_done=True)
+            break
+        checkpoint.save(code_cursor=cursor)
+        logger.info(f"Re-indexed {total} code vectors")
+    return total
\ No newline at end of file
@@ -0,0 +1,138 @@
+import os
+import time
+import hashlib
+import numpy as np
+from .embedding import normalize_code
+from .openai import REVIEW_MODEL
+from .vector_store import connect_vector_store
+from ..lib.cache import TTLCache
+from ..lib.helpers import redis_client, logger
+from ..lib.metrics import record_cache
+
+REVIEW_CACHE_ENABLED = os.getenv("REVIEW_CACHE_ENABLED", "true").lower() == "true"
+REVIEW_CACHE_TTL = int(os.getenv("REVIEW_CACHE_TTL", str(7 * 24 * 3600)))
+REVIEW_CACHE_LOCAL_SIZE = int(os.getenv("REVIEW_CACHE_LOCAL_SIZE", "512"))
+# Minimum cosine similarity for a near-duplicate submission to reuse a review.
+# A near-duplicate review quotes someone else's code, so semantic reuse is
+# limited to the same signed-in user; anonymous requests only get exact hits.
+REVIEW_CACHE_SIMILARITY = float(os.getenv("REVIEW_CACHE_SIMILARITY", "0.97"))
+REVIEW_CACHE_NAMESPACE = "review-cache"
+
+CACHE_EXACT = "exact"
+CACHE_SEMANTIC = "semantic"
+CACHE_MISS = "miss"
+
+_local_cache = TTLCache(maxsize=REVIEW_CACHE_LOCAL_SIZE, ttl=REVIEW_CACHE_TTL)
+_stats = {CACHE_EXACT: 0, CACHE_SEMANTIC: 0, CACHE_MISS: 0, "errors": 0}
+
+
+def review_cache_key(code: str, model: str = REVIEW_MODEL) -> str:
+    digest = hashlib.sha256(f"{model}\0{normalize_code(code)}".encode("utf-8")).hexdigest()
+    return f"review:{digest}"
+
+
+def file_vector(embeddings: list[list]) -> list:
+    """
+    Single vector for a chunked file: the normalized mean of its chunk vectors.
+    """
+    mean = np.mean(np.asarray(embeddings, dtype=np.float32), axis=0)
+    norm = np.linalg.norm(mean)
+    return (mean / norm if norm else mean).tolist()
+
+
+def _semantic_id(key: str, user_id: str) -> str:
+    return f"{key}:{hashlib.sha256(user_id.encode('utf-8')).hexdigest()[:16]}"
+
+
+def review_cache_stats() -> dict:
+    total = _stats[CACHE_EXACT] + _stats[CACHE_SEMANTIC] + _stats[CACHE_MISS]
+    hits = _stats[CACHE_EXACT] + _stats[CACHE_SEMANTIC]
+    return {**_stats, "hit_ratio": hits / total if total else 0.0, "local": _local_cache.stats()}
+
+
+async def _load(key: str) -> str | None:
+    review = _local_cache.get(key)
+    if review is not None:
+        return review
+    try:
+        raw = await redis_client.get(key)
+    except Exception as e:
+        _stats["errors"] += 1
+        logger.warning(f"Redis error reading review cache: {e}")
+        return None
+    if raw is None:
+        return None
+    review = raw.decode("utf-8")
+    _local_cache.set(key, review)
+    return review
+
+
+async def get_cached_review(
+    code: str, embedding: list | None, user_id: str | None = None, model: str = REVIEW_MODEL
+) -> tuple[str | None, str]:
+    """
+    Look up a stored review, first by exact normalized-code hash, then by
+    nearest neighbour among the reviews stored for the same user and model.
+
+    Returns (review_or_None, cache_status) with status "exact", "semantic" or "miss".
+    """
+    if not REVIEW_CACHE_ENABLED:
+        return None, CACHE_MISS
+
+    key = review_cache_key(code, model)
+    review = await _load(key)
+    if review is not None:
+        _stats[CACHE_EXACT] += 1
+        record_cache("review", CACHE_EXACT)
+        return review, CACHE_EXACT
+
+    if embedding is not None and user_id:
+        try:
+            store = await connect_vector_store(REVIEW_CACHE_NAMESPACE)
+            result = await store.query(embedding, top_k=1, filter={"model": model, "user_id": user_id})
+            match = result["matches"][0] if result["matches"] else None
+            if match and match["score"] >= REVIEW_CACHE_SIMILARITY:
+                # The vector only points at the review; the review body lives
+                # under its exact key, so TTL and eviction are governed there.
+                review = await _load(match["metadata"].get("key", ""))
+                if review is not None:
+                    _stats[CACHE_SEMANTIC] += 1
+                    record_cache("review", CACHE_SEMANTIC)
+                    return review, CACHE_SEMANTIC
+                if match["metadata"].get("expires_at", 0) < time.time():
+                    await store.delete([match["id"]])
+        except Exception as e:
+            _stats["errors"] += 1
+            logger.warning(f"Semantic review cache lookup failed: {e}")
+
+    _stats[CACHE_MISS] += 1
+    record_cache("review", CACHE_MISS)
+    return None, CACHE_MISS
+
+
+async def store_cached_review(
+    code: str, embedding: list | None, review: str, user_id: str | None = None, model: str = REVIEW_MODEL
+):
+    """
+    Cache a freshly generated review under its exact key and, when a vector
+    and a user are available, index it for that user's semantic lookups.
+    """
+    if not REVIEW_CACHE_ENABLED:
+        return
+
+    key = review_cache_key(code, model)
+    _local_cache.set(key, review)
+    try:
+        await redis_client.setex(key, REVIEW_CACHE_TTL, review)
+    except Exception as e:
+        _stats["errors"] += 1
+        logger.warning(f"Redis error writing review cache: {e}")
+
+    if embedding is not None and user_id:
+        try:
+            store = await connect_vector_store(REVIEW_CACHE_NAMESPACE)
+            metadata = {"model": model, "user_id": user_id, "key": key, "expires_at": int(time.time()) + REVIEW_CACHE_TTL}
+            await store.upsert([(_semantic_id(key, user_id), embedding, metadata)])
+        except Exception as e:
+            _stats["errors"] += 1
+            logger.warning(f"Semantic review cache write failed: {e}")
\ No newline at end of file
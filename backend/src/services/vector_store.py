@@ -0,0 +1,440 @@
+import os
+import json
+import time
+import fcntl
+import threading
+import numpy as np
+from anyio import to_thread
+from ..lib.metrics import timed
+
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pinecone")
+# VECTOR_STORE=local is for development and single-process deployments: its
+# files can only be open in one process at a time, so run one API worker and
+# index messages in it (MESSAGE_INDEX_MODE=write_behind or inline) instead of
+# a separate outbox worker.
+LOCAL_VECTOR_STORE_PATH = os.getenv("LOCAL_VECTOR_STORE_PATH", "data/vectors")
+# Ids and metadata are also written out this often (on the next upsert), so a
+# crash loses at most this much of the index.
+LOCAL_VECTOR_STORE_FLUSH_SECONDS = float(os.getenv("LOCAL_VECTOR_STORE_FLUSH_SECONDS", "30"))
+# Setting the host skips the describe_index round-trip when connecting.
+PINECONE_INDEX_HOST = os.getenv("PINECONE_INDEX_HOST")
+
+# Point this at a freshly provisioned index to rebuild it (manage.py reindex)
+# without touching the one serving traffic.
+INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "code-review-index")
+INDEX_DIMENSION = 1536
+INDEX_SPEC = {
+    "serverless": {
+        "cloud": "aws",
+        "region": "us-east-1"
+    }
+}
+
+
+def _field(obj, name):
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+
+def _matches(actual, condition) -> bool:
+    if not isinstance(condition, dict):
+        return actual == condition
+    if "$ne" in condition:
+        return actual != condition["$ne"]
+    if "$nin" in condition:
+        return actual not in condition["$nin"]
+    raise ValueError(f"Unsupported metadata filter: {condition}")
+
+
+class VectorStore:
+    """
+    Interface for the vector index behind the RAG helpers.
+
+    Vectors are (id, values, metadata) tuples. `query` returns
+    {"matches": [{"id", "score", "metadata"[, "values"]}]} sorted by
+    descending cosine similarity; `filter` maps metadata keys to a value to
+    match, or to {"$ne": value} / {"$nin": [values]}. Each store is scoped to
+    one namespace.
+    """
+
+    async def upsert(self, vectors: list[tuple[str, list, dict]]):
+        raise NotImplementedError
+
+    async def query(self, vector: list, top_k: int = 5, include_values: bool = False, filter: dict | None = None) -> dict:
+        raise NotImplementedError
+
+    async def fetch_values(self, ids: list[str]) -> dict[str, list]:
+        """
+        Stored vectors by id; unknown ids are left out.
+        """
+        raise NotImplementedError
+
+    async def delete(self, ids: list[str]):
+        raise NotImplementedError
+
+    # Largest page `scan` returns; bigger limits are capped to it.
+    SCAN_PAGE_LIMIT = 100
+
+    async def scan(self, cursor: str | None = None, limit: int = 100) -> tuple[list[dict], str | None]:
+        """
+        Page through stored vectors: returns ([{"id", "metadata"}], next_cursor),
+        with next_cursor None after the last page. Pages hold at most
+        SCAN_PAGE_LIMIT vectors.
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """Persist pending state, if the backend keeps any."""
+
+    def close(self):
+        self.flush()
+
+
+class PineconeVectorStore(VectorStore):
+    """
+    Pinecone serverless index. The SDK is synchronous, so calls run in a
+    worker thread instead of on the event loop.
+    """
+
+    def __init__(self, index, namespace: str | None = None):
+        self.index = index
+        self.namespace = namespace
+        self._ns = {"namespace": namespace} if namespace else {}
+
+    async def upsert(self, vectors):
+        with timed("vector_upsert"):
+            await to_thread.run_sync(lambda: self.index.upsert(vectors, **self._ns))
+
+    async def query(self, vector, top_k=5, include_values=False, filter=None):
+        kwargs = dict(self._ns)
+        if filter:
+            kwargs["filter"] = {key: value if isinstance(value, dict) else {"$eq": value} for key, value in filter.items()}
+        with timed("vector_query"):
+            result = await to_thread.run_sync(
+                lambda: self.index.query(vector=vector, top_k=top_k, include_metadata=True, include_values=include_values, **kwargs)
+            )
+        matches = []
+        for match in _field(result, "matches") or []:
+            item = {"id": _field(match, "id"), "score": _field(match, "score"), "metadata": _field(match, "metadata") or {}}
+            if include_values:
+                item["values"] = _field(match, "values")
+            matches.append(item)
+        return {"matches": matches}
+
+    async def fetch_values(self, ids):
+        if not ids:
+            return {}
+        fetched = await to_thread.run_sync(lambda: _field(self.index.fetch(ids=ids, **self._ns), "vectors") or {})
+        return {vector_id: list(_field(vector, "values")) for vector_id, vector in fetched.items()}
+
+    async def delete(self, ids):
+        await to_thread.run_sync(lambda: self.index.delete(ids=ids, **self._ns))
+
+    async def scan(self, cursor=None, limit=100):
+        def page():
+            # list_paginated pages are capped at 100 ids
+            kwargs = dict(self._ns, limit=min(limit, self.SCAN_PAGE_LIMIT))
+            if cursor:
+                kwargs["pagination_token"] = cursor
+            listed = self.index.list_paginated(**kwargs)
+            ids = [_field(v, "id") for v in _field(listed, "vectors") or []]
+            pagination = _field(listed, "pagination")
+            next_cursor = _field(pagination, "next") if pagination else None
+            if not ids:
+                return [], next_cursor
+            fetched = _field(self.index.fetch(ids=ids, **self._ns), "vectors") or {}
+            items = [{"id": vid, "metadata": _field(fetched[vid], "metadata") or {}} for vid in ids if vid in fetched]
+            return items, next_cursor
+
+        return await to_thread.run_sync(page)
+
+
+class LocalVectorStoreLocked(RuntimeError):
+    pass
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process index: a float32 matrix of L2-normalized vectors in a
+    memory-mapped file, so cosine top-k is one matrix-vector product plus an
+    argpartition. Ids and metadata live in a JSON sidecar written on flush()
+    and every LOCAL_VECTOR_STORE_FLUSH_SECONDS.
+
+    Files: <path>.vectors (raw float32, grown by doubling), <path>.meta.json
+    and <path>.lock; each namespace gets its own set. Every process keeps
+    its own ids and appends rows at its own end of the file, so an exclusive
+    lock on <path>.lock keeps a second process from opening the same store.
+    """
+
+    INITIAL_CAPACITY = 1024
+    SCAN_PAGE_LIMIT = 1000
+
+    def __init__(self, path: str = LOCAL_VECTOR_STORE_PATH, dimension: int = INDEX_DIMENSION):
+        self.path = path
+        self.dimension = dimension
+        self._lock = threading.Lock()
+        self._vectors_path = f"{path}.vectors"
+        self._meta_path = f"{path}.meta.json"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock_file = open(f"{path}.lock", "a+")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise LocalVectorStoreLocked(
+                f"Local vector store at {path} is open in another process. VECTOR_STORE=local "
+                "supports a single process; use one worker or VECTOR_STORE=pinecone."
+            )
+        self._flushed_at = time.monotonic()
+        self.ids: list[str] = []
+        self.metadata: list[dict] = []
+        if os.path.exists(self._meta_path) and os.path.exists(self._vectors_path):
+            with open(self._meta_path) as fh:
+                state = json.load(fh)
+            if state["dimension"] != dimension:
+                raise ValueError(f"Local vector store at {path} has dimension {state['dimension']}, expected {dimension}")
+            self.ids = state["ids"]
+            self.metadata = state["metadata"]
+            capacity = max(os.path.getsize(self._vectors_path) // (4 * dimension), self.INITIAL_CAPACITY)
+        else:
+            capacity = self.INITIAL_CAPACITY
+        self._map(capacity)
+        self._rows = {vector_id: row for row, vector_id in enumerate(self.ids)}
+
+    def _map(self, capacity: int):
+        size = capacity * self.dimension * 4
+        with open(self._vectors_path, "a+b") as fh:
+            if os.path.getsize(self._vectors_path) < size:
+                fh.truncate(size)
+        self.capacity = capacity
+        self.matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dimension))
+
+    def _normalize(self, values) -> np.ndarray:
+        vec = np.asarray(values, dtype=np.float32)
+        if vec.shape != (self.dimension,):
+            raise ValueError(f"Vector dimension {vec.shape} does not match index dimension {self.dimension}")
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def upsert_sync(self, vectors):
+        with self._lock:
+            for vector_id, values, metadata in vectors:
+                row = self._rows.get(vector_id)
+                if row is None:
+                    row = len(self.ids)
+                    if row >= self.capacity:
+                        self.matrix.flush()
+                        self._map(self.capacity * 2)
+                    self.ids.append(vector_id)
+                    self.metadata.append(metadata or {})
+                    self._rows[vector_id] = row
+                else:
+                    self.metadata[row] = metadata or {}
+                self.matrix[row] = self._normalize(values)
+            if time.monotonic() - self._flushed_at >= LOCAL_VECTOR_STORE_FLUSH_SECONDS:
+                self._flush_locked()
+
+    def query_sync(self, vector, top_k=5, include_values=False, filter=None):
+        with self._lock:
+            count = len(self.ids)
+            if not count or top_k <= 0:
+                return {"matches": []}
+            query = self._normalize(vector)
+            if filter:
+                rows = np.array([
+                    row for row, metadata in enumerate(self.metadata)
+                    if all(_matches(metadata.get(key), value) for key, value in filter.items())
+                ], dtype=np.int64)
+                if not len(rows):
+                    return {"matches": []}
+                scores = np.empty(count, dtype=np.float32)
+                scores[rows] = self.matrix[rows] @ query
+            else:
+                # a slice is a view of the memmap; fancy indexing would copy it
+                rows = np.arange(count)
+                scores = self.matrix[:count] @ query
+            k = min(top_k, len(rows))
+            top = rows[np.argpartition(-scores[rows], k - 1)[:k]]
+            top = top[np.argsort(-scores[top])]
+            matches = []
+            for row in top:
+                item = {"id": self.ids[row], "score": float(scores[row]), "metadata": self.metadata[row]}
+                if include_values:
+                    item["values"] = self.matrix[row].tolist()
+                matches.append(item)
+            return {"matches": matches}
+
+    def fetch_values_sync(self, ids):
+        with self._lock:
+            return {vector_id: self.matrix[self._rows[vector_id]].tolist() for vector_id in ids if vector_id in self._rows}
+
+    def delete_sync(self, ids):
+        with self._lock:
+            for vector_id in ids:
+                row = self._rows.pop(vector_id, None)
+                if row is None:
+                    continue
+                # move the last row into the hole to keep the matrix dense
+                last = len(self.ids) - 1
+                if row != last:
+                    self.matrix[row] = self.matrix[last]
+                    self.ids[row] = self.ids[last]
+                    self.metadata[row] = self.metadata[last]
+                    self._rows[self.ids[row]] = row
+                self.ids.pop()
+                self.metadata.pop()
+
+    # A query is a scan of the whole matrix (milliseconds at a few thousand
+    # vectors, hundreds at 50k) and upserts may remap the file, so both run in
+    # a worker thread; numpy releases the GIL for the matrix product.
+    async def upsert(self, vectors):
+        with timed("vector_upsert"):
+            await to_thread.run_sync(self.upsert_sync, vectors)
+
+    async def query(self, vector, top_k=5, include_values=False, filter=None):
+        with timed("vector_query"):
+            return await to_thread.run_sync(self.query_sync, vector, top_k, include_values, filter)
+
+    async def fetch_values(self, ids):
+        return await to_thread.run_sync(self.fetch_values_sync, ids)
+
+    async def delete(self, ids):
+        await to_thread.run_sync(self.delete_sync, ids)
+
+    async def scan(self, cursor=None, limit=100):
+        # cursor is a row offset; rows only move on delete (swap-with-last),
+        # so don't delete while scanning
+        start = int(cursor or 0)
+        with self._lock:
+            end = min(start + min(limit, self.SCAN_PAGE_LIMIT), len(self.ids))
+            items = [{"id": self.ids[row], "metadata": self.metadata[row]} for row in range(start, end)]
+        return items, (str(end) if end < len(self.ids) else None)
+
+    def _flush_locked(self):
+        self.matrix.flush()
+        tmp_path = f"{self._meta_path}.tmp"
+        with open(tmp_path, "w") as fh:
+            json.dump({"dimension": self.dimension, "ids": self.ids, "metadata": self.metadata}, fh)
+        os.replace(tmp_path, self._meta_path)
+        self._flushed_at = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        """
+        Flush and release the file lock so another process can open the store.
+        """
+        self.flush()
+        self._lock_file.close()
+
+
+class IndexDimensionMismatch(RuntimeError):
+    pass
+
+
+def provision_index(backend: str = VECTOR_STORE, recreate: bool = False):
+    """
+    Create the index if it does not exist. Run this as an explicit deploy
+    step (`python manage.py provision-index`), never from request workers.
+
+    An existing index with the wrong dimension is an error: dropping it
+    would orphan every stored pinecone_id, so it is only recreated when
+    `recreate` is passed explicitly.
+    """
+    if backend == "local":
+        LocalVectorStore(LOCAL_VECTOR_STORE_PATH, INDEX_DIMENSION).close()
+        return
+    if backend != "pinecone":
+        raise ValueError(f"Unknown VECTOR_STORE backend: {backend}")
+
+    from pinecone import Pinecone # type: ignore
+
+    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    if INDEX_NAME in pc.list_indexes().names():
+        index_info = pc.describe_index(INDEX_NAME)
+        if index_info.dimension == INDEX_DIMENSION:
+            return
+        if not recreate:
+            raise IndexDimensionMismatch(
+                f"Index {INDEX_NAME} has dimension {index_info.dimension}, expected {INDEX_DIMENSION}"
+            )
+        pc.delete_index(INDEX_NAME)
+    pc.create_index(name=INDEX_NAME, dimension=INDEX_DIMENSION, metric="cosine", spec=INDEX_SPEC)
+
+
+def _local_path(namespace: str | None, path: str | None = None) -> str:
+    path = path or LOCAL_VECTOR_STORE_PATH
+    return f"{path}.{namespace}" if namespace else path
+
+
+_pinecone_index = None
+
+
+def create_vector_store(backend: str = VECTOR_STORE, namespace: str | None = None, index_name: str | None = None) -> VectorStore:
+    """
+    Connect to the vector store selected by VECTOR_STORE ("pinecone" or "local").
+    Does not create or modify the index; see provision_index.
+
+    `index_name` connects to a different index (Pinecone) or file path
+    (local) than the shared one, e.g. the source of a re-index.
+    """
+    global _pinecone_index
+    if index_name is not None:
+        if backend == "pinecone":
+            from pinecone import Pinecone # type: ignore
+
+            return PineconeVectorStore(Pinecone(api_key=os.getenv("PINECONE_API_KEY")).Index(index_name), namespace)
+        if backend == "local":
+            return LocalVectorStore(_local_path(namespace, index_name), INDEX_DIMENSION)
+    if backend == "pinecone":
+        if _pinecone_index is None:
+            from pinecone import Pinecone # type: ignore
+
+            pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+            if PINECONE_INDEX_HOST:
+                _pinecone_index = pc.Index(host=PINECONE_INDEX_HOST)
+            else:
+                _pinecone_index = pc.Index(INDEX_NAME)
+        return PineconeVectorStore(_pinecone_index, namespace)
+    if backend == "local":
+        return LocalVectorStore(_local_path(namespace), INDEX_DIMENSION)
+    raise ValueError(f"Unknown VECTOR_STORE backend: {backend}")
+
+
+_vector_stores: dict[str | None, VectorStore] = {}
+_vector_store_lock = threading.Lock()
+
+
+def get_vector_store(namespace: str | None = None) -> VectorStore:
+    """
+    Shared, lazily connected vector store for this process. The first call
+    connects; nothing touches the network at import time.
+    """
+    store = _vector_stores.get(namespace)
+    if store is None:
+        with _vector_store_lock:
+            store = _vector_stores.get(namespace)
+            if store is None:
+                store = _vector_stores[namespace] = create_vector_store(namespace=namespace)
+    return store
+
+
+async def connect_vector_store(namespace: str | None = None) -> VectorStore:
+    """
+    Connect from async code without blocking the event loop (connecting to
+    Pinecone by name does a describe_index round-trip).
+    """
+    store = _vector_stores.get(namespace)
+    if store is not None:
+        return store
+    return await to_thread.run_sync(get_vector_store, namespace)
+
+
+def close_vector_store():
+    global _pinecone_index
+    with _vector_store_lock:
+        for store in _vector_stores.values():
+            store.close()
+        _vector_stores.clear()
+        _pinecone_index = None
\ No newline at end of file